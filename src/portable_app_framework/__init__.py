@@ -1,26 +1,44 @@
+from __future__ import annotations
+
 import argparse
-import importlib
+import copy
+import multiprocessing
 import os
 import shutil
-
-import inquirer
-import pandas as pd
-import yaml
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING
 
 from .utils.logger import logger
-from .utils.util import load_file
-from .utils.util_brick import parse_raw_query
-from .utils.util_qualify import BasicValidationInterface
-from .utils.util_qualify import BuildingMotifValidationInterface
+from .utils.util_app import APP_REGISTRY, AppCatalog, get_app_catalog, invalidate_app_catalog
+from .utils.util_metrics import instrument, measure_stage
+
+# the heavy dependencies (pandas, rdflib, pyshacl, buildingmotif, inquirer) are imported on first use, so that the
+# package import and the CLI stay fast
+if TYPE_CHECKING:
+    import pandas as pd
+    from rdflib import Graph
+
+    from .utils.util_cache import PreprocessCache, QualifyCache
+    from .utils.util_metrics import ApplicationStats
+    from .utils.util_profile import AppProfiler
+    from .utils.util_remap import RemapIndex
 
-# create app folder if not exists
 MODULE_BASEPATH = os.path.dirname(__file__)
 USER_BASEPATH = os.getcwd()
+# the app folder is not created at import, see cli_new_app
 APP_FOLDER = os.path.join(USER_BASEPATH, 'app')
+# default of the arguments falling back to the parameters of config.yaml (None is a valid value)
+_DEFAULT = object()
 
-if not os.path.exists(APP_FOLDER):
-    os.makedirs(APP_FOLDER, exist_ok=True)
-    logger.info(f'Created app folder in {APP_FOLDER}')
+
+def list_app_names(app_folder: str = APP_FOLDER) -> list:
+    """
+    List the apps in the app folder
+    :param app_folder: The app folder
+    :return: list of the app names (folders starting with app), empty if the app folder does not exist
+    """
+    return get_app_catalog(app_folder).names()
 
 
 class Application:
@@ -28,16 +46,30 @@ class Application:
     Application class
     """
 
-    def __init__(self, metadata=None, app_name=None, base_path=None):
+    def __init__(self, metadata=None, app_name=None, base_path=None, catalog: AppCatalog = None,
+                 stats: ApplicationStats = None, profiler: AppProfiler = None):
         # Class specific logger
         self.logger = logger
+        # per-stage metrics (see utils/util_metrics.py), disabled if None
+        self.stats = stats
+        # profiler of preprocess_fn and analyze_fn (see utils/util_profile.py), disabled if None
+        self.profiler = profiler
         # The graph_path and datasource are external to the configuration file.
         self.metadata = metadata
         self.app_name = app_name
         self.res_qualify = None
+        self.res_qualify_report = None
         self.res_fetch = None
+        self.res_fetch_units = None
+        # conversion plan compiled from the units of the last fetch
+        self._conversion_plan = None
+        # compiled remap index of the last mapping (mapping, index)
+        self._remap_index = (None, None)
         self.res_preprocess = None
         self.res_analyze = None
+        self.incremental_validation = None
+        # functions of the app modules (module, function) -> callable
+        self._functions = {}
 
         # Resolve the app folder based on provided base_path or default
         if base_path:
@@ -55,32 +87,22 @@ class Application:
         └── query.rq
         '''
 
-        # Class variable to store available app names
-        available_app = os.listdir(self.app_folder)  # Add your app names here
-        # get only directories that start with app
-        available_app_names = [app for app in available_app if app.startswith('app')]
+        # the app definitions are loaded once per app folder and validated by the catalog
+        catalog = catalog if catalog is not None else get_app_catalog(self.app_folder)
 
         # Log if no apps are found in the resolved path
-        if not available_app_names:
-            self.logger.warning(f'No apps found in {self.app_folder}. Check if the base_path is correct.')
-
-        if app_name not in available_app_names:
-            raise ValueError(f"Invalid app name. Available app names: {available_app_names}")
-
-        if not os.path.exists(os.path.join(self.app_folder, app_name, 'config.yaml')):
-            raise FileNotFoundError('config.yaml not found')
-        elif not os.path.exists(os.path.join(self.app_folder, app_name, 'manifest.ttl')):
-            raise FileNotFoundError('manifest.ttl not found')
-        elif not os.path.exists(os.path.join(self.app_folder, app_name, 'query.rq')):
-            raise FileNotFoundError('query.rq not found')
-        else:
-            config_file = load_file(os.path.join(self.app_folder, app_name, 'config.yaml'), yaml_type=True)
-            self.details = config_file['details']
-            self.parameters = config_file['parameters']
-            self.manifest = os.path.join(self.app_folder, app_name, 'manifest.ttl')
-            self.query = load_file(os.path.join(self.app_folder, app_name, 'query.rq'))
-
-    def qualify(self) -> bool:
+        if not catalog.names():
+            self.logger.warning('No apps found in %s. Check if the base_path is correct.', self.app_folder)
+
+        definition = catalog.get(app_name)
+        # the definition is shared by the apps of the catalog: nested values must not be modified in place
+        self.details = copy.deepcopy(dict(definition.details))
+        self.parameters = copy.deepcopy(dict(definition.parameters))
+        self.manifest = definition.manifest
+        self.query = definition.query
+
+    @instrument('qualify')
+    def qualify(self, incremental: bool = False, cache: QualifyCache = None) -> bool:
         """
         The "qualify" component defines the metadata and data requirements of an application.
 
@@ -89,108 +111,518 @@ class Application:
         (2) validation of the metadata against the specific constraints through BuildingMOTIF
 
         The output of the "qualify" component is a boolean value indicating whether the metadata meets the requirements.
+        The ValidationReport of both steps (see utils/util_report.py) is stored in res_qualify_report.
+        :param incremental: If True remember the validated graph and, on the next calls, validate only what changed
+        (see IncrementalValidationInterface)
+        :param cache: Optional on-disk cache of the results. On a cache hit the validation is skipped entirely
         :return: bool indicating whether the requirements are satisfied or not
         """
-        self.logger.debug(f'Validating the ttl file on manifest.ttl')
+        from .utils.util_qualify import BasicValidationInterface
+        from .utils.util_qualify import BuildingMotifValidationInterface
+        from .utils.util_qualify import IncrementalValidationInterface
+        from .utils.util_report import MAX_STORED_RESULTS, ValidationReport
+
+        self.logger.debug('Validating the ttl file on manifest.ttl')
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.key(self.metadata, self.manifest, mode='incremental' if incremental else 'full')
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.logger.debug('Qualify result found in cache %s', cache_key)
+                self.res_qualify = cached['valid']
+                report = cached['report']
+                # the entries written before the structured reports store the text
+                self.res_qualify_report = ValidationReport.from_dict(report) if isinstance(report, dict) else report
+                return self.res_qualify
+
         # by default it is not valid
         is_valid = False
+        report = ValidationReport()
+        start = time.perf_counter()
         try:
-            basic_validation = BasicValidationInterface(
-                graph=self.metadata
-            )
-            res_basic_validation = basic_validation.validate()
-
-            building_motif_validation = BuildingMotifValidationInterface(
-                graph=self.metadata,
-                app_name=self.app_name,
-            )
-            res_building_motif_validation = building_motif_validation.validate()
-            # is at least one of the two validation valid?
-            is_valid = all([res_basic_validation, res_building_motif_validation])
+            if incremental:
+                # the interface is kept on the app to remember the last validated graph
+                if self.incremental_validation is None:
+                    self.incremental_validation = IncrementalValidationInterface(manifest=self.manifest)
+                is_valid = self.incremental_validation.validate(self.metadata)
+                report = self.incremental_validation.report
+            else:
+                basic_validation = BasicValidationInterface(
+                    graph=self.metadata
+                )
+                with measure_stage(self, 'qualify.basic'):
+                    res_basic_validation = basic_validation.validate()
+
+                building_motif_validation = BuildingMotifValidationInterface(
+                    graph=self.metadata,
+                    app_name=self.app_name,
+                    manifest=self.manifest,
+                )
+                with measure_stage(self, 'qualify.building_motif'):
+                    res_building_motif_validation = building_motif_validation.validate()
+                # is at least one of the two validation valid?
+                is_valid = all([res_basic_validation, res_building_motif_validation])
+                report = ValidationReport.combine(basic_validation.report, building_motif_validation.report)
 
         except Exception as e:
             # If some exception the valid is still false
-            self.logger.error(f'Error during the validation of the manifest: {e}')
+            self.logger.error('Error during the validation of the manifest: %s', e)
+            report = ValidationReport(errors=[f'Error during the validation of the manifest: {e}'])
+            # do not cache failures that may be transient
+            cache_key = None
+
+        if cache_key is not None:
+            cache.put(cache_key, is_valid, report=report.to_dict(max_results=MAX_STORED_RESULTS),
+                      elapsed=time.perf_counter() - start)
 
         self.res_qualify = is_valid
+        self.res_qualify_report = report
         return is_valid
 
-    def fetch(self) -> dict:
+    @instrument('fetch')
+    def fetch(self, init_bindings: dict = None, output: str = 'dict', with_units: bool = False):
         """
         The fetch component performs the retrival of the metadata based on the sparql query.
         This method returns the mapping convention between the internal naming convention (i.e., naming convention
         defined in the SPARQL query) an the external naming convention (i.e., naming convention used in the building)
 
-        :return dict: mapping between internal and external naming convention
+        :param init_bindings: Optional initial bindings of the query variables (e.g. {'ahu': URIRef(...)}) to scope
+        the query without rewriting it
+        :param output: The format of the returned mapping: 'dict' ({i: {var: name}}), 'columns' ({var: [names]}) or
+        'dataframe'. res_fetch (used by remap, load and convert) always stores the dict
+        :param with_units: If True return also the unit and datatype of the points (brick:hasUnit, brick:value),
+        retrieved with one additional query over the graph
+        :return dict: mapping between internal and external naming convention, or tuple (mapping, units) with units
+        {name: {'unit': ..., 'datatype': ...}} if with_units is True
         """
-        self.logger.debug(f'Fetching metadata based on sparql query')
+        from rdflib import URIRef
+
+        from .utils.util_brick import POINT_METADATA_QUERY, columns_to_mapping, parse_point_metadata, parse_raw_query
+        from .utils.util_brick import TermResolver, prepare_query
+
+        self.logger.debug('Fetching metadata based on sparql query')
+        try:
+            # the query is parsed once per process and reused on every graph
+            query = prepare_query(self.query)
+        except Exception as e:
+            # e.g., prefixes bound only in the graph namespace manager: let rdflib resolve them on the graph
+            self.logger.debug('Unable to prepare the query, running it as text: %s', e)
+            query = self.query
         # Perform query on rdf graph
-        query_results = self.metadata.query(self.query)
+        query_results = self.metadata.query(query, initBindings=init_bindings)
+        # the local names follow the prefixes bound in the graph
+        resolver = TermResolver(self.metadata.namespace_manager)
         # Convert the query results to the desired JSON format
-        int_to_ext = parse_raw_query(query_results)
+        if output == 'dict':
+            int_to_ext = parse_raw_query(query_results, output='dict', resolver=resolver)
+            fetch_map_dict = int_to_ext
+        else:
+            # the bindings are parsed once, the components downstream use the dict
+            int_to_ext = parse_raw_query(query_results, output='columns', resolver=resolver)
+            fetch_map_dict = columns_to_mapping(int_to_ext)
+            if output == 'dataframe':
+                import pandas as pd
+                int_to_ext = pd.DataFrame(int_to_ext, columns=list(int_to_ext))
+            elif output != 'columns':
+                raise ValueError(f"Invalid output {output}. Please choose between dict, columns or dataframe")
         # save internal external naming convention to class
-        self.res_fetch = int_to_ext
-        # return mapping
-        return int_to_ext
+        self.res_fetch = fetch_map_dict
+        self._conversion_plan = None
+
+        if not with_units:
+            # return mapping
+            return int_to_ext
+
+        # the units are joined by the full URI: points in different namespaces may share the local name
+        points = {value for binding in query_results.bindings for value in binding.values()
+                  if isinstance(value, URIRef)}
+        units = parse_point_metadata(self.metadata.query(prepare_query(POINT_METADATA_QUERY)), points=points,
+                                     resolver=resolver)
+        self.res_fetch_units = units
+        return int_to_ext, units
+
+    def convert(self, data: pd.DataFrame, targets: dict = None, binding: int = None,
+                inplace: bool = False) -> pd.DataFrame:
+        """
+        The convert component converts the columns of the remapped data (internal names) to the target units, using the
+        units of the points of the last fetch(with_units=True) with the default output, in a single vectorized step
+        (see ConversionPlan).
+        :param data: The dataframe with the internal names
+        :param targets: dict internal name -> target unit, by default the units parameter of config.yaml, and the base
+        unit of each quantity (e.g., DEG_C, PA, W) for the columns without a target
+        :param binding: Optional position of the binding of the data when the fetch returned several bindings
+        :param inplace: If True convert the columns of data, otherwise return a new dataframe
+        :return: The converted dataframe
+        """
+        from .utils.util_preprocess import ConversionPlan
+
+        if self.res_fetch_units is None:
+            self.logger.error('Units not available. Please call fetch(with_units=True) first')
+            return data
 
-    def remap(self, data: pd.DataFrame, fetch_map_dict: dict, mode=None) -> pd.DataFrame:
+        if targets is None and self._conversion_plan is not None:
+            # the default plan is compiled once per fetch
+            plan = self._conversion_plan
+        else:
+            plan = ConversionPlan(self.res_fetch_units, self.get_remap_index(self.res_fetch),
+                                  targets=targets if targets is not None else self.parameters.get('units'))
+            for name, reason in plan.skipped.items():
+                self.logger.warning('Column %s not converted: %s', name, reason)
+            if targets is None:
+                self._conversion_plan = plan
+        return plan.apply(data, binding=binding, inplace=inplace)
+
+    def get_remap_index(self, fetch_map_dict) -> RemapIndex:
+        """
+        Get the remap index of a mapping, compiled once per mapping and reused on every call
+        :param fetch_map_dict: The mapping, either the fetch result {i: {var: name}}, a flat {var: name} or a RemapIndex
+        :return: The remap index
+        """
+        from .utils.util_remap import RemapIndex
+
+        if isinstance(fetch_map_dict, RemapIndex):
+            return fetch_map_dict
+        if self._remap_index[0] is not fetch_map_dict:
+            self._remap_index = (fetch_map_dict, RemapIndex(fetch_map_dict))
+        return self._remap_index[1]
+
+    @instrument('remap')
+    def remap(self, data: pd.DataFrame, fetch_map_dict, mode=None, binding: int = None,
+              inplace: bool = False) -> pd.DataFrame:
         """
         The internal_external_mapping component performs the actual mapping of the internal data to the external data
         :param data: The dataframe to be mapped
-        :param fetch_map_dict: The mapping dictionary with key-value pairs
+        :param fetch_map_dict: The mapping, either the fetch result {i: {var: name}}, a flat {var: name} or a RemapIndex
         :param mode: The mode of the mapping (to_internal or to_external)
+        :param binding: Optional position of the binding to use when the fetch returned several bindings
+        :param inplace: If True rename the columns of data, otherwise return a shallow copy sharing the data
         :return: The mapped dataframe
         """
+        if mode not in ("to_external", "to_internal"):
+            self.logger.error('Invalid mode %s. Please choose between to_external or to_internal', mode)
+            return data
 
-        dict_to_external = fetch_map_dict
-        dict_to_internal = {v: k for k, v in fetch_map_dict.items()}
-
-        if mode == "to_external":
-            # rename dataframe to external naming convention
-            data = data.rename(columns=dict_to_external)
-        elif mode == "to_internal":
-            # rename dataframe to internal naming convention
-            data = data.rename(columns=dict_to_internal)
-        else:
-            self.logger.error(f'Invalid mode {mode}. Please choose between to_external or to_internal')
+        remap_index = self.get_remap_index(fetch_map_dict)
+        data = remap_index.rename(data, mode=mode, binding=binding, inplace=inplace)
+        if remap_index.unmapped:
+            self.logger.debug('Columns without mapping: %s', remap_index.unmapped)
 
         return data
 
-    def preprocess(self, *args, **kwargs):
+    def load(self, path: str, fetch_map_dict=None, binding: int = None, time_column: str = None, time_from=_DEFAULT,
+             time_to=_DEFAULT) -> pd.DataFrame:
         """
-        The purpose of this component is to perform the actual analysis of the data.
+        The load component reads only the data of the points required by the app (i.e., the external names of the
+        fetch mapping) and returns them with the internal naming convention.
+        The time range defaults to the time_from and time_to parameters of config.yaml and is pushed down to the
+        parquet reader (see utils/util_data.py).
+        :param path: The path to a csv/parquet file or to a folder of csv/parquet files
+        :param fetch_map_dict: The mapping, by default the result of the last fetch (the query is run if needed)
+        :param binding: Optional position of the binding to load, by default the points of all the bindings
+        :param time_column: The name of the time column, by default the first column (csv) or the index (parquet)
+        :param time_from: Lower bound of the time range (included), by default parameters.time_from. None for no bound
+        :param time_to: Upper bound of the time range (included), by default parameters.time_to. None for no bound
+        :return: The dataframe with the internal column names
+        """
+        from .utils.util_data import load_data
+
+        if fetch_map_dict is None:
+            fetch_map_dict = self.res_fetch if self.res_fetch is not None else self.fetch()
+        if time_from is _DEFAULT:
+            time_from = self.parameters.get('time_from')
+        if time_to is _DEFAULT:
+            time_to = self.parameters.get('time_to')
+
+        self.logger.debug('Loading data from %s', path)
+        return load_data(path, self.get_remap_index(fetch_map_dict), binding=binding, time_column=time_column,
+                         time_from=time_from, time_to=time_to)
+
+    def _load_function(self, module_name: str, function_name: str):
+        """
+        Get a function defined in a module of the app. The module is imported once from the app folder and the
+        function is bound to the application, see reload to pick up the changes of the source files
+        :param module_name: The name of the module (preprocess or analyze)
+        :param function_name: The name of the function
+        :return: The function or None if it is not defined
+        """
+        key = (module_name, function_name)
+        try:
+            return self._functions[key]
+        except KeyError:
+            function = APP_REGISTRY.get_function(self.path_to_app, module_name, function_name)
+            self._functions[key] = function
+            return function
+
+    def reload(self) -> list:
+        """
+        Reload the modules of the app whose source file changed since they were imported
+        :return: list of the paths of the reloaded modules
+        """
+        reloaded = APP_REGISTRY.reload(self.path_to_app)
+        self._functions = {}
+        return reloaded
+
+    def _call_app_function(self, stage: str, function, args: tuple, kwargs: dict):
+        """
+        Call a function of the app, under the profiler if enabled
+        :param stage: The name of the stage (preprocess or analyze)
+        :param function: The function of the app
+        :param args: The positional arguments of the function
+        :param kwargs: The keyword arguments of the function
+        :return: The result of the function
         """
-        # Dynamically import the analyze module
-        preprocess_module = importlib.import_module(f"app.{self.app_name}.preprocess", package=__name__)
+        if self.profiler is None:
+            return function(*args, **kwargs)
+        return self.profiler.run(self.app_name, stage, function, *args, **kwargs)
 
-        # Get the function object from the module
-        preprocess_fn = getattr(preprocess_module, "preprocess_fn", None)
+    @instrument('preprocess')
+    def preprocess(self, *args, cache: PreprocessCache = None, **kwargs):
+        """
+        The purpose of this component is to perform the actual analysis of the data.
+        :param cache: Optional on-disk cache of the results keyed by the preprocess source, the input data and the
+        parameters. On a cache hit the cached dataframe is memory-mapped instead of calling preprocess_fn
+        """
+        preprocess_fn = self._load_function("preprocess", "preprocess_fn")
+
+        if preprocess_fn is not None:
+            cache_key = None
+            if cache is not None:
+                try:
+                    cache_key = cache.key(preprocess_fn, args, kwargs, self.parameters)
+                except TypeError as e:
+                    self.logger.debug('Preprocess result not cached: %s', e)
+            if cache_key is not None:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    self.logger.debug('Preprocess result found in cache %s', cache_key)
+                    self.res_preprocess = cached
+                    return self.res_preprocess
 
-        if preprocess_fn is not None and callable(preprocess_fn):
             # Call the function with the provided arguments
-            self.res_preprocess = preprocess_fn(*args, **kwargs)
+            self.res_preprocess = self._call_app_function('preprocess', preprocess_fn, args, kwargs)
+            if cache_key is not None:
+                cache.put(cache_key, self.res_preprocess)
             return self.res_preprocess
         else:
-            self.logger.error(f"Function {preprocess_fn} not found in analyze module.")
+            self.logger.error("Function preprocess_fn not found in preprocess module.")
             return None
 
+    @instrument('analyze')
     def analyze(self, *args, **kwargs):
         """
         The purpose of this component is to perform the actual analysis of the data.
         """
-        # Dynamically import the analyze module
-        analyze_module = importlib.import_module(f"app.{self.app_name}.analyze", package=__name__)
-
-        # Get the function object from the module
-        analyze_fn = getattr(analyze_module, "analyze_fn", None)
+        analyze_fn = self._load_function("analyze", "analyze_fn")
 
-        if analyze_fn is not None and callable(analyze_fn):
+        if analyze_fn is not None:
             # Call the function with the provided arguments
-            self.res_analyze = analyze_fn(*args, **kwargs)
+            self.res_analyze = self._call_app_function('analyze', analyze_fn, args, kwargs)
             return self.res_analyze
         else:
-            self.logger.error(f"Function {analyze_fn} not found in analyze module.")
+            self.logger.error("Function analyze_fn not found in analyze module.")
+            return None
+
+    def preprocess_stream(self, chunks, *args, window=None, overlap=None, cache: PreprocessCache = None, **kwargs):
+        """
+        Streaming version of preprocess: preprocess is called on each chunk of data (so that the profiler, the stage
+        metrics and the cache see each chunk) and the results are yielded one by one, so that the peak memory is
+        bounded by the chunk size. res_preprocess holds the last preprocessed chunk.
+
+        example:
+        chunks = pd.read_csv('data.csv', index_col=0, parse_dates=True, chunksize=100_000)
+        for df_preprocess in app.preprocess_stream(chunks, window='1D', overlap='1h'):
+            ...
+
+        :param chunks: A dataframe or an iterable of dataframes sorted by their index (e.g., a generator)
+        :param args: Additional positional arguments of preprocess_fn (after the chunk)
+        :param window: Optional window length (e.g., '1D') to re-chunk the data in time windows
+        :param overlap: Optional overlap (rows or duration) prepended to each chunk from the previous one, e.g. for
+        rolling features. The rows computed on the overlap are removed from the results
+        :param cache: Optional on-disk cache of the results of the chunks (see preprocess)
+        :param kwargs: Additional keyword arguments of preprocess_fn
+        :return: generator of the preprocessed chunks
+        """
+        import pandas as pd
+
+        from .utils.util_stream import iter_time_windows, iter_with_overlap, trim_overlap
+
+        preprocess_fn = self._load_function("preprocess", "preprocess_fn")
+        if preprocess_fn is None:
+            self.logger.error("Function preprocess_fn not found in preprocess module.")
+            return
+
+        if window is not None:
+            chunks = iter_time_windows(chunks, window)
+        elif isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
+
+        for chunk, n_overlap in iter_with_overlap(chunks, overlap):
+            if len(chunk) <= n_overlap:
+                continue
+            result = self.preprocess(chunk, *args, cache=cache, **kwargs)
+            self.res_preprocess = trim_overlap(result, chunk.index[n_overlap], n_overlap)
+            yield self.res_preprocess
+
+    def analyze_stream(self, chunks, *args, reducer=None, **kwargs):
+        """
+        Streaming version of analyze: analyze is called on each chunk of data (so that the profiler and the stage
+        metrics see each chunk) and the results are merged by the reducer reduce_fn(accumulator, result) -> accumulator.
+        The reducer is the reduce_fn defined in the analyze module of the app; without a reducer the list of the results
+        of the chunks is returned.
+        :param chunks: An iterable of dataframes (e.g., the output of preprocess_stream)
+        :param args: Additional positional arguments of analyze_fn (after the chunk)
+        :param reducer: Optional reducer overriding the one of the app
+        :param kwargs: Additional keyword arguments of analyze_fn
+        :return: The merged result
+        """
+        analyze_fn = self._load_function("analyze", "analyze_fn")
+        if analyze_fn is None:
+            self.logger.error("Function analyze_fn not found in analyze module.")
             return None
+        if reducer is None:
+            reducer = self._load_function("analyze", "reduce_fn")
+
+        accumulator = None if reducer is not None else []
+        for i, chunk in enumerate(chunks):
+            result = self.analyze(chunk, *args, **kwargs)
+            if reducer is None:
+                accumulator.append(result)
+            else:
+                accumulator = result if i == 0 else reducer(accumulator, result)
+
+        self.res_analyze = accumulator
+        return accumulator
+
+
+def _init_qualify_worker(db_uri: str = None):
+    """
+    Initialize a qualify worker process: the ontology and the BuildingMOTIF session are created once per process
+    :param db_uri: The database uri of the BuildingMOTIF session (in-memory databases are private to the process), by
+    default an in-memory sqlite database
+    :return: None
+    """
+    from .utils.util_ontology import load_brick_ontology
+    from .utils.util_qualify import IN_MEMORY_DB, get_building_motif_session
+
+    load_brick_ontology()
+    get_building_motif_session(db_uri or IN_MEMORY_DB)
+
+
+def _load_graph(metadata) -> Graph:
+    """
+    Load a graph from file if a path is given
+    :param metadata: The rdflib graph or the path to the graph file
+    :return: The graph
+    """
+    from rdflib import Graph
+    from rdflib.util import guess_format
+
+    if isinstance(metadata, Graph):
+        return metadata
+    graph = Graph()
+    graph.parse(metadata, format=guess_format(metadata) or 'ttl')
+    return graph
+
+
+def _qualify_one(key, metadata, app_name: str, base_path: str = None, cache: QualifyCache = None) -> tuple:
+    """
+    Qualify one metadata graph
+    :param key: The identifier of the graph in the batch
+    :param metadata: The metadata graph or the path to the file
+    :param app_name: The name of the app
+    :param base_path: The base path of the app folder
+    :param cache: Optional on-disk cache of the results
+    :return: tuple (key, valid, report), the report carries the error if the graph cannot be qualified
+    """
+    from .utils.util_report import ValidationReport
+
+    try:
+        app = Application(metadata=_load_graph(metadata), app_name=app_name, base_path=base_path)
+        valid = app.qualify(cache=cache)
+        return key, valid, app.res_qualify_report
+    except Exception as e:
+        return key, False, ValidationReport(errors=[f'Error during the qualification of {key}: {e}'])
+
+
+def qualify_many(graphs_or_paths, app_name: str, workers: int = None, base_path: str = None,
+                 cache: QualifyCache = None, db_uri: str = None):
+    """
+    Qualify an app against many metadata graphs in a pool of processes.
+    Each worker loads the ontology and the manifest once and keeps its own private BuildingMOTIF database.
+    The results are yielded as soon as they are available (not in the input order).
+
+    example:
+    for path, valid, report in qualify_many(glob.glob('buildings/*.ttl'), 'app_example', workers=8):
+        print(path, valid)
+
+    :param graphs_or_paths: Iterable of rdflib graphs or paths to the graph files
+    :param app_name: The name of the app
+    :param workers: The number of processes. If 1 the graphs are qualified in the current process
+    :param base_path: The base path of the app folder
+    :param cache: Optional on-disk cache of the results, shared by the workers
+    :param db_uri: The database uri of the BuildingMOTIF sessions, by default an in-memory sqlite database. A file
+    database must not be shared by the workers
+    :return: generator of tuples (key, valid, report) where key is the path or the position of the graph
+    """
+    items = [(item if isinstance(item, str) else i, item) for i, item in enumerate(graphs_or_paths)]
+
+    if workers == 1:
+        _init_qualify_worker(db_uri)
+        for key, item in items:
+            yield _qualify_one(key, item, app_name, base_path, cache)
+        return
+
+    # spawn a clean interpreter: sqlite connections and the BuildingMOTIF singleton must not be forked
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_qualify_worker,
+                             initargs=(db_uri,)) as executor:
+        futures = [executor.submit(_qualify_one, key, item, app_name, base_path, cache) for key, item in items]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def qualify_matrix(graphs_or_paths, app_names: list, base_path: str = None,
+                   basic_validation: bool = True) -> pd.DataFrame:
+    """
+    Compute which apps can run on which buildings.
+    Each graph is loaded and validated against Brick once, then the manifests of all the apps are evaluated in a single
+    SHACL pass (see CombinedManifestValidationInterface).
+
+    example:
+    matrix = qualify_matrix(glob.glob('buildings/*.ttl'), ['app_example', 'app_other'])
+
+    :param graphs_or_paths: Iterable of rdflib graphs or paths to the graph files
+    :param app_names: The names of the apps
+    :param base_path: The base path of the app folder
+    :param basic_validation: If False skip the validation against the Brick shapes
+    :return: DataFrame of booleans with the apps as index and the graphs (path or position) as columns
+    """
+    import pandas as pd
+
+    from .utils.util_qualify import BasicValidationInterface
+    from .utils.util_qualify import CombinedManifestValidationInterface
+
+    manifests = {
+        app_name: Application(metadata=None, app_name=app_name, base_path=base_path).manifest
+        for app_name in app_names
+    }
+    combined_validation = CombinedManifestValidationInterface(manifests)
+
+    matrix = {}
+    for i, item in enumerate(graphs_or_paths):
+        key = item if isinstance(item, str) else i
+        try:
+            graph = _load_graph(item)
+            is_valid = BasicValidationInterface(graph=graph).validate() if basic_validation else True
+            res_apps = combined_validation.validate(graph)
+            matrix[key] = {app_name: is_valid and res_apps[app_name] for app_name in app_names}
+        except Exception as e:
+            logger.error('Error during the qualification of %s: %s', key, e)
+            matrix[key] = {app_name: False for app_name in app_names}
+
+    return pd.DataFrame(matrix, index=app_names, dtype=bool)
+
 
 def app_name_validation(answer, current):
     """
@@ -199,6 +631,8 @@ def app_name_validation(answer, current):
     :param current: The current answer
     :return:
     """
+    import inquirer
+
     if not current.startswith('app_'):
         raise inquirer.errors.ValidationError("", reason="Must start with 'app_'")
 
@@ -212,6 +646,8 @@ def app_folder_validation(answer, current):
     :param current: The current answer
     :return:
     """
+    import inquirer
+
     # must be a path in this form /path/to/folder
     if not os.path.exists(current):
         raise inquirer.errors.ValidationError("", reason="Path does not exist")
@@ -226,6 +662,8 @@ def app_selection_validation(answer, current):
     :param current: The current answer
     :return:
     """
+    import inquirer
+
     # must be a path in this form /path/to/folder
     if len(current) == 0:
         raise inquirer.errors.ValidationError("", reason="Please choose one app from the list")
@@ -237,6 +675,8 @@ def cli_new_app():
     """
     Create new application from template
     """
+    import inquirer
+
     questions = [
         inquirer.Text("name", message="App name?", validate=app_name_validation),
     ]
@@ -247,6 +687,7 @@ def cli_new_app():
 
     # Recursively copy the template folder content to the user folder
     shutil.copytree(template_folder, user_folder, dirs_exist_ok=True)
+    invalidate_app_catalog(APP_FOLDER)
 
     # Update the README or perform other necessary actions
     update_readme(answer["name"])
@@ -270,25 +711,47 @@ def cli_new_app():
 #     print(answer)
 #     # copy folder app_example to app_name
 #     os.system(
-#         f'cp -r {os.path.join(MODULE_BASEPATH, answer["app"])} {os.path.join(USER_BASEPATH, APP_FOLDER, answer["app"])}')
+#         f'cp -r {os.path.join(MODULE_BASEPATH, answer["app"])} '
+#         f'{os.path.join(USER_BASEPATH, APP_FOLDER, answer["app"])}')
 
 
 def cli_list_app():
     """
     List available applications excluding example
     """
-    # list folders in app folder inside the module
-    app_folder = os.listdir(os.path.join(USER_BASEPATH, APP_FOLDER))  # todo should be set by the user
-    # list only folders that start with ap
-    app_names = [app for app in app_folder if app.startswith('app')]
+    # list only folders that start with app in the app folder
+    app_names = list_app_names(APP_FOLDER)  # todo should be set by the user
     print(app_names)
 
 
+def cli_profile(folder: str = 'profiles', app_name: str = None, stage: str = None, top: int = 20):
+    """
+    Print the hot functions of the apps aggregated across the profiled runs
+    :param folder: The folder of the profiles (see AppProfiler)
+    :param app_name: Optional name of the app, by default all the apps
+    :param stage: Optional stage (preprocess or analyze), by default both
+    :param top: The number of functions per app
+    """
+    from .utils.util_profile import aggregate_profiles
+
+    results = aggregate_profiles(folder, app_name=app_name, stage=stage, top=top)
+    if not results:
+        print(f'No profiles found in {folder}')
+    for name, rows in results.items():
+        print(f'{name}')
+        print(f'{"self [s]":>12} {"total [s]":>12} {"runs":>6}  function')
+        for function, self_time, total_time, runs in rows:
+            print(f'{self_time:>12.4f} {total_time:>12.4f} {runs:>6}  {function}')
+        print()
+
+
 def update_readme(app_name):
     """
     Update the README.md of the app
     :param app_name: The name of the app
     """
+    import yaml
+
     print(f'Updating app {app_name}')
     # read config.yaml and transform in markdown.md
     with open(os.path.join(USER_BASEPATH, APP_FOLDER, app_name, "config.yaml")) as file:
@@ -333,8 +796,9 @@ def cli_update_app():
     """
     Update the README.md of the app
     """
+    import inquirer
 
-    app_names = [app for app in os.listdir(os.path.join(USER_BASEPATH, APP_FOLDER)) if app.startswith('app')]
+    app_names = list_app_names(APP_FOLDER)
 
     questions = [
         inquirer.Checkbox(
@@ -370,16 +834,23 @@ def cli_entry_point():
     # subparser.add_parser('clone', help='Clone an existing application.') # todo clone da app online
     subparser.add_parser('update', help='Update README of an application.')
     subparser.add_parser('ls', help='List available applications.')
+    profile_parser = subparser.add_parser('profile', help='Show the hot functions of the profiled app runs.')
+    profile_parser.add_argument('--folder', default='profiles', help='Folder of the profiles.')
+    profile_parser.add_argument('--app', default=None, help='Name of the app, by default all the apps.')
+    profile_parser.add_argument('--stage', choices=['preprocess', 'analyze'], default=None, help='Stage to show.')
+    profile_parser.add_argument('--top', type=int, default=20, help='Number of functions per app.')
 
     # Depending on argument does something
     args = parser.parse_args()
     if args.command == 'new':
         cli_new_app()
-    # if args.command == 'clone':
+    # elif args.command == 'clone':
     #     cli_clone_app()
-    if args.command == 'update':
+    elif args.command == 'update':
         cli_update_app()
-    if args.command == 'ls':
+    elif args.command == 'ls':
         cli_list_app()
+    elif args.command == 'profile':
+        cli_profile(args.folder, app_name=args.app, stage=args.stage, top=args.top)
     else:
         parser.print_help()
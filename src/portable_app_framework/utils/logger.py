@@ -9,7 +9,11 @@ Path:         utils
 
 Script Description:
 This script contains the logger class. Load the Custom logger in your file
-to access to customized logger configuration
+to access to customized logger configuration. The console handler is installed once (configure_logging) on the logger
+of the package, never on the root logger, optionally behind a QueueHandler so that the records are written by a
+background thread.
+Pass the arguments of the messages lazily (logger.debug('Loaded %s', path)), so that they are not formatted when the
+level is disabled.
 Example code:
 
 from utils.logger import CustomLogger
@@ -26,39 +30,120 @@ https://github.com/MrGemy95/Tensorflow-Project-Template
 https://coderzcolumn.com/tutorials/python/logging-config-simple-guide-to-configure-loggers-from-dictionary-and-config-files-in-python
 """
 
-import logging.config
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] (%(filename)s > %(funcName)s) %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# the logger of the package, the root logger is left to the applications
+PACKAGE_LOGGER = 'portable_app_framework'
+
+# marks the handlers installed by configure_logging
+_HANDLER_FLAG = '_portable_app_framework'
+_CONFIG_LOCK = threading.Lock()
+# listener of the queue handler, if any
+_listener = None
 
 
 class ColoredFormatter(logging.Formatter):
     """
-    Colored formatter
+    Colored formatter. The record is not modified: the colors are applied to a copy, so that the other handlers of the
+    record (and the re-emitted records) get the plain level name and message
     """
+    COLORS = {
+        'DEBUG': '\u001b[37;1m',
+        'INFO': '\u001b[32;1m',
+        'WARNING': '\u001b[33;1m',
+        'ERROR': '\033[91m',
+        'CRITICAL': '\u001b[31;1m',
+    }
+    RESET = '\033[0m'
 
     def __init__(self, fmt=None, date_format=None, style='%'):
         super().__init__(fmt, date_format, style)
-        self.COLORS = {
-            'DEBUG': '\u001b[37;1m',
-            'INFO': '\u001b[32;1m',
-            'WARNING': '\u001b[33;1m',
-            'ERROR': '\033[91m',
-            'CRITICAL': '\u001b[31;1m',
-            'RESET': '\033[0m',
-        }
 
     def format(self, record) -> str:
         """
         Defines the colors of the logs depending on the level
-        :param record: The log string
+        :param record: The log record
         :return: Formatted string
         """
-        levelname = record.levelname
-        message = record.msg
-        if levelname in self.COLORS:
-            levelname_color = self.COLORS[levelname] + levelname + self.COLORS['RESET']
-            message_color = self.COLORS[levelname] + message + self.COLORS['RESET']
-            record.levelname = levelname_color
-            record.msg = message_color
-        return super(ColoredFormatter, self).format(record)
+        color = self.COLORS.get(record.levelname)
+        if color is None:
+            return super().format(record)
+        colored = logging.makeLogRecord(record.__dict__)
+        colored.levelname = color + record.levelname + self.RESET
+        # getMessage applies the lazy %-style arguments and accepts non-str messages
+        colored.msg = color + record.getMessage() + self.RESET
+        colored.args = None
+        return super().format(colored)
+
+
+def _stop_listener() -> None:
+    global _listener
+    with _CONFIG_LOCK:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def flush_logging() -> None:
+    """
+    Wait until the queued records are written (use_queue=True), no-op otherwise
+    :return: None
+    """
+    with _CONFIG_LOCK:
+        if _listener is not None:
+            # stop processes the pending records before joining the thread
+            _listener.stop()
+            _listener.start()
+
+
+def configure_logging(level='WARNING', stream=None, use_queue: bool = False, force: bool = False) -> logging.Logger:
+    """
+    Configure the console logging once. The later calls are no-ops unless force is True
+    :param level: The level of the package logger and of the console handler
+    :param stream: The stream of the console handler, by default sys.stdout
+    :param use_queue: If True the records are put on a queue and written by a background thread (QueueHandler), so that
+    logging long messages (e.g., the validation reports) does not block the calling threads
+    :param force: If True replace the handler installed by a previous call
+    :return: The package logger
+    """
+    global _listener
+    package_logger = logging.getLogger(PACKAGE_LOGGER)
+    with _CONFIG_LOCK:
+        installed = [handler for handler in package_logger.handlers if getattr(handler, _HANDLER_FLAG, False)]
+        if installed and not force:
+            return package_logger
+        for handler in installed:
+            package_logger.removeHandler(handler)
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+        console_handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+        console_handler.setLevel(level)
+        console_handler.setFormatter(ColoredFormatter(fmt=LOG_FORMAT, date_format=LOG_DATE_FORMAT))
+        if use_queue:
+            # the queue handler keeps the records as they are, the formatting happens in the listener thread
+            handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+            handler.prepare = lambda record: record
+            _listener = logging.handlers.QueueListener(handler.queue, console_handler, respect_handler_level=True)
+            _listener.start()
+        else:
+            handler = console_handler
+        setattr(handler, _HANDLER_FLAG, True)
+        package_logger.addHandler(handler)
+        package_logger.setLevel(level)
+    return package_logger
+
+
+# flush the queue on exit
+atexit.register(_stop_listener)
 
 
 class CustomLogger:
@@ -78,47 +163,12 @@ class CustomLogger:
 
     def get_logger(self, filename="dev") -> logging.Logger:
         """
-        Return logger
+        Return logger, configuring the console logging on the first call (see configure_logging)
 
         :param filename: name of the file to log
         :return: logger
         """
-
-        logging_config = {
-            'version': 1,
-            'disable_existing_loggers': False,
-            'formatters': {
-                'console': {
-                    'format': '%(asctime)s [%(levelname)s] (%(filename)s > %(funcName)s) %(message)s',
-                    'datefmt': '%Y-%m-%d %H:%M:%S'
-                },
-            },
-            'handlers': {
-                'console': {
-                    'class': 'logging.StreamHandler',
-                    'level': 'WARNING',
-                    'formatter': 'console',
-                    'stream': 'ext://sys.stdout'
-                },
-            },
-            'root': {
-                'level': 'WARNING',
-                'handlers': ['console'],
-            },
-        }
-
-        logging.config.dictConfig(logging_config)
-
-        # Set the formatter for the console handler
-        console_handler = self.logger.handlers[0]
-        console_formatter = ColoredFormatter(
-            # fmt='%(asctime)s [%(levelname)s] (%(funcName)s) %(message)s',
-            fmt='%(asctime)s [%(levelname)s] (%(filename)s > %(funcName)s) %(message)s',
-            # fmt='%(asctime)s [%(levelname)s] (%(filename)s > %(funcName)s > line %(lineno)d) %(message)s',
-            date_format='%Y-%m-%d %H:%M:%S'
-        )
-        console_handler.setFormatter(console_formatter)
-
+        configure_logging()
         return self.logger
 
 
@@ -135,4 +185,4 @@ def example_logs(logger) -> None:
     logger.critical("critical")
 
 
-logger = CustomLogger().get_logger()
+logger = CustomLogger(PACKAGE_LOGGER).get_logger()
@@ -18,11 +18,7 @@ import os
 from collections import OrderedDict
 from pathlib import Path
 
-import yaml
-
-from .logger import CustomLogger
-
-logger = CustomLogger().get_logger()
+from .logger import logger
 
 
 def load_file(path: str, yaml_type=False):
@@ -35,6 +31,7 @@ def load_file(path: str, yaml_type=False):
     try:
         with open(path) as f:
             if yaml_type:
+                import yaml
                 file = yaml.safe_load(f)
             else:
                 file = f.read()
@@ -101,7 +98,8 @@ def write_json(content, filename: str):
 
 def fahrenheit_to_celsius(fahrenheit):
     """
-    Converts °F to °C degrees.
+    Converts °F to °C degrees. Works on scalars and on whole arrays/series, to convert several columns at once
+    driven by the units of the points see util_preprocess.convert_units.
     :param fahrenheit: Temperature in °F
     :return: Temperature in °C
     :example:
@@ -0,0 +1,330 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_app.py
+Path:         utils
+
+Script Description:
+This script contains the catalog of the app definitions and the registry of the modules of the apps (preprocess.py,
+analyze.py). The definitions (config.yaml, query.rq, manifest.ttl) are loaded once per app folder and reloaded only
+when their mtimes change. Each module is imported once per process from the actual folder of the app (i.e., honouring
+the base_path of the Application) and its functions are cached, so that calling them in a loop costs a plain function
+call.
+
+Notes:
+The app folder is registered as a package named after the hash of its path, so that the modules of an app can use
+relative imports (e.g., from .utils import helper) and apps with the same name in different folders do not collide.
+"""
+
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+import types
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+from .logger import logger
+from .util import load_file
+
+# prefix of the packages of the apps in sys.modules
+APP_PACKAGE_PREFIX = '_portable_app_framework_apps'
+
+
+class AppModuleRegistry:
+    """
+    This class is used to import the modules of the apps once and to cache their functions.
+    The modules are reloaded only on request (reload), and only if the source file changed since the import.
+
+    example:
+    preprocess_fn = APP_REGISTRY.get_function(app.path_to_app, 'preprocess', 'preprocess_fn')
+    """
+
+    def __init__(self):
+        # module path -> (mtime_ns, module)
+        self._modules = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def package_name(app_path: str) -> str:
+        """
+        Get the name of the package of an app folder
+        :param app_path: The path to the app folder
+        :return: The package name
+        """
+        digest = hashlib.blake2b(os.path.realpath(app_path).encode(), digest_size=8).hexdigest()
+        return f'{APP_PACKAGE_PREFIX}.app_{digest}'
+
+    def _ensure_package(self, app_path: str) -> str:
+        """
+        Register the app folder as a package in sys.modules
+        :param app_path: The path to the app folder
+        :return: The package name
+        """
+        package_name = self.package_name(app_path)
+        if APP_PACKAGE_PREFIX not in sys.modules:
+            root = types.ModuleType(APP_PACKAGE_PREFIX)
+            root.__path__ = []
+            sys.modules[APP_PACKAGE_PREFIX] = root
+        if package_name not in sys.modules:
+            package = types.ModuleType(package_name)
+            package.__path__ = [os.path.realpath(app_path)]
+            sys.modules[package_name] = package
+        return package_name
+
+    def _import(self, path: str, module_name: str):
+        """
+        Import a module from a file and register it in sys.modules
+        :param path: The path to the source file
+        :param module_name: The full name of the module
+        :return: The module
+        """
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            sys.modules.pop(module_name, None)
+            raise
+        return module
+
+    def get_module(self, app_path: str, module_name: str):
+        """
+        Get a module of an app, importing it on the first call
+        :param app_path: The path to the app folder
+        :param module_name: The name of the module (e.g., preprocess or analyze)
+        :return: The module
+        """
+        path = os.path.join(os.path.realpath(app_path), f'{module_name}.py')
+        entry = self._modules.get(path)
+        if entry is not None:
+            return entry[1]
+
+        with self._lock:
+            entry = self._modules.get(path)
+            if entry is None:
+                mtime_ns = os.stat(path).st_mtime_ns
+                package_name = self._ensure_package(app_path)
+                module = self._import(path, f'{package_name}.{module_name}')
+                entry = (mtime_ns, module)
+                self._modules[path] = entry
+        return entry[1]
+
+    def get_function(self, app_path: str, module_name: str, function_name: str):
+        """
+        Get a function defined in a module of an app
+        :param app_path: The path to the app folder
+        :param module_name: The name of the module (e.g., preprocess or analyze)
+        :param function_name: The name of the function
+        :return: The function or None if it is not defined
+        """
+        function = getattr(self.get_module(app_path, module_name), function_name, None)
+        return function if callable(function) else None
+
+    def reload(self, app_path: str = None) -> list:
+        """
+        Reload the modules whose source file changed since they were imported
+        :param app_path: Optional path to an app folder, by default the modules of all the apps
+        :return: list of the paths of the reloaded modules
+        """
+        folder = os.path.realpath(app_path) if app_path is not None else None
+        reloaded = []
+        with self._lock:
+            for path, (mtime_ns, module) in list(self._modules.items()):
+                if folder is not None and os.path.dirname(path) != folder:
+                    continue
+                try:
+                    current_mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    # the module has been removed
+                    del self._modules[path]
+                    sys.modules.pop(module.__name__, None)
+                    reloaded.append(path)
+                    continue
+                if current_mtime_ns != mtime_ns:
+                    logger.debug('Reloading %s', path)
+                    self._modules[path] = (current_mtime_ns, self._import(path, module.__name__))
+                    reloaded.append(path)
+        return reloaded
+
+
+# process wide registry of the app modules
+APP_REGISTRY = AppModuleRegistry()
+
+
+class AppDefinition(NamedTuple):
+    """
+    The definition of an app loaded from its folder. The config is exposed through read-only mappings
+    """
+    name: str
+    path: str
+    details: Mapping
+    parameters: Mapping
+    manifest: str
+    query: str
+    # mtimes of the app folder and of its files, used to detect the changes
+    mtimes: tuple
+
+
+class AppCatalog:
+    """
+    This class is an immutable in-memory index of the apps of an app folder.
+    The app folder is scanned once: the config.yaml files are parsed, the queries read and the definitions validated,
+    so that looking up an app costs a dictionary access. The index is rebuilt (only for the changed apps) when the
+    mtimes of the folder or of the app files change, checked at most once every refresh_interval seconds.
+
+    example:
+    catalog = get_app_catalog('app')
+    catalog.names()  # ['app_example', ...]
+    definition = catalog.get('app_example')
+    """
+    # files required in the folder of each app
+    REQUIRED_FILES = ('config.yaml', 'manifest.ttl', 'query.rq')
+
+    def __init__(self, app_folder: str, refresh_interval: float = 2.0):
+        """
+        :param app_folder: The folder of the apps
+        :param refresh_interval: The minimum interval in seconds between two checks of the mtimes. If 0 the mtimes are
+        checked on every lookup, if None only on explicit refresh
+        """
+        self.app_folder = app_folder
+        self.refresh_interval = refresh_interval
+        # app name -> AppDefinition or the exception raised by its lookup
+        self._apps = MappingProxyType({})
+        self._folder_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @staticmethod
+    def _mtime(path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _app_mtimes(self, path: str) -> tuple:
+        return (self._mtime(path),) + tuple(self._mtime(os.path.join(path, name)) for name in self.REQUIRED_FILES)
+
+    def _load(self, name: str, mtimes: tuple):
+        """
+        Load and validate the definition of an app
+        :param name: The name of the app
+        :param mtimes: The mtimes of the app folder and files
+        :return: The AppDefinition or the exception to raise on lookup
+        """
+        path = os.path.join(self.app_folder, name)
+        for file_name, mtime in zip(self.REQUIRED_FILES, mtimes[1:]):
+            if mtime is None:
+                return FileNotFoundError(f'{file_name} not found')
+        try:
+            config_file = load_file(os.path.join(path, 'config.yaml'), yaml_type=True)
+            query = load_file(os.path.join(path, 'query.rq'))
+            details, parameters = config_file['details'], config_file['parameters']
+        except Exception as e:
+            return e
+        return AppDefinition(
+            name=name,
+            path=path,
+            details=MappingProxyType(dict(details or {})),
+            parameters=MappingProxyType(dict(parameters or {})),
+            manifest=os.path.join(path, 'manifest.ttl'),
+            query=query,
+            mtimes=mtimes,
+        )
+
+    def refresh(self) -> bool:
+        """
+        Check the mtimes and reload the new and changed apps
+        :return: True if the index changed
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            folder_mtime = self._mtime(self.app_folder)
+            if folder_mtime != self._folder_mtime:
+                names = sorted(entry.name for entry in os.scandir(self.app_folder)
+                               if entry.name.startswith('app') and entry.is_dir()) if folder_mtime else []
+            else:
+                names = list(self._apps)
+
+            apps = {}
+            changed = folder_mtime != self._folder_mtime
+            for name in names:
+                mtimes = self._app_mtimes(os.path.join(self.app_folder, name))
+                current = self._apps.get(name)
+                if isinstance(current, AppDefinition) and current.mtimes == mtimes:
+                    apps[name] = current
+                else:
+                    apps[name] = self._load(name, mtimes)
+                    changed = True
+
+            if changed:
+                self._apps = MappingProxyType(apps)
+                self._folder_mtime = folder_mtime
+            return changed
+
+    def _maybe_refresh(self) -> None:
+        if self.refresh_interval is not None and time.monotonic() - self._checked_at >= self.refresh_interval:
+            self.refresh()
+
+    def names(self) -> list:
+        """
+        Get the names of the apps
+        :return: list of the app names (folders starting with app)
+        """
+        self._maybe_refresh()
+        return list(self._apps)
+
+    def get(self, name: str) -> AppDefinition:
+        """
+        Get the definition of an app
+        :param name: The name of the app
+        :return: The AppDefinition
+        :raise ValueError: if the app does not exist
+        :raise FileNotFoundError: if a required file of the app is missing
+        """
+        self._maybe_refresh()
+        definition = self._apps.get(name)
+        if definition is None:
+            raise ValueError(f"Invalid app name. Available app names: {list(self._apps)}")
+        if isinstance(definition, Exception):
+            raise definition
+        return definition
+
+
+# process wide app catalogs (app folder -> catalog)
+_CATALOGS = {}
+_CATALOGS_LOCK = threading.Lock()
+
+
+def get_app_catalog(app_folder: str) -> AppCatalog:
+    """
+    Get the catalog of an app folder, creating it on the first call
+    :param app_folder: The folder of the apps
+    :return: The shared catalog
+    """
+    key = os.path.realpath(app_folder)
+    catalog = _CATALOGS.get(key)
+    if catalog is None:
+        with _CATALOGS_LOCK:
+            catalog = _CATALOGS.get(key)
+            if catalog is None:
+                catalog = _CATALOGS[key] = AppCatalog(app_folder)
+    return catalog
+
+
+def invalidate_app_catalog(app_folder: str) -> None:
+    """
+    Reload the catalog of an app folder (if any) after an app is created, without waiting for the refresh interval
+    :param app_folder: The folder of the apps
+    :return: None
+    """
+    catalog = _CATALOGS.get(os.path.realpath(app_folder))
+    if catalog is not None:
+        catalog.refresh()
@@ -0,0 +1,285 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_async.py
+Path:         utils
+
+Script Description:
+This script contains the asyncio pipeline of an app: the time series of the points returned by fetch are retrieved
+concurrently from a pluggable asynchronous data source (e.g., a historian over HTTP) with bounded concurrency, while the
+CPU-heavy steps (qualify, fetch, preprocess, analyze) run in an executor without blocking the event loop.
+
+Example code:
+
+import asyncio
+from portable_app_framework.utils.util_async import AsyncPipeline, FileDataSource, run_pipelines
+
+source = FileDataSource('data')
+pipeline = AsyncPipeline(app, source, max_concurrency=32)
+result = asyncio.run(pipeline.run())
+
+Notes:
+The default executor of the event loop is a thread pool: pass a process pool to run the CPU-heavy steps in parallel
+only if the app and its data can be pickled.
+"""
+
+import asyncio
+import functools
+import os
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from .logger import logger
+from .util import list_files
+from .util_data import read_csv_columns, read_parquet_columns
+
+# default of the arguments falling back to the parameters of config.yaml (None is a valid value)
+_DEFAULT = object()
+
+
+class AsyncDataSource(ABC):
+    """
+    This class is the interface of the asynchronous data sources of the time series of the points.
+    Implement read (e.g., with an HTTP client) and optionally read_many (batch requests) and close.
+    """
+
+    @abstractmethod
+    async def read(self, point: str, time_from=None, time_to=None) -> pd.Series:
+        """
+        Read the time series of a point
+        :param point: The external name of the point
+        :param time_from: Optional lower bound of the time range (included)
+        :param time_to: Optional upper bound of the time range (included)
+        :return: The series indexed by time
+        """
+
+    async def read_many(self, points: list, time_from=None, time_to=None, semaphore: asyncio.Semaphore = None) -> dict:
+        """
+        Read the time series of many points, by default with one concurrent read call per point. Override it if the
+        source can read many points in a single request
+        :param points: The external names of the points
+        :param time_from: Optional lower bound of the time range (included)
+        :param time_to: Optional upper bound of the time range (included)
+        :param semaphore: Optional semaphore bounding the concurrent requests
+        :return: dict point -> series, or the exception raised while reading the point
+        """
+        semaphore = semaphore if semaphore is not None else asyncio.Semaphore(max(len(points), 1))
+
+        async def read(point):
+            async with semaphore:
+                return await self.read(point, time_from=time_from, time_to=time_to)
+
+        results = await asyncio.gather(*(read(point) for point in points), return_exceptions=True)
+        return dict(zip(points, results))
+
+    async def close(self) -> None:
+        """
+        Release the resources of the source (e.g., the HTTP session)
+        :return: None
+        """
+
+
+class FileDataSource(AsyncDataSource):
+    """
+    This class is a local stand-in of a historian: the time series are read from csv/parquet files (a file or a folder
+    of files with one column per point). The files are read in the default executor, so that the reads do not block
+    the event loop, and read_many reads each file once for all its points.
+    """
+
+    def __init__(self, path: str, time_column: str = None):
+        """
+        :param path: The path to a csv/parquet file or to a folder of csv/parquet files
+        :param time_column: The name of the time column, by default the first column (csv) or the index (parquet)
+        """
+        if os.path.isdir(path):
+            self.paths = [os.path.join(path, file) for file in sorted(list_files(path))]
+        else:
+            self.paths = [path]
+        self.time_column = time_column
+        # point -> file, built on the first read
+        self._files = None
+
+    def _index_files(self) -> dict:
+        """
+        Index the columns of the files
+        :return: dict point -> path to the file
+        """
+        files = {}
+        for path in self.paths:
+            if path.endswith('.parquet'):
+                import pyarrow.parquet as pq
+                columns = pq.read_schema(path).names
+            else:
+                columns = pd.read_csv(path, nrows=0).columns
+            for column in columns:
+                files.setdefault(column, path)
+        return files
+
+    def _group_by_file(self, points: list) -> dict:
+        """
+        Group the points by the file that contains them
+        :param points: The external names of the points
+        :return: dict path -> list of points, the points not found are grouped under None
+        """
+        if self._files is None:
+            self._files = self._index_files()
+        groups = {}
+        for point in points:
+            groups.setdefault(self._files.get(point), []).append(point)
+        return groups
+
+    def _read_file(self, path: str, points: list, time_from=None, time_to=None) -> pd.DataFrame:
+        reader = read_parquet_columns if path.endswith('.parquet') else read_csv_columns
+        return reader(path, points, time_column=self.time_column, time_from=time_from, time_to=time_to)
+
+    async def read(self, point: str, time_from=None, time_to=None) -> pd.Series:
+        result = (await self.read_many([point], time_from=time_from, time_to=time_to))[point]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def read_many(self, points: list, time_from=None, time_to=None, semaphore: asyncio.Semaphore = None) -> dict:
+        loop = asyncio.get_running_loop()
+        groups = await loop.run_in_executor(None, self._group_by_file, points)
+        results = {point: KeyError(f'Point {point} not found') for point in groups.pop(None, [])}
+        semaphore = semaphore if semaphore is not None else asyncio.Semaphore(max(len(groups), 1))
+
+        async def read_file(path, columns):
+            async with semaphore:
+                return await loop.run_in_executor(None, self._read_file, path, columns, time_from, time_to)
+
+        frames = await asyncio.gather(*(read_file(path, columns) for path, columns in groups.items()),
+                                      return_exceptions=True)
+        for columns, frame in zip(groups.values(), frames):
+            for point in columns:
+                results[point] = frame if isinstance(frame, Exception) else frame[point]
+        return results
+
+
+class AsyncPipeline:
+    """
+    This class is used to run the components of an Application in an event loop.
+    load reads the points of the fetch mapping concurrently from the data source, at most max_concurrency at a time (or
+    within a semaphore shared by several pipelines), and the other components run in an executor.
+
+    example:
+    pipeline = AsyncPipeline(app, FileDataSource('data'))
+    df = await pipeline.load()
+    """
+
+    def __init__(self, app, source: AsyncDataSource, max_concurrency: int = 16, semaphore: asyncio.Semaphore = None,
+                 executor=None):
+        """
+        :param app: The Application
+        :param source: The data source of the time series
+        :param max_concurrency: The maximum number of concurrent reads (ignored if a semaphore is given)
+        :param semaphore: Optional semaphore shared by several pipelines to bound the reads of all the pipelines
+        :param executor: The executor of the CPU-heavy components, by default the executor of the event loop
+        """
+        self.app = app
+        self.source = source
+        self.max_concurrency = max_concurrency
+        self.semaphore = semaphore
+        self.executor = executor
+
+    async def _run_in_executor(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def qualify(self, **kwargs) -> bool:
+        """
+        Run Application.qualify in the executor
+        :return: bool indicating whether the requirements are satisfied or not
+        """
+        return await self._run_in_executor(self.app.qualify, **kwargs)
+
+    async def fetch(self, **kwargs):
+        """
+        Run Application.fetch in the executor
+        :return: The mapping between internal and external naming convention
+        """
+        return await self._run_in_executor(self.app.fetch, **kwargs)
+
+    async def load(self, fetch_map_dict=None, binding: int = None, time_from=_DEFAULT,
+                   time_to=_DEFAULT) -> pd.DataFrame:
+        """
+        Read the time series of the points of the mapping concurrently and return them with the internal names
+        :param fetch_map_dict: The mapping, by default the result of the last fetch (fetch is run if needed)
+        :param binding: Optional position of the binding to load, by default the points of all the bindings
+        :param time_from: Lower bound of the time range (included), by default parameters.time_from. None for no bound
+        :param time_to: Upper bound of the time range (included), by default parameters.time_to. None for no bound
+        :return: The dataframe with the internal column names
+        """
+        if fetch_map_dict is None:
+            fetch_map_dict = self.app.res_fetch if self.app.res_fetch is not None else await self.fetch()
+        if time_from is _DEFAULT:
+            time_from = self.app.parameters.get('time_from')
+        if time_to is _DEFAULT:
+            time_to = self.app.parameters.get('time_to')
+
+        semaphore = self.semaphore if self.semaphore is not None else asyncio.Semaphore(self.max_concurrency)
+
+        remap_index = self.app.get_remap_index(fetch_map_dict)
+        points = remap_index.external_columns(binding=binding)
+        results = await self.source.read_many(points, time_from=time_from, time_to=time_to, semaphore=semaphore)
+
+        series = {}
+        for point in points:
+            result = results[point]
+            if isinstance(result, Exception):
+                logger.warning('Unable to read point %s: %s', point, result)
+            else:
+                series[point] = result
+        data = pd.concat(series, axis=1) if series else pd.DataFrame()
+        return remap_index.rename(data, mode='to_internal', binding=binding, inplace=True)
+
+    async def preprocess(self, *args, **kwargs):
+        """
+        Run Application.preprocess in the executor
+        :return: The result of preprocess_fn
+        """
+        return await self._run_in_executor(self.app.preprocess, *args, **kwargs)
+
+    async def analyze(self, *args, **kwargs):
+        """
+        Run Application.analyze in the executor
+        :return: The result of analyze_fn
+        """
+        return await self._run_in_executor(self.app.analyze, *args, **kwargs)
+
+    async def run(self, qualify: bool = True, binding: int = None, preprocess_kwargs: dict = None,
+                  analyze_kwargs: dict = None):
+        """
+        Run the whole pipeline: qualify, fetch, load, preprocess and analyze
+        :param qualify: If False skip the qualification of the metadata
+        :param binding: Optional position of the binding to load
+        :param preprocess_kwargs: Additional keyword arguments of preprocess_fn
+        :param analyze_kwargs: Additional keyword arguments of analyze_fn
+        :return: The result of analyze_fn or None if the metadata does not qualify
+        """
+        if qualify and not await self.qualify():
+            logger.warning('%s does not qualify, pipeline stopped', self.app.app_name)
+            return None
+        await self.fetch()
+        data = await self.load(binding=binding)
+        data = await self.preprocess(data, **(preprocess_kwargs or {}))
+        return await self.analyze(data, **(analyze_kwargs or {}))
+
+
+async def run_pipelines(apps, source: AsyncDataSource, max_concurrency: int = 16, **kwargs) -> list:
+    """
+    Run the pipelines of many applications (e.g., one per building) concurrently, bounding the reads of all the
+    pipelines to max_concurrency
+    :param apps: Iterable of Application
+    :param source: The data source shared by the pipelines
+    :param max_concurrency: The maximum number of concurrent reads
+    :param kwargs: Additional keyword arguments of AsyncPipeline.run
+    :return: list of the results (or of the exceptions) in the order of the apps
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    pipelines = [AsyncPipeline(app, source, semaphore=semaphore) for app in apps]
+    return await asyncio.gather(*(pipeline.run(**kwargs) for pipeline in pipelines), return_exceptions=True)
@@ -13,107 +13,243 @@ Script Description:
 Notes:
 """
 
-import pandas as pd
-from rdflib import Literal, URIRef, Variable, Graph
+from functools import lru_cache
 
+from rdflib import URIRef, Variable, Graph
+from rdflib.namespace import BRICK, OWL, RDF, RDFS, XSD, NamespaceManager
+from rdflib.plugins.sparql import prepareQuery
 
-def parse_raw_query(query_results):
+# prefixes available to the prepared queries even if the query does not declare them
+DEFAULT_QUERY_NAMESPACES = {'brick': BRICK, 'owl': OWL, 'rdf': RDF, 'rdfs': RDFS, 'xsd': XSD}
+
+# prefixes used by parse_results when no namespace manager is given
+DEFAULT_RESULTS_NAMESPACES = {
+    'brick': 'https://brickschema.org/schema/Brick#',
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'rdfs': 'http://www.w3.org/2000/01/rdf-schema#',
+    'bf': 'https://brickschema.org/schema/1.0.1/BrickFrame#',
+    'owl': 'http://www.w3.org/2002/07/owl#',
+    'skos': 'http://www.w3.org/2004/02/skos/core#',
+    'bldg': 'http://bldg-59#',
+}
+
+
+class TermResolver:
     """
-    Parse the results of a SPARQL query into a standard json format
-    :param query_results:
-    :return:
+    This class is used to convert rdflib terms to local names and CURIEs.
+    The namespaces are resolved with the namespace manager (e.g., graph.namespace_manager) and the results are memoized
+    per term in a bounded LRU cache, so that the terms repeated across bindings and buildings are converted once.
+    Terms outside the known namespaces fall back to the text after the last '#', '/' or ':' (e.g., urn:bldg:ahu1).
+
+    example:
+    resolver = TermResolver(graph.namespace_manager)
+    resolver.local_name(URIRef('https://brickschema.org/schema/Brick#AHU'))  # AHU
+    resolver.curie(URIRef('https://brickschema.org/schema/Brick#AHU'))  # brick:AHU
+    """
+
+    def __init__(self, namespace_manager: NamespaceManager = None, maxsize: int = 65536):
+        self.namespace_manager = namespace_manager
+        self.local_name = lru_cache(maxsize=maxsize)(self._local_name)
+        self.curie = lru_cache(maxsize=maxsize)(self._curie)
+
+    def _qname(self, term):
+        """
+        Split a URI with the namespace manager
+        :param term: The URIRef
+        :return: tuple (prefix, name) or None if the namespace is not bound
+        """
+        if self.namespace_manager is None:
+            return None
+        try:
+            prefix, _, name = self.namespace_manager.compute_qname(term, generate=False)
+        except (KeyError, ValueError):
+            return None
+        return prefix, name
+
+    def _local_name(self, term) -> str:
+        """
+        Get the local name of a term
+        :param term: The rdflib term
+        :return: The local name for URIs, the text for literals
+        """
+        if not isinstance(term, URIRef):
+            return str(term)
+        qname = self._qname(term)
+        if qname is not None and qname[1]:
+            return qname[1]
+        for separator in ('#', '/', ':'):
+            # ignore trailing separators (e.g., namespace URIs)
+            text = term.rstrip(separator)
+            position = text.rfind(separator)
+            if position >= 0:
+                return str(text[position + 1:])
+        return str(term)
+
+    def _curie(self, term):
+        """
+        Get the CURIE of a term
+        :param term: The rdflib term
+        :return: prefix:name if the namespace is bound, otherwise the term itself
+        """
+        if not isinstance(term, URIRef):
+            return term
+        qname = self._qname(term)
+        if qname is None:
+            return term
+        return f'{qname[0]}:{qname[1]}'
+
+
+# resolver shared by the calls without namespace manager
+default_resolver = TermResolver()
+
+
+@lru_cache(maxsize=256)
+def prepare_query(query_string: str):
+    """
+    Parse and translate a SPARQL query once. The compiled query is cached by its text so that the same query run on
+    many graphs (e.g., the query.rq of an app on many buildings) is parsed only once per process.
+    :param query_string: The sparql query encoded as string
+    :return: The prepared rdflib Query
     """
-    # Convert the query results to the desired JSON format
-    head_vars = [str(var) for var in query_results.vars]
-    # Convert FrozenBindings to JSON format
-    bindings_list = []
-    for binding in query_results.bindings:
-        binding_dict = {}
-        for var in head_vars:
-            try:
-                value = binding[var]
-                value_dict = {
-                    'type': 'uri' if isinstance(value, URIRef) else 'literal' if isinstance(value,
-                                                                                            Literal) else None,
-                    'value': str(value),
-                }
-                binding_dict[var] = value_dict
-            except KeyError:
-                pass
-        bindings_list.append(binding_dict)
-
-    json_results = {
-        'head': {'vars': head_vars},
-        'results': {'bindings': bindings_list}
-    }
-    fetch_metadata = {}
-    i = 0
-    for binding in json_results['results']['bindings']:
-        fetch_metadata_binding = {}
-        for item in binding.items():
-            if '#' in item[1]['value']:
-                fetch_metadata_binding[item[0]] = item[1]['value'].split('#')[1]
-            else:
-                fetch_metadata_binding[item[0]] = item[1]['value']
-        fetch_metadata[i] = fetch_metadata_binding
-        i += 1
-
-    return fetch_metadata
-
-
-def parse_results(results, full_uri=False, df=True, no_prefix=False):
+    return prepareQuery(query_string, initNs=DEFAULT_QUERY_NAMESPACES)
+
+
+def parse_raw_query(query_results, output: str = 'dict', resolver: TermResolver = None):
+    """
+    Parse the results of a SPARQL query into the mapping between the query variables and the local names of the terms.
+    The bindings are converted in a single pass without intermediate structures.
+    :param query_results: The rdflib query results
+    :param output: The output format:
+    - 'dict': {i: {var: name}} with one entry per binding (unbound variables are skipped)
+    - 'columns': {var: [name, ...]} with one list per variable (unbound variables are None)
+    - 'dataframe': pandas DataFrame with one row per binding and one column per variable
+    :param resolver: The term resolver used to get the local names, by default the shared one
+    :return: The mapping in the requested format
+    """
+    local_name = (resolver or default_resolver).local_name
+    variables = list(query_results.vars or [])
+    names = [str(var) for var in variables]
+
+    if output == 'dict':
+        fetch_metadata = {}
+        for i, binding in enumerate(query_results.bindings):
+            fetch_metadata_binding = {}
+            for var, name in zip(variables, names):
+                value = binding.get(var)
+                if value is not None:
+                    fetch_metadata_binding[name] = local_name(value)
+            fetch_metadata[i] = fetch_metadata_binding
+        return fetch_metadata
+
+    if output in ('columns', 'dataframe'):
+        columns = {name: [] for name in names}
+        for binding in query_results.bindings:
+            for var, name in zip(variables, names):
+                value = binding.get(var)
+                columns[name].append(None if value is None else local_name(value))
+        if output == 'columns':
+            return columns
+        # pandas is imported only when a dataframe is requested
+        import pandas as pd
+        return pd.DataFrame(columns, columns=names)
+
+    raise ValueError(f"Invalid output {output}. Please choose between dict, columns or dataframe")
+
+
+def columns_to_mapping(columns: dict) -> dict:
+    """
+    Convert the mapping of parse_raw_query(output='columns') to the default mapping
+    :param columns: The mapping {var: [name, ...]}
+    :return: The mapping {i: {var: name}} (unbound variables are skipped)
+    """
+    names = list(columns)
+    return {i: {name: value for name, value in zip(names, row) if value is not None}
+            for i, row in enumerate(zip(*columns.values()))}
+
+
+# unit and datatype of the points, in a single pass over the graph
+POINT_METADATA_QUERY = """
+SELECT ?point ?unit ?datatype WHERE {
+    { ?point brick:hasUnit ?unit }
+    UNION
+    { ?point brick:value ?value . BIND(DATATYPE(?value) AS ?datatype) }
+}
+"""
+
+
+def parse_point_metadata(query_results, names=None, resolver: TermResolver = None, points=None) -> dict:
+    """
+    Parse the results of POINT_METADATA_QUERY into the unit and datatype of each point
+    :param query_results: The rdflib query results
+    :param names: Optional collection of the point names to keep (e.g., the external names of the fetch mapping)
+    :param resolver: The term resolver used to get the local names, by default the shared one
+    :param points: Optional collection of the point URIs to keep (e.g., the terms bound by the app query). Unlike the
+    names, the URIs do not match the points of other namespaces with the same local name
+    :return: dict point name -> {'unit': unit local name or None, 'datatype': datatype local name or None}
+    """
+    local_name = (resolver or default_resolver).local_name
+    names = set(names) if names is not None else None
+    points = set(points) if points is not None else None
+    metadata = {}
+    for point, unit, datatype in query_results:
+        if points is not None and point not in points:
+            continue
+        name = local_name(point)
+        if names is not None and name not in names:
+            continue
+        entry = metadata.setdefault(name, {'unit': None, 'datatype': None})
+        if unit is not None:
+            entry['unit'] = local_name(unit)
+        if datatype is not None:
+            entry['datatype'] = local_name(datatype)
+    return metadata
+
+
+def parse_results(results, full_uri=False, df=True, no_prefix=False, namespace_manager: NamespaceManager = None):
     """
     Parse the results of a SPARQL query
     :param results:
     :param full_uri:
     :param df:
     :param no_prefix:
+    :param namespace_manager: The namespace manager used to compute the prefixes (e.g., graph.namespace_manager). By
+    default the Brick, W3C and bldg prefixes are used. URIs outside the known namespaces are kept as they are.
     :return:
     """
-    m = {
-        'https://brickschema.org/schema/Brick': 'brick',
-        'http://www.w3.org/1999/02/22-rdf-syntax-ns': 'rdf',
-        'http://www.w3.org/2000/01/rdf-schema': 'rdfs',
-        'https://brickschema.org/schema/1.0.1/BrickFrame': 'bf',
-        'http://www.w3.org/2002/07/owl': 'owl',
-        'http://www.w3.org/2004/02/skos/core': 'skos',
-        'http://bldg-59': 'bldg',
-    }
-    """
-    alternative
-    for row in res:
-    print(row)
-    if explicit:
-        y = [[str(term.split('//')[1]) for term in row] for row in res]
-    else:
-        y = [[str(term.split('#')[1]) for term in row] for row in res]
-    y = list([str(row[0]).split('#')[1] for row in results])
-    return y
-    """
-
     if not full_uri:
-        rows = [
-            [m[r.split('#')[0]] + ':' + r.split('#')[1] if isinstance(r, URIRef) and '#' in r else r for r in
-             row] for row in results]
+        if namespace_manager is None:
+            resolver = _default_results_resolver()
+        else:
+            resolver = TermResolver(namespace_manager)
 
         if no_prefix is True:
-            # split prefix from name in list comprehension
-            out = [[item.split(':')[1] if isinstance(item, str) and ':' in item else item for item in row] for row in
-                   rows]
-
+            out = [[resolver.local_name(r) if isinstance(r, URIRef) else r for r in row] for row in results]
         else:
-            out = rows
+            out = [[resolver.curie(r) for r in row] for row in results]
 
     else:
         out = list(results)
 
     if df:
+        import pandas as pd
         out = pd.DataFrame.from_records(
             data=out, columns=[str(item) for item in results.vars if isinstance(item, Variable)])
 
     return out
 
 
+@lru_cache(maxsize=1)
+def _default_results_resolver() -> TermResolver:
+    """
+    Build the resolver with the default prefixes of parse_results once
+    :return: The term resolver
+    """
+    namespace_manager = NamespaceManager(Graph(), bind_namespaces='none')
+    for prefix, namespace in DEFAULT_RESULTS_NAMESPACES.items():
+        namespace_manager.bind(prefix, namespace)
+    return TermResolver(namespace_manager)
+
+
 class BrickGraph(object):
     """
     High-level interface for interacting with Brick graphs using rdflib
@@ -180,6 +316,8 @@ class BrickGraph(object):
         Describe the graph
         :return: print the graph description
         """
+        import pandas as pd
+
         # count the number of triples
         print(f"Number of triples: {len(self.graph)}")
 
@@ -0,0 +1,342 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_cache.py
+Path:         utils
+
+Script Description:
+This script contains the on-disk caches used to skip repeated work across runs and processes.
+
+Notes:
+"""
+
+import datetime
+import decimal
+import hashlib
+import inspect
+import json
+import os
+import time
+
+from rdflib import Graph
+
+from .logger import logger
+from .util_ontology import BRICK_NIGHTLY_PATH, file_digest, get_cache_dir
+from .util_qualify import canonical_digest
+
+# bump when the format of the cached entries changes
+CACHE_FORMAT_VERSION = 1
+
+
+def fingerprint(value) -> str:
+    """
+    Compute a digest of a value used as part of a cache key.
+    Dataframes, series and indexes are hashed by content (values, index, column names and dtypes), numpy arrays by
+    dtype, shape and bytes, containers recursively and the scalars (numbers, strings, dates) by their type and repr.
+    :param value: The value
+    :return: The hex digest
+    :raise TypeError: If the value cannot be hashed by content (e.g., an arbitrary object, whose repr may be truncated
+    or may not depend on its content)
+    """
+    import numpy as np
+    import pandas as pd
+
+    sha = hashlib.sha256()
+    sha.update(type(value).__name__.encode())
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        sha.update(pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index)).to_numpy().tobytes())
+        if isinstance(value, pd.DataFrame):
+            sha.update(repr(list(value.columns)).encode())
+            sha.update(repr(list(value.dtypes.astype(str))).encode())
+        else:
+            sha.update(repr((value.name, str(value.dtype))).encode())
+    elif isinstance(value, np.ndarray):
+        sha.update(repr((str(value.dtype), value.shape)).encode())
+        if value.dtype.hasobject:
+            # the bytes of an object array are pointers
+            for item in value.ravel():
+                sha.update(fingerprint(item).encode())
+        else:
+            sha.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for k, v in sorted((fingerprint(k), v) for k, v in value.items()):
+            sha.update(k.encode())
+            sha.update(fingerprint(v).encode())
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            sha.update(fingerprint(item).encode())
+    elif isinstance(value, (set, frozenset)):
+        for item in sorted(fingerprint(item) for item in value):
+            sha.update(item.encode())
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic, datetime.date,
+                                             datetime.time, datetime.timedelta, decimal.Decimal)):
+        # the repr of these types is exact
+        sha.update(repr(value).encode())
+    else:
+        raise TypeError(f'Cannot fingerprint a value of type {type(value).__name__}')
+    return sha.hexdigest()
+
+
+def source_digest(function) -> str:
+    """
+    Compute the digest of the source of a function: the whole module file, so that a change of any helper of the
+    module invalidates the cache, and the name of the function
+    :param function: The function
+    :return: The hex digest
+    """
+    try:
+        digest = file_digest(inspect.getfile(function))
+    except (TypeError, OSError):
+        # e.g., builtins or functions defined in an interactive session
+        digest = hashlib.sha256(function.__code__.co_code).hexdigest()
+    return hashlib.sha256(f'{digest}:{function.__qualname__}'.encode()).hexdigest()
+
+
+class DiskCache:
+    """
+    This class is the base of the on-disk caches: one file per entry named after the key, where the mtime of the file
+    tracks the last access. The cache is evicted by age (max_age seconds) and by size (max_entries and max_bytes, least
+    recently used first).
+    """
+    suffix = ''
+
+    def __init__(self, cache_dir: str, max_entries: int, max_bytes: int, max_age: float):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}{self.suffix}')
+
+    def evict(self) -> None:
+        """
+        Remove the expired entries and the least recently used ones beyond max_entries or max_bytes
+        :return: None
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # the mtime is the last access, an entry not accessed for max_age is expired as well
+            if now - stat.st_mtime > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        # keep the most recently used entries within the limits
+        entries.sort(reverse=True)
+        total_bytes = 0
+        for i, (_, size, path) in enumerate(entries):
+            total_bytes += size
+            if i >= self.max_entries or total_bytes > self.max_bytes:
+                self._remove(path)
+
+    def clear(self) -> None:
+        """
+        Remove all the entries
+        :return: None
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.suffix):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class QualifyCache(DiskCache):
+    """
+    This class is used to store the results of Application.qualify on disk.
+    The entries are keyed by the canonical digest of the metadata graph, the digest of the app manifest, the digest of
+    the Brick library and the validation mode. Each entry stores the boolean result, the (truncated) validation report
+    and the validation time.
+    The cache is evicted by age (max_age seconds) and by size (max_entries and max_bytes, least recently used first).
+
+    example:
+    cache = QualifyCache()
+    app.qualify(cache=cache)
+    """
+    suffix = '.json'
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 1000, max_bytes: int = 256 * 2 ** 20,
+                 max_age: float = 30 * 24 * 3600, library_path: str = BRICK_NIGHTLY_PATH):
+        super().__init__(cache_dir if cache_dir is not None else get_cache_dir('qualify'),
+                         max_entries, max_bytes, max_age)
+        self.library_digest = file_digest(library_path)
+
+    def key(self, graph: Graph, manifest: str, mode: str = 'full') -> str:
+        """
+        Compute the cache key of a qualify run
+        :param graph: The metadata graph
+        :param manifest: The path to the manifest.ttl of the app
+        :param mode: The validation mode: 'full' (Brick and BuildingMOTIF) or 'incremental' (pyshacl only), the modes
+        may disagree on the same graph
+        :return: The hex key
+        """
+        sha = hashlib.sha256()
+        for part in (str(CACHE_FORMAT_VERSION), canonical_digest(graph), file_digest(manifest), self.library_digest,
+                     mode):
+            sha.update(part.encode())
+            sha.update(b'\n')
+        return sha.hexdigest()
+
+    def get(self, key: str):
+        """
+        Get a cached entry
+        :param key: The cache key
+        :return: dict with valid, report, elapsed and created_at or None if missing or expired
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get('created_at', 0) > self.max_age:
+            self._remove(path)
+            return None
+
+        # the mtime tracks the last access for the LRU eviction
+        os.utime(path)
+        return entry
+
+    def put(self, key: str, valid: bool, report='', elapsed: float = None) -> None:
+        """
+        Store an entry and evict the old ones
+        :param key: The cache key
+        :param valid: The result of the validation
+        :param report: The report of the validation (ValidationReport.to_dict), JSON serializable
+        :param elapsed: The validation time in seconds
+        :return: None
+        """
+        entry = {
+            'valid': valid,
+            'report': report,
+            'elapsed': elapsed,
+            'created_at': time.time(),
+        }
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning('Unable to store qualify result %s: %s', path, e)
+            return
+        self.evict()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError('pyarrow is required by PreprocessCache, install it with pip install pyarrow') from e
+    return pa
+
+
+class PreprocessCache(DiskCache):
+    """
+    This class is used to store the results of Application.preprocess on disk as Arrow IPC (Feather v2) files.
+    The entries are content addressed by the digest of the source of the preprocess module, the fingerprint of the input
+    data and the parameters, so that apps with the same preprocessing of the same building share the entries. Cached
+    results are memory-mapped instead of being read in memory: the numeric and datetime columns without missing values
+    are zero-copy views of the file, the other columns (e.g., strings, columns with nulls) are copied by pyarrow.
+    The cache is evicted by age (max_age seconds) and by size (max_entries and max_bytes, least recently used first).
+
+    example:
+    cache = PreprocessCache()
+    df_preprocess = app.preprocess(df, cache=cache)
+    """
+    suffix = '.arrow'
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 1000, max_bytes: int = 4 * 2 ** 30,
+                 max_age: float = 30 * 24 * 3600):
+        super().__init__(cache_dir if cache_dir is not None else get_cache_dir('preprocess'),
+                         max_entries, max_bytes, max_age)
+
+    @staticmethod
+    def key(function, args: tuple = (), kwargs: dict = None, parameters: dict = None) -> str:
+        """
+        Compute the cache key of a preprocess run
+        :param function: The preprocess function
+        :param args: The positional arguments of the function (e.g., the input dataframe)
+        :param kwargs: The keyword arguments of the function
+        :param parameters: The parameters of the app (config.yaml)
+        :return: The hex key
+        :raise TypeError: If an argument cannot be fingerprinted (see fingerprint), the run must not be cached
+        """
+        sha = hashlib.sha256()
+        for part in (str(CACHE_FORMAT_VERSION), source_digest(function), fingerprint(tuple(args)),
+                     fingerprint(kwargs or {}), fingerprint(parameters or {})):
+            sha.update(part.encode())
+            sha.update(b'\n')
+        return sha.hexdigest()
+
+    def get(self, key: str):
+        """
+        Get a cached result
+        :param key: The cache key
+        :return: The dataframe or None if missing
+        """
+        pa = _import_pyarrow()
+
+        path = self._path(key)
+        try:
+            # the memory map stays open as long as the dataframe references its buffers
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            # one block per column: the columns are not consolidated (copied) in 2D blocks
+            data = table.to_pandas(split_blocks=True, self_destruct=True)
+            del table
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+        # the mtime tracks the last access for the LRU eviction
+        os.utime(path)
+        return data
+
+    def put(self, key: str, data) -> bool:
+        """
+        Store a result and evict the old ones
+        :param key: The cache key
+        :param data: The result of the preprocess function
+        :return: True if the result has been stored. Only dataframes can be stored
+        """
+        import pandas as pd
+
+        pa = _import_pyarrow()
+
+        if not isinstance(data, pd.DataFrame):
+            logger.debug('Preprocess result of type %s not cached', type(data).__name__)
+            return False
+
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            table = pa.Table.from_pandas(data, preserve_index=True)
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except (OSError, pa.ArrowException) as e:
+            logger.warning('Unable to store preprocess result %s: %s', path, e)
+            self._remove(tmp_path)
+            return False
+        self.evict()
+        return True
@@ -0,0 +1,168 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_data.py
+Path:         utils
+
+Script Description:
+This script contains the data loader driven by the fetch mapping. Only the columns of the points required by the app
+are read from the csv/parquet files and the time range filter is applied while reading, then the columns are renamed
+to the internal naming convention.
+
+Notes:
+The parquet files are read through pyarrow (optional dependency, pip install pyarrow): the column projection and the
+time range filter are pushed down to the parquet reader, so that the row groups outside the time range are skipped.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .logger import logger
+from .util import list_files
+from .util_remap import RemapIndex
+
+# number of rows read at once from the csv files when a time range filter is applied
+CSV_CHUNKSIZE = 1_000_000
+
+
+def _to_timestamp(value, tz=None):
+    """
+    Convert a time bound to a timestamp comparable with a time column
+    :param value: The time bound (str, datetime, pd.Timestamp) or None
+    :param tz: The timezone of the time column, None if naive
+    :return: The timestamp or None
+    """
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    if tz is None:
+        return timestamp.tz_convert('UTC').tz_localize(None) if timestamp.tzinfo is not None else timestamp
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.tz_convert(tz)
+
+
+def _filter_time(data: pd.DataFrame, time_from=None, time_to=None) -> pd.DataFrame:
+    """
+    Keep the rows of a dataframe indexed by time within [time_from, time_to]
+    :param data: The dataframe with a DatetimeIndex
+    :param time_from: The lower bound (included) or None
+    :param time_to: The upper bound (included) or None
+    :return: The filtered dataframe
+    """
+    if not isinstance(data.index, pd.DatetimeIndex) or (time_from is None and time_to is None):
+        return data
+    mask = np.ones(len(data), dtype=bool)
+    if time_from is not None:
+        mask &= data.index >= _to_timestamp(time_from, data.index.tz)
+    if time_to is not None:
+        mask &= data.index <= _to_timestamp(time_to, data.index.tz)
+    return data[mask]
+
+
+def read_csv_columns(path: str, columns: list, time_column=None, time_from=None, time_to=None) -> pd.DataFrame:
+    """
+    Read only the required columns of a csv file
+    :param path: The path to the csv file
+    :param columns: The names of the columns to read
+    :param time_column: The name of the time column used as index, by default the first column of the file
+    :param time_from: Optional lower bound of the time range (included)
+    :param time_to: Optional upper bound of the time range (included)
+    :return: The dataframe indexed by time with the required columns found in the file
+    """
+    header = list(pd.read_csv(path, nrows=0).columns)
+    time_column = header[0] if time_column is None else time_column
+    wanted = set(columns)
+    usecols = [time_column] + [column for column in header if column in wanted and column != time_column]
+
+    reader = pd.read_csv(path, usecols=usecols, index_col=time_column, parse_dates=[time_column],
+                         chunksize=CSV_CHUNKSIZE)
+    # filter each chunk so that the rows outside the time range are never held in memory at once
+    frames = [_filter_time(chunk, time_from, time_to) for chunk in reader]
+    data = pd.concat(frames) if frames else pd.DataFrame(columns=usecols[1:])
+    # keep the order of the file columns
+    return data[usecols[1:]]
+
+
+def read_parquet_columns(path: str, columns: list, time_column=None, time_from=None, time_to=None) -> pd.DataFrame:
+    """
+    Read only the required columns of a parquet file, pushing down the time range filter to pyarrow
+    :param path: The path to the parquet file
+    :param columns: The names of the columns to read
+    :param time_column: The name of the time column, by default the (first) index column stored by pandas
+    :param time_from: Optional lower bound of the time range (included)
+    :param time_to: Optional upper bound of the time range (included)
+    :return: The dataframe with the required columns found in the file
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('pyarrow is required to read parquet files, install it with pip install pyarrow') from e
+
+    schema = pq.read_schema(path)
+    if time_column is None:
+        index_columns = [column for column in (schema.pandas_metadata or {}).get('index_columns', [])
+                         if isinstance(column, str)]
+        time_column = index_columns[0] if index_columns else None
+
+    wanted = set(columns)
+    read_columns = [name for name in schema.names if name in wanted and name != time_column]
+    if time_column is not None:
+        read_columns.append(time_column)
+
+    filters = []
+    if time_column is not None and (time_from is not None or time_to is not None):
+        time_type = schema.field(time_column).type
+        tz = time_type.tz if pa.types.is_timestamp(time_type) else None
+        if time_from is not None:
+            filters.append((time_column, '>=', _to_timestamp(time_from, tz)))
+        if time_to is not None:
+            filters.append((time_column, '<=', _to_timestamp(time_to, tz)))
+
+    table = pq.read_table(path, columns=read_columns, filters=filters or None, use_pandas_metadata=True)
+    data = table.to_pandas()
+    if time_column is not None and time_column in data.columns:
+        data = data.set_index(time_column)
+    return data
+
+
+def load_data(path: str, remap_index: RemapIndex, binding: int = None, time_column=None, time_from=None,
+              time_to=None) -> pd.DataFrame:
+    """
+    Load the data required by an app and rename the columns to the internal naming convention
+    :param path: The path to a csv/parquet file or to a folder of csv/parquet files (concatenated by name order)
+    :param remap_index: The mapping compiled from the fetch result
+    :param binding: Optional position of the binding to load, by default the points of all the bindings
+    :param time_column: The name of the time column, by default the first column (csv) or the index (parquet)
+    :param time_from: Optional lower bound of the time range (included)
+    :param time_to: Optional upper bound of the time range (included)
+    :return: The dataframe with the internal column names
+    """
+    if os.path.isdir(path):
+        paths = [os.path.join(path, file) for file in sorted(list_files(path))]
+    else:
+        paths = [path]
+
+    columns = remap_index.external_columns(binding=binding)
+    frames = []
+    for file_path in paths:
+        if file_path.endswith('.parquet'):
+            reader = read_parquet_columns
+        elif file_path.endswith('.csv'):
+            reader = read_csv_columns
+        else:
+            raise ValueError(f'Unsupported file format {file_path}. Please use csv or parquet files')
+        frames.append(reader(file_path, columns, time_column=time_column, time_from=time_from, time_to=time_to))
+
+    data = pd.concat(frames) if len(frames) > 1 else frames[0]
+    missing = [column for column in columns if column not in data.columns]
+    if missing:
+        logger.warning('Columns not found in %s: %s', path, missing)
+
+    return remap_index.rename(data, mode='to_internal', binding=binding, inplace=True)
@@ -0,0 +1,365 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_metrics.py
+Path:         utils
+
+Script Description:
+This script contains the per-stage instrumentation of the Application: the components (qualify, fetch, remap,
+preprocess, analyze) record their wall time, CPU time, peak RSS delta, the triples of the metadata graph before and
+after the stage and the rows/columns of the data in an ApplicationStats object, which can be summarized, exported as
+OpenTelemetry-style spans or written as a Prometheus text exposition (e.g., for the node_exporter textfile collector).
+
+Example code:
+
+from portable_app_framework.utils.util_metrics import ApplicationStats
+
+stats = ApplicationStats()
+app = Application(metadata=graph, app_name='app_example', stats=stats)
+app.qualify()
+app.fetch()
+print(stats.summary())
+stats.write_prometheus('metrics/app.prom')
+
+Notes:
+The instrumentation is disabled when the stats of the Application are None: the components then cost one attribute
+lookup more. The peak RSS delta is the growth of the peak resident memory of the process during the stage (0 if the
+stage did not set a new peak) and is not available on Windows.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+try:
+    import resource
+except ImportError:  # pragma: no cover, Windows
+    resource = None
+
+
+class StageMetrics(NamedTuple):
+    """
+    The metrics of one call of a stage
+    """
+    app_name: str
+    stage: str
+    # wall clock start and end in ns since the epoch (for the spans)
+    start_ns: int
+    end_ns: int
+    wall_time: float
+    cpu_time: float
+    # bytes, None if not available
+    peak_rss_delta: int
+    # triples of the metadata graph, None if the app has no graph
+    triples_before: int
+    triples_after: int
+    # shape of the input data (remap, preprocess, analyze) or of the mapping (fetch), None if not tabular
+    rows: int
+    columns: int
+    # name of the exception raised by the stage, None if the stage succeeded
+    error: str
+
+
+def _peak_rss() -> int:
+    """
+    Get the peak resident memory of the process
+    :return: The peak RSS in bytes, None if not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _triples(graph) -> int:
+    try:
+        return len(graph) if graph is not None else None
+    except TypeError:
+        return None
+
+
+def _shape(value) -> tuple:
+    """
+    Get the rows and columns of a dataframe, a series or a fetch mapping
+    :param value: The data
+    :return: tuple (rows, columns), (None, None) if the value is not tabular
+    """
+    shape = getattr(value, 'shape', None)
+    if isinstance(shape, tuple) and len(shape) in (1, 2):
+        return shape[0], shape[1] if len(shape) == 2 else 1
+    if isinstance(value, dict) and value:
+        # fetch mapping {i: {var: name}} or {var: [names]}
+        first = next(iter(value.values()))
+        if isinstance(first, dict):
+            return len(value), len(first)
+        if isinstance(first, list):
+            return len(first), len(value)
+    return None, None
+
+
+class ApplicationStats:
+    """
+    This class collects the StageMetrics of one or more applications (e.g., a fleet of buildings sharing one stats
+    object).
+
+    example:
+    stats = ApplicationStats()
+    app = Application(metadata=graph, app_name='app_example', stats=stats)
+    app.qualify()
+    stats.records[-1].wall_time
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record: StageMetrics) -> None:
+        """
+        Add the metrics of a stage
+        :param record: The metrics
+        :return: None
+        """
+        with self._lock:
+            self.records.append(record)
+
+    def clear(self) -> None:
+        """
+        Remove all the metrics
+        :return: None
+        """
+        with self._lock:
+            self.records = []
+
+    def to_dataframe(self):
+        """
+        Get the metrics as a dataframe, one row per call of a stage
+        :return: The dataframe with the fields of StageMetrics as columns
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.records, columns=StageMetrics._fields)
+
+    def summary(self):
+        """
+        Aggregate the metrics per app and stage
+        :return: The dataframe indexed by (app_name, stage) with the calls, the errors, the total and maximum wall time,
+        the total CPU time, the maximum peak RSS delta and the total rows
+        """
+        df = self.to_dataframe()
+        return df.groupby(['app_name', 'stage'], sort=False).agg(
+            calls=('stage', 'size'),
+            errors=('error', 'count'),
+            wall_time=('wall_time', 'sum'),
+            wall_time_max=('wall_time', 'max'),
+            cpu_time=('cpu_time', 'sum'),
+            peak_rss_delta=('peak_rss_delta', 'max'),
+            rows=('rows', 'sum'),
+        )
+
+    def to_spans(self, trace_id: str = None) -> list:
+        """
+        Get the metrics as spans following the OpenTelemetry data model (one span per call of a stage)
+        :param trace_id: Optional hex trace id shared by the spans, by default a random one
+        :return: list of dict with name, trace_id, span_id, start/end time in ns, status and attributes
+        """
+        trace_id = trace_id or os.urandom(16).hex()
+        spans = []
+        for record in self.records:
+            spans.append({
+                'name': f'portable_app.{record.stage}',
+                'trace_id': trace_id,
+                'span_id': os.urandom(8).hex(),
+                'start_time_unix_nano': record.start_ns,
+                'end_time_unix_nano': record.end_ns,
+                'status': 'ERROR' if record.error else 'OK',
+                'attributes': self._span_attributes(record),
+            })
+        return spans
+
+    @staticmethod
+    def _span_attributes(record: StageMetrics) -> dict:
+        attributes = {
+            'app.name': record.app_name,
+            'app.stage': record.stage,
+            'process.cpu.time': record.cpu_time,
+            'process.memory.peak_rss_delta': record.peak_rss_delta,
+            'rdf.triples.before': record.triples_before,
+            'rdf.triples.after': record.triples_after,
+            'data.rows': record.rows,
+            'data.columns': record.columns,
+            'error.type': record.error,
+        }
+        # OpenTelemetry attributes cannot be None
+        return {key: value for key, value in attributes.items() if value is not None}
+
+    def emit_spans(self, tracer) -> None:
+        """
+        Emit the metrics as spans with an OpenTelemetry tracer (e.g., opentelemetry.trace.get_tracer(__name__))
+        :param tracer: The tracer
+        :return: None
+        """
+        for record in self.records:
+            span = tracer.start_span(f'portable_app.{record.stage}', start_time=record.start_ns,
+                                     attributes=self._span_attributes(record))
+            span.end(end_time=record.end_ns)
+
+    def to_prometheus(self, prefix: str = 'portable_app') -> str:
+        """
+        Get the metrics in the Prometheus text exposition format, aggregated per app and stage
+        :param prefix: The prefix of the metric names
+        :return: The text exposition
+        """
+        totals = {}
+        for record in self.records:
+            entry = totals.setdefault((record.app_name, record.stage), [0, 0, 0.0, 0.0, 0, 0])
+            entry[0] += 1
+            entry[1] += record.error is not None
+            entry[2] += record.wall_time
+            entry[3] += record.cpu_time
+            entry[4] = max(entry[4], record.peak_rss_delta or 0)
+            entry[5] += record.rows or 0
+
+        metrics = [
+            ('stage_calls_total', 'counter', 'Calls of the stage', 0),
+            ('stage_errors_total', 'counter', 'Calls of the stage that raised an exception', 1),
+            ('stage_wall_seconds_total', 'counter', 'Wall time spent in the stage', 2),
+            ('stage_cpu_seconds_total', 'counter', 'CPU time spent in the stage', 3),
+            ('stage_peak_rss_delta_bytes', 'gauge', 'Maximum growth of the peak RSS during the stage', 4),
+            ('stage_rows_total', 'counter', 'Rows of data processed by the stage', 5),
+        ]
+        lines = []
+        for name, kind, description, position in metrics:
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for (app_name, stage), entry in totals.items():
+                app_name = str(app_name).replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{prefix}_{name}{{app="{app_name}",stage="{stage}"}} {entry[position]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str, prefix: str = 'portable_app') -> str:
+        """
+        Write the Prometheus text exposition to a file. The file is replaced atomically, so that a collector never
+        reads a partial file
+        :param path: The path to the file (e.g., <textfile collector folder>/app.prom)
+        :param prefix: The prefix of the metric names
+        :return: The path to the file
+        """
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.to_prometheus(prefix=prefix))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+
+class StageTimer:
+    """
+    This class is a context manager measuring a stage of an Application and adding its metrics to app.stats.
+    Set result before exiting to record the shape of the result instead of the one of the input data.
+
+    example:
+    with measure_stage(app, 'qualify.basic'):
+        basic_validation.validate()
+    """
+
+    def __init__(self, app, stage: str, data=None):
+        """
+        :param app: The Application, its stats must not be None
+        :param stage: The name of the stage
+        :param data: Optional input data of the stage, for the rows and columns
+        """
+        self.app = app
+        self.stage = stage
+        self.data = data
+        self.result = None
+
+    def __enter__(self):
+        self._triples_before = _triples(self.app.metadata)
+        self._rss_before = _peak_rss()
+        self._start_ns = time.time_ns()
+        self._start, self._cpu_start = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time, cpu_time = time.perf_counter() - self._start, time.process_time() - self._cpu_start
+        rss_after = _peak_rss()
+        rows, columns = _shape(self.result if self.result is not None else self.data)
+        self.app.stats.add(StageMetrics(
+            app_name=self.app.app_name,
+            stage=self.stage,
+            start_ns=self._start_ns,
+            end_ns=self._start_ns + int(wall_time * 1e9),
+            wall_time=wall_time,
+            cpu_time=cpu_time,
+            peak_rss_delta=rss_after - self._rss_before if self._rss_before is not None else None,
+            triples_before=self._triples_before,
+            triples_after=_triples(self.app.metadata),
+            rows=rows,
+            columns=columns,
+            error=exc_type.__name__ if exc_type is not None else None,
+        ))
+        return False
+
+
+# shared no-op context manager of the disabled instrumentation
+_DISABLED = contextlib.nullcontext()
+
+
+def measure_stage(app, stage: str, data=None):
+    """
+    Measure a stage of an Application
+    :param app: The Application
+    :param stage: The name of the stage (e.g., qualify.basic)
+    :param data: Optional input data of the stage, for the rows and columns
+    :return: A StageTimer, or a no-op context manager if app.stats is None
+    """
+    if app.stats is None:
+        return _DISABLED
+    return StageTimer(app, stage, data)
+
+
+def instrument(stage: str):
+    """
+    Decorate a component of the Application to record its metrics in app.stats. When app.stats is None the component
+    is called directly
+    :param stage: The name of the stage
+    :return: The decorator
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.stats is None:
+                return method(self, *args, **kwargs)
+
+            # the input data of remap, preprocess and analyze
+            with StageTimer(self, stage, args[0] if args else kwargs.get('data')) as timer:
+                result = method(self, *args, **kwargs)
+                if stage == 'fetch':
+                    # the mapping, without the units
+                    timer.result = result[0] if isinstance(result, tuple) else result
+                return result
+
+        return wrapper
+
+    return decorator
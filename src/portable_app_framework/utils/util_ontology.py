@@ -0,0 +1,254 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_ontology.py
+Path:         utils
+
+Script Description:
+This script contains the helpers to load the Brick ontology snapshot shipped with the package.
+The ontology is parsed once per process and shared through a read-only view. A compiled copy of the
+snapshot is stored on disk (keyed by the hash of the turtle file) so that cold starts skip the
+turtle parsing entirely.
+
+Notes:
+The compiled snapshots are pickles: they are written with 0600 permissions in a folder owned by the user and
+authenticated with an HMAC keyed by a secret stored in the same folder, so that a file that was not written by the
+package is parsed again instead of being unpickled. The folder defaults to ~/.cache/portable_app_framework and can be
+moved with the PORTABLE_APP_FRAMEWORK_CACHE_DIR environment variable.
+pyshacl adds its system triples (e.g. owl:Class rdfs:subClassOf rdfs:Class) to the shapes graph. They are added to the
+ontology once, before it is shared, so that the validations never write into the shared graph.
+"""
+
+import hashlib
+import hmac
+import os
+import pickle
+import threading
+
+from rdflib import Graph, OWL, RDF, RDFS
+from rdflib.graph import ModificationException
+
+from .logger import logger
+
+BRICK_NIGHTLY_PATH = os.path.join(os.path.dirname(__file__), "..", "libraries", "Brick-nightly.ttl")
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "portable_app_framework")
+# environment variable overriding the cache folder (e.g., in the tests)
+CACHE_DIR_ENV = "PORTABLE_APP_FRAMEWORK_CACHE_DIR"
+
+# triples that pyshacl adds to the shapes graph of every validation
+SHACL_SYSTEM_TRIPLES = [(OWL.Class, RDFS.subClassOf, RDFS.Class), (OWL.DatatypeProperty, RDFS.subClassOf, RDF.Property)]
+
+# process wide store of the parsed ontologies (file hash -> graph)
+_ONTOLOGY_STORE = {}
+_ONTOLOGY_LOCK = threading.Lock()
+# digests of the files (path -> (mtime, size, digest))
+_DIGESTS = {}
+
+
+def get_cache_dir(*names: str) -> str:
+    """
+    Get the folder of the on-disk caches
+    :param names: Optional sub folders (e.g., qualify)
+    :return: The path in $PORTABLE_APP_FRAMEWORK_CACHE_DIR, by default in ~/.cache/portable_app_framework
+    """
+    return os.path.join(os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR, *names)
+
+
+def file_digest(path: str) -> str:
+    """
+    Compute the sha256 digest of a file. The digest is computed again only if the mtime or the size of the file change
+    :param path: The path to the file
+    :return: The hex digest of the file content
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    cached = _DIGESTS.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    _DIGESTS[path] = (stat.st_mtime_ns, stat.st_size, sha.hexdigest())
+    return _DIGESTS[path][2]
+
+
+class ReadOnlyGraph(Graph):
+    """
+    This class is a read-only view of a graph: it shares the store of the graph and raises ModificationException on
+    any change. Adding a triple that is already in the graph is a no-op, so that the view can be passed to pyshacl as
+    shapes/ontology graph (pyshacl adds its system triples to it).
+    Unlike ReadOnlyGraphAggregate, the view is a plain Graph and not a dataset for pyshacl.
+
+    example:
+    view = ReadOnlyGraph(graph)
+    pyshacl.validate(data_graph, shacl_graph=view, ont_graph=view)
+    """
+
+    def __init__(self, graph: Graph):
+        super().__init__(store=graph.store, identifier=graph.identifier)
+
+    def add(self, triple):
+        if triple not in self:
+            raise ModificationException()
+        return self
+
+    def addN(self, quads):
+        raise ModificationException()
+
+    def remove(self, triple):
+        raise ModificationException()
+
+
+def _is_private(path: str, mode_mask: int) -> bool:
+    """
+    Check that a file or folder is owned by the user and has none of the permissions of mode_mask
+    :param path: The path
+    :param mode_mask: The forbidden permissions (e.g., 0o022 not writable by the group and the others)
+    :return: True if the path is private, always True where the owner is not available (Windows)
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    stat = os.stat(path)
+    return stat.st_uid == os.getuid() and not stat.st_mode & mode_mask
+
+
+def _snapshot_key(cache_dir: str):
+    """
+    Get the secret key authenticating the compiled snapshots of a cache folder, creating the folder (0700) and the key
+    (0600) on first use
+    :param cache_dir: The folder of the compiled snapshots
+    :return: The key or None if the folder or the key are not private
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not _is_private(cache_dir, 0o022):
+            logger.warning('Compiled ontology cache disabled, %s is not private', cache_dir)
+            return None
+        key_path = os.path.join(cache_dir, 'snapshot.key')
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            if not _is_private(key_path, 0o077):
+                logger.warning('Compiled ontology cache disabled, %s is not private', key_path)
+                return None
+            with open(key_path, 'rb') as f:
+                key = f.read()
+            # the key may be still being written by another process
+            return key if len(key) == 32 else None
+        key = os.urandom(32)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        return key
+    except OSError as e:
+        logger.warning('Compiled ontology cache disabled: %s', e)
+        return None
+
+
+def _load_compiled(compiled_path: str, key: bytes):
+    """
+    Load a compiled ontology snapshot from disk. The snapshot is unpickled only if it is authenticated by the key
+    :param compiled_path: The path to the compiled snapshot
+    :param key: The key of the cache folder
+    :return: The graph or None if the snapshot is missing, not authenticated or corrupted
+    """
+    if not os.path.exists(compiled_path):
+        return None
+    try:
+        with open(compiled_path, 'rb') as f:
+            tag, payload = f.read(32), f.read()
+        if not hmac.compare_digest(tag, hmac.new(key, payload, hashlib.sha256).digest()):
+            logger.warning('Compiled ontology %s is not authenticated, parsing the ontology again', compiled_path)
+            return None
+        graph = pickle.loads(payload)
+    except Exception as e:
+        logger.warning('Unable to load compiled ontology %s: %s', compiled_path, e)
+        return None
+    return graph if isinstance(graph, Graph) else None
+
+
+def _dump_compiled(graph: Graph, compiled_path: str, key: bytes) -> None:
+    """
+    Store a compiled ontology snapshot on disk (0600), prefixed by its HMAC. The file is written atomically so that
+    concurrent processes never read a partial snapshot.
+    :param graph: The parsed graph
+    :param compiled_path: The path to the compiled snapshot
+    :param key: The key of the cache folder
+    :return: None
+    """
+    payload = pickle.dumps(graph, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f'{compiled_path}.{os.getpid()}.tmp'
+    try:
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(hmac.new(key, payload, hashlib.sha256).digest())
+            f.write(payload)
+        os.replace(tmp_path, compiled_path)
+    except OSError as e:
+        logger.warning('Unable to store compiled ontology %s: %s', compiled_path, e)
+
+
+def load_ontology(path: str = BRICK_NIGHTLY_PATH, cache_dir: str = None, read_only: bool = True):
+    """
+    Load an ontology file once per process and return it as a shared graph.
+    The first call in a process looks for a compiled snapshot in cache_dir (keyed by the file hash)
+    and falls back to parse the turtle file, storing the compiled snapshot for the next cold start.
+    :param path: The path to the ontology turtle file
+    :param cache_dir: The folder of the compiled snapshots, by default get_cache_dir(). If False the on-disk cache is
+    disabled
+    :param read_only: If True return a ReadOnlyGraph view of the shared graph (usable by pyshacl). Set it to False only
+    for consumers that need the underlying graph and never modify it
+    :return: The shared ontology graph
+    """
+    digest = file_digest(path)
+    with _ONTOLOGY_LOCK:
+        if digest not in _ONTOLOGY_STORE:
+            _ONTOLOGY_STORE[digest] = _parse_ontology(path, digest, cache_dir)
+        graph = _ONTOLOGY_STORE[digest]
+
+    return ReadOnlyGraph(graph) if read_only else graph
+
+
+def _parse_ontology(path: str, digest: str, cache_dir: str) -> Graph:
+    """
+    Parse an ontology file, going through the compiled snapshot when available
+    :param path: The path to the ontology turtle file
+    :param digest: The digest of the ontology file
+    :param cache_dir: The folder of the compiled snapshots, by default get_cache_dir(). If False the on-disk cache is
+    disabled
+    :return: The parsed graph
+    """
+    compiled_path = None
+    graph = None
+    if cache_dir is not False:
+        cache_dir = cache_dir if cache_dir is not None else get_cache_dir()
+        key = _snapshot_key(cache_dir)
+        if key is not None:
+            compiled_path = os.path.join(cache_dir, f'{os.path.basename(path)}.{digest[:16]}.pickle')
+            graph = _load_compiled(compiled_path, key)
+
+    if graph is None:
+        logger.debug('Parsing ontology %s', path)
+        graph = Graph()
+        graph.parse(path, format='ttl')
+        if compiled_path is not None:
+            _dump_compiled(graph, compiled_path, key)
+
+    # the graph is not shared yet
+    for triple in SHACL_SYSTEM_TRIPLES:
+        graph.add(triple)
+    return graph
+
+
+def load_brick_ontology(cache_dir: str = None, read_only: bool = True):
+    """
+    Load the Brick nightly snapshot shipped with the package
+    :param cache_dir: The folder of the compiled snapshots, by default get_cache_dir(). If False the on-disk cache is
+    disabled
+    :param read_only: If True return a ReadOnlyGraph view of the shared graph
+    :return: The shared Brick graph
+    """
+    return load_ontology(BRICK_NIGHTLY_PATH, cache_dir=cache_dir, read_only=read_only)
@@ -0,0 +1,313 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_preprocess.py
+Path:         utils
+
+Script Description:
+This script contains vectorized helpers to compose the preprocess_fn of the apps: unit conversion driven by the QUDT
+units of the Brick points, resampling to the aggregation parameter of the app, outlier masking and gap interpolation.
+All the helpers operate on whole arrays or dataframes.
+
+Example code:
+
+from portable_app_framework.utils.util_preprocess import convert_units, mask_outliers, interpolate, resample
+
+def preprocess_fn(df, units, aggregation='1h'):
+    df = convert_units(df, units)
+    df = mask_outliers(df, method='iqr')
+    df = interpolate(df, limit=4)
+    return resample(df, aggregation)
+
+Notes:
+The units are QUDT units (http://qudt.org/vocab/unit/), given as URIs, CURIEs (unit:DEG_F) or local names (DEG_F).
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+QUDT_UNIT = 'http://qudt.org/vocab/unit/'
+
+# unit -> (quantity, scale, offset) such that value_in_base_unit = value * scale + offset
+UNITS = {
+    # temperature
+    'DEG_C': ('temperature', 1.0, 0.0),
+    'K': ('temperature', 1.0, -273.15),
+    'DEG_F': ('temperature', 5 / 9, -32 * 5 / 9),
+    # temperature difference
+    'DEG_C-DIFF': ('temperature_difference', 1.0, 0.0),
+    'K-DIFF': ('temperature_difference', 1.0, 0.0),
+    'DEG_F-DIFF': ('temperature_difference', 5 / 9, 0.0),
+    # pressure
+    'PA': ('pressure', 1.0, 0.0),
+    'KiloPA': ('pressure', 1e3, 0.0),
+    'BAR': ('pressure', 1e5, 0.0),
+    'MilliBAR': ('pressure', 1e2, 0.0),
+    'PSI': ('pressure', 6894.757293168361, 0.0),
+    'IN_H2O': ('pressure', 249.08891, 0.0),
+    # power
+    'W': ('power', 1.0, 0.0),
+    'KiloW': ('power', 1e3, 0.0),
+    'MegaW': ('power', 1e6, 0.0),
+    'BTU_IT-PER-HR': ('power', 0.29307107017222, 0.0),
+    'TON_FG': ('power', 3516.8528420667, 0.0),
+    'HP': ('power', 745.69987158227, 0.0),
+    # energy
+    'J': ('energy', 1.0, 0.0),
+    'KiloJ': ('energy', 1e3, 0.0),
+    'W-HR': ('energy', 3600.0, 0.0),
+    'KiloW-HR': ('energy', 3.6e6, 0.0),
+    'MegaW-HR': ('energy', 3.6e9, 0.0),
+    'BTU_IT': ('energy', 1055.05585262, 0.0),
+    # volume flow rate
+    'M3-PER-SEC': ('volume_flow_rate', 1.0, 0.0),
+    'M3-PER-HR': ('volume_flow_rate', 1 / 3600, 0.0),
+    'L-PER-SEC': ('volume_flow_rate', 1e-3, 0.0),
+    'L-PER-MIN': ('volume_flow_rate', 1e-3 / 60, 0.0),
+    'FT3-PER-MIN': ('volume_flow_rate', 0.028316846592 / 60, 0.0),
+    'GAL_US-PER-MIN': ('volume_flow_rate', 0.003785411784 / 60, 0.0),
+    # ratio
+    'PERCENT': ('ratio', 1.0, 0.0),
+    # speed
+    'M-PER-SEC': ('speed', 1.0, 0.0),
+    'FT-PER-MIN': ('speed', 0.3048 / 60, 0.0),
+}
+
+# base unit of each quantity
+BASE_UNITS = {
+    'temperature': 'DEG_C',
+    'temperature_difference': 'K-DIFF',
+    'pressure': 'PA',
+    'power': 'W',
+    'energy': 'J',
+    'volume_flow_rate': 'M3-PER-SEC',
+    'ratio': 'PERCENT',
+    'speed': 'M-PER-SEC',
+}
+
+
+def unit_name(unit) -> str:
+    """
+    Get the QUDT local name of a unit
+    :param unit: The unit as URI, CURIE or local name
+    :return: The local name (e.g., DEG_F)
+    """
+    unit = str(unit)
+    if unit.startswith(QUDT_UNIT):
+        return unit[len(QUDT_UNIT):]
+    if unit.startswith('unit:'):
+        return unit[len('unit:'):]
+    return unit
+
+
+def conversion_factors(from_unit, to_unit=None) -> tuple:
+    """
+    Get the affine conversion between two units of the same quantity
+    :param from_unit: The unit of the data
+    :param to_unit: The target unit, by default the base unit of the quantity
+    :return: tuple (scale, offset) such that converted = value * scale + offset
+    :raise ValueError: if a unit is unknown or the units measure different quantities
+    """
+    from_name = unit_name(from_unit)
+    if from_name not in UNITS:
+        raise ValueError(f'Unknown unit {from_unit}')
+    quantity, from_scale, from_offset = UNITS[from_name]
+    to_name = BASE_UNITS[quantity] if to_unit is None else unit_name(to_unit)
+    if to_name not in UNITS:
+        raise ValueError(f'Unknown unit {to_unit}')
+    to_quantity, to_scale, to_offset = UNITS[to_name]
+    if to_quantity != quantity:
+        raise ValueError(f'Cannot convert {from_name} ({quantity}) to {to_name} ({to_quantity})')
+    # value -> base unit -> target unit
+    return from_scale / to_scale, (from_offset - to_offset) / to_scale
+
+
+def convert_units(data: pd.DataFrame, units: dict, targets: dict = None) -> pd.DataFrame:
+    """
+    Convert the columns of a dataframe to the target units in a single vectorized operation
+    :param data: The dataframe
+    :param units: dict column -> unit of the data. Columns without a unit (or with an unknown unit) are not converted
+    :param targets: dict column -> target unit, by default the base unit of the quantity of each column
+    :return: The converted dataframe (a new dataframe, data is not modified)
+    """
+    targets = targets or {}
+    scale = np.ones(len(data.columns))
+    offset = np.zeros(len(data.columns))
+    for i, column in enumerate(data.columns):
+        unit = units.get(column)
+        if unit is None or unit_name(unit) not in UNITS:
+            continue
+        scale[i], offset[i] = conversion_factors(unit, targets.get(column))
+
+    converted = np.flatnonzero((scale != 1.0) | (offset != 0.0))
+    if len(converted) == 0:
+        return data.copy()
+    data = data.copy()
+    columns = data.columns[converted]
+    data[columns] = data[columns].to_numpy(dtype=float) * scale[converted] + offset[converted]
+    return data
+
+
+def resample(data: pd.DataFrame, aggregation: str, how='mean') -> pd.DataFrame:
+    """
+    Resample a dataframe indexed by time to the aggregation of the app
+    :param data: The dataframe with a DatetimeIndex
+    :param aggregation: The aggregation frequency (e.g., the aggregation parameter of config.yaml, 1h), fixed or
+    calendar (e.g., W, MS)
+    :param how: The aggregation function (e.g., mean, sum, max) or dict column -> function
+    :return: The resampled dataframe
+    """
+    return data.resample(to_offset(aggregation)).agg(how)
+
+
+def mask_outliers(data: pd.DataFrame, method: str = 'iqr', k: float = None, lower=None,
+                  upper=None) -> pd.DataFrame:
+    """
+    Replace the outliers of each column with NaN
+    :param data: The dataframe
+    :param method: The detection method:
+    - 'iqr': values outside [q1 - k * iqr, q3 + k * iqr] (k = 1.5 by default)
+    - 'zscore': values farther than k standard deviations from the mean (k = 3 by default)
+    - 'range': values outside [lower, upper]
+    :param k: The width of the acceptance interval of the iqr and zscore methods
+    :param lower: The lower bound of the range method, a scalar or dict column -> bound
+    :param upper: The upper bound of the range method, a scalar or dict column -> bound
+    :return: The masked dataframe (a new dataframe, data is not modified)
+    """
+    values = data.to_numpy(dtype=float)
+    if method == 'iqr':
+        k = 1.5 if k is None else k
+        q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+        low, high = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+    elif method == 'zscore':
+        k = 3.0 if k is None else k
+        mean, std = np.nanmean(values, axis=0), np.nanstd(values, axis=0)
+        low, high = mean - k * std, mean + k * std
+    elif method == 'range':
+        low = _bounds(data.columns, lower, -np.inf)
+        high = _bounds(data.columns, upper, np.inf)
+    else:
+        raise ValueError(f'Invalid method {method}. Please choose between iqr, zscore or range')
+
+    masked = np.where((values < low) | (values > high), np.nan, values)
+    return pd.DataFrame(masked, index=data.index, columns=data.columns)
+
+
+def _bounds(columns, bound, default: float) -> np.ndarray:
+    """
+    Broadcast a bound to the columns
+    :param columns: The columns
+    :param bound: None, a scalar or dict column -> bound
+    :param default: The bound of the columns without a bound
+    :return: array with one bound per column
+    """
+    if bound is None:
+        return np.full(len(columns), default)
+    if isinstance(bound, dict):
+        return np.array([bound.get(column, default) for column in columns], dtype=float)
+    return np.full(len(columns), bound, dtype=float)
+
+
+def interpolate(data: pd.DataFrame, limit: int = None, method: str = None) -> pd.DataFrame:
+    """
+    Fill the gaps (NaN) of each column by interpolation
+    :param data: The dataframe
+    :param limit: The maximum length of the gaps to fill, longer gaps are left missing
+    :param method: The interpolation method, by default time for a DatetimeIndex and linear otherwise
+    :return: The interpolated dataframe
+    """
+    if method is None:
+        method = 'time' if isinstance(data.index, pd.DatetimeIndex) else 'linear'
+    # only the gaps within the data are filled, the leading and trailing missing values are kept
+    filled = data.interpolate(method=method, limit_area='inside')
+    if limit is None:
+        return filled
+
+    # length of the gap each missing value belongs to
+    missing = data.isna().to_numpy()
+    gap_id = np.cumsum(~missing, axis=0)
+    long_gaps = np.zeros_like(missing)
+    for j in range(missing.shape[1]):
+        gap_length = np.bincount(gap_id[:, j], weights=missing[:, j])
+        long_gaps[:, j] = missing[:, j] & (gap_length[gap_id[:, j]] > limit)
+    return filled.mask(long_gaps)
+
+
+class ConversionPlan:
+    """
+    This class is used to convert the columns of the app data to the target units in a single vectorized step.
+    The plan is compiled once from the units of the points returned by Application.fetch(with_units=True), keyed by the
+    external names, so that it can be applied after remap: the internal columns are resolved back to their points
+    through the remap index (the k-th column with the same internal name is the k-th point of the mapping).
+
+    example:
+    mapping, units = app.fetch(with_units=True)
+    remap_index = RemapIndex(mapping)
+    plan = ConversionPlan(units, remap_index=remap_index, targets={'t_mix': 'DEG_C'})
+    df = plan.apply(remap_index.rename(df, mode='to_internal'))
+    """
+
+    def __init__(self, units: dict, remap_index=None, targets: dict = None):
+        """
+        :param units: dict external name -> unit or -> {'unit': unit, ...} (the output of fetch with_units=True)
+        :param remap_index: The RemapIndex of the mapping. If None the plan is applied to the external names
+        :param targets: dict internal (or external) name -> target unit, by default the base unit of each quantity
+        """
+        targets = targets or {}
+        self.remap_index = remap_index
+        names, scale, offset = [], [], []
+        self.skipped = {}
+        for name, unit in units.items():
+            if isinstance(unit, dict):
+                unit = unit.get('unit')
+            if unit is None or unit_name(unit) not in UNITS:
+                continue
+            internal = remap_index.to_internal.get(name) if remap_index is not None else None
+            target = targets.get(internal, targets.get(name))
+            try:
+                factors = conversion_factors(unit, target)
+            except ValueError as e:
+                self.skipped[name] = str(e)
+                continue
+            if factors != (1.0, 0.0):
+                names.append(name)
+                scale.append(factors[0])
+                offset.append(factors[1])
+
+        self._index = pd.Index(names, dtype=object)
+        self._scale = np.array(scale, dtype=float)
+        self._offset = np.array(offset, dtype=float)
+
+    def __len__(self):
+        return len(self._index)
+
+    def apply(self, data: pd.DataFrame, binding: int = None, inplace: bool = False) -> pd.DataFrame:
+        """
+        Convert the columns of a dataframe
+        :param data: The dataframe with the internal names (or the external names if the plan has no remap index)
+        :param binding: Optional position of the binding of the data when the fetch returned several bindings
+        :param inplace: If True convert the columns of data, otherwise return a new dataframe
+        :return: The converted dataframe
+        """
+        if not inplace:
+            data = data.copy()
+        if len(self._index) == 0:
+            return data
+
+        names = data.columns
+        if self.remap_index is not None:
+            names = self.remap_index.columns(data.columns, 'to_external', binding=binding)
+        positions = self._index.get_indexer(names)
+        columns = np.flatnonzero(positions >= 0)
+        if len(columns) == 0:
+            return data
+
+        factors = positions[columns]
+        values = data.iloc[:, columns].to_numpy(dtype=float) * self._scale[factors] + self._offset[factors]
+        for j, column in enumerate(columns):
+            data.isetitem(column, values[:, j])
+        return data
@@ -0,0 +1,251 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_profile.py
+Path:         utils
+
+Script Description:
+This script contains the opt-in profiler of the functions of the apps (preprocess_fn, analyze_fn). Each profiled call
+writes a profile per app and per run: with cProfile a pstats file (e.g., for snakeviz) and the collapsed stacks
+derived from its call graph, with the sampling profiler the collapsed stacks of the samples. The collapsed stacks
+(one "frame;frame;frame weight" line per stack, weights in microseconds) can be rendered by flamegraph.pl or
+speedscope, and are aggregated across runs by aggregate_profiles (CLI: portable-app-framework profile).
+
+Example code:
+
+from portable_app_framework.utils.util_profile import AppProfiler, aggregate_profiles
+
+app = Application(metadata=graph, app_name='app_example', profiler=AppProfiler('profiles'))
+app.analyze(app.preprocess(df))
+aggregate_profiles('profiles')['app_example'][:5]
+
+Notes:
+cProfile records the caller/callee edges only: the collapsed stacks of a cProfile run split the time of a function
+among its callers proportionally to the time spent from each caller. Use the sampling profiler (mode='sampling') for
+exact stacks at the cost of the resolution (interval).
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MODES = ('cprofile', 'sampling')
+# maximum depth of the collapsed stacks
+MAX_DEPTH = 128
+# the stacks lighter than this fraction of the total time are not split further among the callers (this bounds the
+# number of stacks derived from a cProfile run)
+MIN_WEIGHT_FRACTION = 1e-4
+
+
+def _label(filename: str, lineno: int, name: str) -> str:
+    """
+    Get the label of a frame in the collapsed stacks
+    :return: The label function (file:line)
+    """
+    label = f'{name} ({os.path.basename(filename)}:{lineno})' if lineno else name
+    # ; separates the frames of a stack
+    return label.replace(';', ',')
+
+
+def _cprofile_stacks(stats: dict) -> Counter:
+    """
+    Derive the collapsed stacks from the call graph of a cProfile run
+    :param stats: The stats of pstats.Stats (function -> (cc, nc, tt, ct, callers))
+    :return: Counter of the stacks (tuple of labels from the root) with the self time in seconds
+    """
+    stacks = Counter()
+    min_weight = MIN_WEIGHT_FRACTION * sum(entry[2] for entry in stats.values())
+
+    def walk(function, weight, path):
+        callers = {caller: timing for caller, timing in stats[function][4].items()
+                   if caller in stats and caller not in path}
+        if not callers or len(path) >= MAX_DEPTH or weight < min_weight:
+            stacks[tuple(_label(*f) for f in reversed(path))] += weight
+            return
+        # split the time among the callers proportionally to the time spent from each of them (or to the calls)
+        shares = {caller: timing[3] for caller, timing in callers.items()}
+        total = sum(shares.values())
+        if total <= 0:
+            shares = {caller: timing[1] for caller, timing in callers.items()}
+            total = sum(shares.values()) or len(shares)
+        for caller, share in shares.items():
+            walk(caller, weight * (share or 1) / total, path + [caller])
+
+    for function, (_, _, tottime, _, _) in stats.items():
+        if tottime > 0 and not function[2].startswith("<method 'disable'"):
+            walk(function, tottime, [function])
+    return stacks
+
+
+class _Sampler(threading.Thread):
+    """
+    Thread sampling the stack of a thread every interval seconds, samples maps the stacks to their time in seconds
+    """
+
+    def __init__(self, thread_id: int, interval: float, stop_code):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        # code of the frame where the stacks stop (_sampled_call)
+        self.stop_code = stop_code
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            # the samples are weighted by the time since the previous one: the sampler may wake up later than interval
+            # when the profiled thread holds the GIL
+            now = time.perf_counter()
+            weight, last = now - last, now
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.stop_code:
+                # the first line of the function, as cProfile, so that the runs of both modes are aggregated together
+                stack.append(_label(frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name))
+                frame = frame.f_back
+            # the thread is not in the profiled function (e.g., it is stopping the sampler)
+            if frame is not None and stack:
+                self.samples[tuple(reversed(stack))] += weight
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.samples
+
+
+def _sampled_call(function, args, kwargs):
+    # bottom frame of the sampled stacks
+    return function(*args, **kwargs)
+
+
+class AppProfiler:
+    """
+    This class profiles the calls of the functions of the apps and writes one profile per call in
+    output_folder/<app_name>/<stage>_<timestamp>.(pstats|collapsed)
+
+    example:
+    profiler = AppProfiler('profiles', mode='sampling', interval=0.001)
+    result = profiler.run('app_example', 'analyze', analyze_fn, df)
+    """
+
+    def __init__(self, output_folder: str = 'profiles', mode: str = 'cprofile', interval: float = 0.005):
+        """
+        :param output_folder: The folder of the profiles
+        :param mode: cprofile (deterministic, pstats and collapsed stacks) or sampling (collapsed stacks only)
+        :param interval: The sampling interval in seconds (sampling mode)
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'Invalid mode {mode}. Please choose between {PROFILE_MODES}')
+        self.output_folder = output_folder
+        self.mode = mode
+        self.interval = interval
+        # paths of the profiles written by the last run
+        self.last_paths = []
+
+    def _base_path(self, app_name: str, stage: str) -> str:
+        folder = os.path.join(self.output_folder, str(app_name))
+        os.makedirs(folder, exist_ok=True)
+        stamp = time.strftime('%Y%m%dT%H%M%S')
+        return os.path.join(folder, f'{stage}_{stamp}_{os.getpid()}_{time.time_ns() % 10 ** 9:09d}')
+
+    def run(self, app_name: str, stage: str, function, *args, **kwargs):
+        """
+        Call a function under the profiler and write its profile
+        :param app_name: The name of the app
+        :param stage: The name of the stage (e.g., preprocess or analyze)
+        :param function: The function to profile
+        :param args: The positional arguments of the function
+        :param kwargs: The keyword arguments of the function
+        :return: The result of the function
+        """
+        base_path = self._base_path(app_name, stage)
+        self.last_paths = []
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                stats = pstats.Stats(profile)
+                stats.dump_stats(base_path + '.pstats')
+                self.last_paths.append(base_path + '.pstats')
+                self._write_collapsed(base_path + '.collapsed', _cprofile_stacks(stats.stats))
+
+        sampler = _Sampler(threading.get_ident(), self.interval, _sampled_call.__code__)
+        sampler.start()
+        try:
+            return _sampled_call(function, args, kwargs)
+        finally:
+            self._write_collapsed(base_path + '.collapsed', sampler.stop())
+
+    def _write_collapsed(self, path: str, stacks: Counter) -> None:
+        """
+        Write the collapsed stacks
+        :param path: The path to the file
+        :param stacks: Counter of the stacks with the weight in seconds
+        :return: None
+        """
+        with open(path, 'w') as f:
+            for stack, weight in stacks.most_common():
+                weight_us = round(weight * 1e6)
+                if weight_us > 0:
+                    f.write(f"{';'.join(stack)} {weight_us}\n")
+        self.last_paths.append(path)
+
+
+def read_collapsed(path: str) -> Counter:
+    """
+    Read a collapsed stacks file
+    :param path: The path to the file
+    :return: Counter of the stacks (tuple of labels from the root) with the weight in microseconds
+    """
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, weight = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[tuple(stack.split(';'))] += int(weight)
+    return stacks
+
+
+def aggregate_profiles(folder: str = 'profiles', app_name: str = None, stage: str = None, top: int = 20) -> dict:
+    """
+    Aggregate the collapsed stacks of the runs of the apps to find the hot functions
+    :param folder: The folder of the profiles
+    :param app_name: Optional name of the app, by default all the apps in the folder
+    :param stage: Optional stage (e.g., analyze), by default all the stages
+    :param top: The number of functions per app
+    :return: dict app_name -> list of tuples (function, self time, total time, runs) sorted by self time, the times in
+    seconds summed over the runs
+    """
+    if not os.path.isdir(folder):
+        return {}
+    app_names = [app_name] if app_name is not None else sorted(
+        name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name)))
+
+    results = {}
+    for name in app_names:
+        app_folder = os.path.join(folder, name)
+        if not os.path.isdir(app_folder):
+            continue
+        self_time, total_time, runs = Counter(), Counter(), Counter()
+        for file_name in sorted(os.listdir(app_folder)):
+            if not file_name.endswith('.collapsed') or (stage is not None and not file_name.startswith(f'{stage}_')):
+                continue
+            seen = set()
+            for stack, weight in read_collapsed(os.path.join(app_folder, file_name)).items():
+                self_time[stack[-1]] += weight
+                for function in set(stack):
+                    total_time[function] += weight
+                seen.update(stack)
+            runs.update(seen)
+        results[name] = [(function, weight / 1e6, total_time[function] / 1e6, runs[function])
+                         for function, weight in self_time.most_common(top)]
+    return results
@@ -11,14 +11,158 @@ Script Description:
 
 
 Notes:
+pyshacl and buildingmotif are imported on first use, so that importing this module stays fast.
 """
+import hashlib
+import importlib.util
+import logging
 import os
-from buildingmotif import BuildingMOTIF
-from buildingmotif.dataclasses import Model, Library
-from rdflib import Namespace, Graph
-import sqlite3 as lite
-import pyshacl
+import threading
+
+from rdflib import Namespace, Graph, BNode, Literal, URIRef, OWL, RDF, RDFS, SH
+from rdflib.compare import to_canonical_graph
 from .logger import logger
+from .util_ontology import load_brick_ontology
+from .util_report import ValidationReport, iter_results
+
+
+# BuildingMOTIF libraries that the manifests can import (e.g., for constraint:exactCount): ontology IRI -> path in the
+# buildingmotif package
+BUILDING_MOTIF_LIBRARIES = {
+    URIRef('https://nrel.gov/BuildingMOTIF/constraints'): ('libraries', 'constraints', 'constraints.ttl'),
+}
+
+
+def building_motif_library_path(ontology: URIRef) -> str:
+    """
+    Get the path to a BuildingMOTIF library, without importing buildingmotif
+    :param ontology: The IRI of the library ontology
+    :return: The path to the turtle file or None if the ontology is not a known library
+    """
+    if ontology not in BUILDING_MOTIF_LIBRARIES:
+        return None
+    spec = importlib.util.find_spec('buildingmotif')
+    return os.path.join(spec.submodule_search_locations[0], *BUILDING_MOTIF_LIBRARIES[ontology])
+
+
+def resolve_imports(graph: Graph, source: str = None) -> Graph:
+    """
+    Resolve the owl:imports of a manifest (recursively) as BuildingMOTIF does
+    :param graph: The manifest graph
+    :param source: Optional name of the manifest for the errors
+    :return: The graph of the imported libraries
+    :raise ValueError: If an import is not a known BuildingMOTIF library (BuildingMOTIF fails as well)
+    """
+    libraries = Graph()
+    seen = set()
+    pending = list(graph.objects(None, OWL.imports))
+    while pending:
+        ontology = pending.pop()
+        if ontology in seen:
+            continue
+        seen.add(ontology)
+        path = building_motif_library_path(ontology)
+        if path is None:
+            raise ValueError(f'Cannot resolve the import of {ontology} in {source or "the manifest"}')
+        library = Graph()
+        library.parse(path, format='ttl')
+        libraries += library
+        pending.extend(library.objects(None, OWL.imports))
+    return libraries
+
+
+def shape_nodes(graph: Graph) -> set:
+    """
+    Find the shapes of a shapes graph: the nodes typed as shapes, the nodes with a target and the nodes referenced by
+    sh:node and sh:property
+    :param graph: The shapes graph (e.g., a manifest)
+    :return: The set of the shape nodes
+    """
+    shapes = set(graph.subjects(RDF.type, SH.NodeShape)) | set(graph.subjects(RDF.type, SH.PropertyShape))
+    for predicate in (SH.targetClass, SH.targetNode, SH.targetSubjectsOf, SH.targetObjectsOf):
+        shapes.update(graph.subjects(predicate, None))
+    for predicate in (SH.node, SH.property):
+        shapes.update(graph.objects(None, predicate))
+    return shapes
+
+
+def expand_types(graph: Graph, ontology: Graph) -> Graph:
+    """
+    Return a copy of the graph with the rdf:type triples inferred from the ontology class hierarchy.
+    This is a lightweight alternative to merging the whole ontology into the data graph.
+    :param graph: The data graph (left untouched)
+    :param ontology: The ontology with the rdfs:subClassOf hierarchy
+    :return: A new graph with the data and the inferred types
+    """
+    expanded = Graph()
+    for prefix, namespace in graph.namespaces():
+        expanded.bind(prefix, namespace)
+    expanded += graph
+
+    superclasses = {}
+    for subject, klass in graph.subject_objects(RDF.type):
+        if klass not in superclasses:
+            superclasses[klass] = set(ontology.transitive_objects(klass, RDFS.subClassOf))
+        for superclass in superclasses[klass]:
+            expanded.add((subject, RDF.type, superclass))
+
+    return expanded
+
+
+def subject_digests(graph: Graph) -> dict:
+    """
+    Compute a digest of the description of each subject in the graph
+    :param graph: The graph
+    :return: dict subject -> hex digest of its sorted (predicate, object) pairs
+    """
+    descriptions = {}
+    for s, p, o in graph:
+        descriptions.setdefault(s, []).append(f'{p.n3()} {o.n3()}')
+
+    digests = {}
+    for subject, description in descriptions.items():
+        description.sort()
+        digests[subject] = hashlib.blake2b('\n'.join(description).encode(), digest_size=16).hexdigest()
+    return digests
+
+
+def combine_digests(digests: dict) -> str:
+    """
+    Combine the subject digests into a digest of the whole graph
+    :param digests: dict subject -> hex digest as returned by subject_digests
+    :return: The hex digest of the graph
+    """
+    sha = hashlib.sha256()
+    for line in sorted(f'{subject.n3()} {digest}' for subject, digest in digests.items()):
+        sha.update(line.encode())
+        sha.update(b'\n')
+    return sha.hexdigest()
+
+
+def canonical_digest(graph: Graph) -> str:
+    """
+    Compute a digest of the graph that does not depend on the blank node identifiers.
+    The (expensive) canonicalization of the blank nodes is performed only if the graph contains any.
+    :param graph: The graph
+    :return: The hex digest of the graph
+    """
+    has_bnodes = any(isinstance(s, BNode) or isinstance(o, BNode) for s, _, o in graph)
+    if has_bnodes:
+        graph = to_canonical_graph(graph)
+    return combine_digests(subject_digests(graph))
+
+
+def results_by_focus_node(results_graph: Graph, ignore_severities=()) -> dict:
+    """
+    Group the messages of a SHACL results graph by focus node
+    :param results_graph: The results graph returned by pyshacl
+    :param ignore_severities: The severities (e.g. SH.Warning) that do not make the graph non-conforming
+    :return: dict focus node -> list of ValidationResult
+    """
+    failing = {}
+    for node, result in iter_results(results_graph, ignore_severities):
+        failing.setdefault(results_graph.value(node, SH.focusNode), []).append(result)
+    return failing
 
 
 class BasicValidationInterface:
@@ -27,103 +171,423 @@ class BasicValidationInterface:
     https://github.com/gtfierro/shapes/blob/main/verify.py
     """
 
-    def __init__(self, graph: Graph):
-        # use the wrapper BrickGraph to initialize the graph
+    def __init__(self, graph: Graph, ontology: Graph = None):
+        # the data graph is never modified, the ontology is kept in a separate (shared) graph
         self.graph = graph
-        self.graph.parse(os.path.join(os.path.dirname(__file__), "..", "libraries", "Brick-nightly.ttl"), format='ttl')
+        # the Brick ontology is parsed once per process and shared
+        self.ontology = ontology if ontology is not None else load_brick_ontology()
+        self.report = ValidationReport()
 
     def validate(self) -> bool:
         """
         Validate the graph
-        :return: print the validation report
+        :return: bool indicating whether the graph is valid, the ValidationReport is stored in report and its summary is
+        logged if not
         """
+        import pyshacl
+
         # validate
-        valid, results_graph, report = pyshacl.validate(self.graph,
-                                                        shacl_graph=self.graph,
-                                                        ont_graph=self.graph,
-                                                        inference='rdfs',
-                                                        abort_on_first=False,
-                                                        allow_infos=False,
-                                                        allow_warnings=False,
-                                                        meta_shacl=False,
-                                                        advanced=False,
-                                                        js=False,
-                                                        debug=False)
-
-        logger.debug(f"[Brick] Is valid? {valid}")
+        # pyshacl mixes the ontology into a copy of the data graph before the inference
+        valid, results_graph, _ = pyshacl.validate(self.graph,
+                                                   shacl_graph=self.ontology,
+                                                   ont_graph=self.ontology,
+                                                   inference='rdfs',
+                                                   abort_on_first=False,
+                                                   allow_infos=False,
+                                                   allow_warnings=False,
+                                                   meta_shacl=False,
+                                                   advanced=False,
+                                                   js=False,
+                                                   debug=False)
+
+        logger.debug("[Brick] Is valid? %s", valid)
+        # the results are parsed only if accessed (or logged)
+        self.report = ValidationReport(results_graph)
         if not valid:
-            print("-" * 79)
-            print(report)
-            print("-" * 79)
+            logger.warning("[Brick] The metadata does not conform to Brick\n%s", self.report)
 
         return valid
 
 
+# shared-cache in-memory sqlite database: no disk I/O and visible from every connection of the process
+IN_MEMORY_DB = "sqlite:///file:portable_app_framework?mode=memory&cache=shared&uri=true"
+
+# process wide BuildingMOTIF sessions (db uri -> session)
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class BuildingMotifSession:
+    """
+    This class is used to keep a long-lived BuildingMOTIF instance to validate many graphs.
+    The engine and the tables are created once, the manifests are loaded once (and reloaded only if the file changes)
+    and each validation creates its model in a transaction that is rolled back afterwards, leaving the database clean.
+    BuildingMOTIF is a singleton, so use get_building_motif_session to share one session per process.
+    """
+
+    def __init__(self, db_uri: str = IN_MEMORY_DB):
+        from buildingmotif import BuildingMOTIF
+
+        # BuildingMOTIF is a singleton: drop the instance bound to another database
+        if hasattr(BuildingMOTIF, 'instance') and BuildingMOTIF.instance.db_uri != db_uri:
+            BuildingMOTIF.instance.close()
+            BuildingMOTIF.clean()
+        self.db_uri = db_uri
+        root = logging.getLogger()
+        root_level, root_handlers = root.level, list(root.handlers)
+        self.building_motif = BuildingMOTIF(db_uri)
+        # BuildingMOTIF configures the root logger (DEBUG level, file and console handlers): restore it and keep the
+        # debug calls of BuildingMOTIF disabled
+        for handler in list(root.handlers):
+            if handler not in root_handlers:
+                root.removeHandler(handler)
+                handler.close()
+        root.setLevel(root_level)
+        logging.getLogger('buildingmotif').setLevel(logging.WARNING)
+        self.building_motif.setup_tables()
+        # the libraries imported by the manifests are resolved by name at every validation
+        from buildingmotif.dataclasses import Library
+        for ontology in BUILDING_MOTIF_LIBRARIES:
+            Library.load(ontology_graph=building_motif_library_path(ontology))
+        self.building_motif.session.commit()
+        # manifest path -> (mtime, shape collection)
+        self.shape_collections = {}
+        self._lock = threading.Lock()
+
+    def _shape_collection(self, manifest: str):
+        """
+        Load the manifest as a BuildingMOTIF library once
+        :param manifest: The path to the manifest.ttl
+        :return: The shape collection of the manifest
+        """
+        from buildingmotif.dataclasses import Library
+
+        manifest = os.path.abspath(manifest)
+        mtime = os.stat(manifest).st_mtime_ns
+        if manifest not in self.shape_collections or self.shape_collections[manifest][0] != mtime:
+            logger.debug("[BuildingMOTIF] Loading manifest %s", manifest)
+            library = Library.load(ontology_graph=manifest)
+            # the libraries outlive the models that are rolled back after each validation
+            self.building_motif.session.commit()
+            self.shape_collections[manifest] = (mtime, library.get_shape_collection())
+        return self.shape_collections[manifest][1]
+
+    def validate(self, graph: Graph, manifest: str):
+        """
+        Validate a graph against the shapes of a manifest
+        :param graph: The data graph
+        :param manifest: The path to the manifest.ttl
+        :return: The BuildingMOTIF ValidationContext
+        """
+        from buildingmotif.dataclasses import Model
+
+        with self._lock:
+            shape_collection = self._shape_collection(manifest)
+            try:
+                model = Model.create(Namespace('urn:example#'), description="")
+                model.add_graph(graph)
+                return model.validate([shape_collection])
+            finally:
+                # discard the model
+                self.building_motif.session.rollback()
+
+    def close(self) -> None:
+        """
+        Close the BuildingMOTIF instance
+        :return: None
+        """
+        from buildingmotif import BuildingMOTIF
+
+        with _SESSIONS_LOCK:
+            _SESSIONS.pop(self.db_uri, None)
+        self.building_motif.close()
+        BuildingMOTIF.clean()
+
+
+def get_building_motif_session(db_uri: str = IN_MEMORY_DB) -> BuildingMotifSession:
+    """
+    Get the BuildingMOTIF session of the process, creating it on the first call
+    :param db_uri: The database uri, by default an in-memory sqlite database
+    :return: The shared session
+    """
+    with _SESSIONS_LOCK:
+        if db_uri not in _SESSIONS:
+            # only one BuildingMOTIF instance can live in a process
+            _SESSIONS.clear()
+            _SESSIONS[db_uri] = BuildingMotifSession(db_uri)
+        return _SESSIONS[db_uri]
+
+
 class BuildingMotifValidationInterface:
     """
     This class is used to validate a graph using the Buildingmotif validation as described here:
     https://github.com/NREL/BuildingMOTIF
     """
 
-    def __init__(self, graph: Graph, app_name: str):
+    def __init__(self, graph: Graph, app_name: str, ontology: Graph = None, manifest: str = None,
+                 session: BuildingMotifSession = None):
         # Define graph path
         self.app_name = app_name
         self.graph = graph
+        self.ontology = ontology if ontology is not None else load_brick_ontology()
+        self.manifest = manifest if manifest is not None else os.path.join("app", app_name, "manifest.ttl")
+        self.session = session
+        self.report = ValidationReport()
 
     def validate(self) -> bool:
         """
         Validate the graph
-        :return: print the validation report
+        :return: bool indicating whether the graph is valid, the ValidationReport is stored in report and its summary is
+        logged if not
         """
-        # todo dismiss logger buildingmotif
-        db_name = "test.db"
-        self.clear_db(db_name)
-        building_motif = None
         valid = False
         try:
-            building_motif = BuildingMOTIF(f"sqlite:///{db_name}")
-            building_motif.setup_tables()
-            ex = Namespace(f'urn:example#')
-            # create the building model
-            model = Model.create(ex, description="")
-            model.add_graph(self.graph)
-            manifest = Library.load(ontology_graph=f"app/{self.app_name}/manifest.ttl")
-            model.update_manifest(manifest.get_shape_collection())
-            validation_result = model.validate()
+            session = self.session if self.session is not None else get_building_motif_session()
+            # the manifest shapes (e.g. sh:class) need the Brick class hierarchy of the data
+            validation_result = session.validate(expand_types(self.graph, self.ontology), self.manifest)
             valid = validation_result.valid
+            self.report = ValidationReport(validation_result.report)
 
-            # if not valid print the validation results
+            # if not valid log the validation results
             if not validation_result.valid:
-                print("-" * 79)  # just a separator for better error display
-                print(validation_result.report_string)
-                print("-" * 79)
+                logger.warning("[BuildingMOTIF] The metadata does not conform to the manifest of %s\n%s", self.app_name,
+                               self.report)
 
         except Exception as e:
-            print(f"Error during validation of manifest: {e}")
-
-        finally:
-            if building_motif:
-                building_motif.close()
+            self.report = ValidationReport(errors=[f"Error during validation of manifest: {e}"])
+            logger.error("[BuildingMOTIF] %s", self.report)
 
         return valid
 
-    @staticmethod
-    def clear_db(db_name: str):
+
+class CombinedManifestValidationInterface:
+    """
+    This class is used to validate a graph against the manifests of many apps in a single SHACL pass.
+    The shapes of each manifest are renamed in an app specific namespace (so that shapes with the same IRI in different
+    manifests do not merge) and the violations are attributed back to the app owning the source shape.
+    """
+
+    def __init__(self, manifests: dict, ontology: Graph = None):
+        self.ontology = ontology if ontology is not None else load_brick_ontology()
+        self.app_names = list(manifests.keys())
+        self.reports = {}
+        self.shapes_graph = Graph()
+        # shape node -> app name
+        self.shape_owner = {}
+        # the libraries imported by the manifests are shared by the apps, they are not renamed
+        libraries = Graph()
+        for app_name, manifest in manifests.items():
+            manifest_graph = Graph()
+            manifest_graph.parse(manifest, format='ttl')
+            libraries += resolve_imports(manifest_graph, manifest)
+            # only the shapes are renamed: the classes and nodes declared by the manifest must match the data graph
+            shapes = shape_nodes(manifest_graph)
+            renamed = {
+                node: URIRef(f'urn:portable_app_framework:{app_name}:{node}')
+                for node in shapes if isinstance(node, URIRef)
+            }
+            for s, p, o in manifest_graph:
+                self.shapes_graph.add((renamed.get(s, s), p, renamed.get(o, o)))
+            for node in shapes:
+                self.shape_owner[renamed.get(node, node)] = app_name
+            # the blank nodes (e.g., the nested shapes) are private to the manifest
+            for node in set(manifest_graph.subjects()):
+                if isinstance(node, BNode):
+                    self.shape_owner[node] = app_name
+        self.shapes_graph += libraries
+
+    def validate(self, graph: Graph) -> dict:
         """
-        Connect to a dataset and clear all the tables
-        :param db_name: db file name
-        :return:
+        Validate the graph against all the manifests
+        :param graph: The data graph
+        :return: dict app name -> bool indicating whether the graph conforms to the app manifest
         """
-        conn = lite.connect(db_name)
-        cur = conn.cursor()
+        import pyshacl
 
-        try:
-            cur.execute("PRAGMA foreign_keys = OFF;")
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cur.fetchall()
-            for table in tables:
-                cur.execute(f"DELETE FROM {table[0]};")
-            cur.execute("PRAGMA foreign_keys = ON;")
-            conn.commit()
-        finally:
-            conn.close()
+        _, results_graph, _ = pyshacl.validate(expand_types(graph, self.ontology),
+                                               shacl_graph=self.shapes_graph,
+                                               ont_graph=self.shapes_graph,
+                                               advanced=True,
+                                               allow_warnings=True)
+
+        results = {app_name: [] for app_name in self.app_names}
+        for node, result in iter_results(results_graph, ignore_severities=(SH.Warning,)):
+            app_name = self.shape_owner.get(results_graph.value(node, SH.sourceShape))
+            if app_name is None:
+                # unknown source shape: it cannot be attributed, fail every app to be safe
+                for app_results in results.values():
+                    app_results.append(result)
+            else:
+                results[app_name].append(result)
+
+        self.reports = {app_name: ValidationReport(results=app_results) for app_name, app_results in results.items()}
+        return {app_name: report.conforms for app_name, report in self.reports.items()}
+
+
+class IncrementalValidationInterface:
+    """
+    This class is used to validate a graph incrementally against both the Brick shapes and the app manifest.
+    The interface remembers the digest of each subject of the last validated graph and the failing focus nodes.
+    On the next call:
+    - if the graph digest is unchanged the cached verdict is returned immediately
+    - otherwise only the subjects that changed (and the nodes that point to them, up to dependency_depth hops) are
+    validated again on the subgraph that describes them.
+    The manifest shapes are evaluated with pyshacl directly (BuildingMOTIF would require a full model rebuild), and
+    shapes depending on paths longer than dependency_depth + 1 hops may need a full validation (reset()).
+    If the manifest imports a BuildingMOTIF library (e.g., constraint:exactCount counts the instances of the whole
+    graph) the manifest shapes are evaluated on the full graph whenever it changes.
+    """
+
+    def __init__(self, manifest: str, ontology: Graph = None, dependency_depth: int = 1):
+        self.manifest = manifest
+        self.ontology = ontology if ontology is not None else load_brick_ontology()
+        self.dependency_depth = dependency_depth
+        self.manifest_graph = Graph()
+        self.manifest_graph.parse(manifest, format='ttl')
+        libraries = resolve_imports(self.manifest_graph, manifest)
+        # the constraints of the libraries are not local to the changed nodes
+        self.global_manifest = len(libraries) > 0
+        self.manifest_graph += libraries
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the state of the last validation so that the next call runs a full validation
+        :return: None
+        """
+        self.digests = None
+        self.digest = None
+        self.failing = {}
+        # failures of the manifest shapes evaluated on the full graph (global_manifest)
+        self.manifest_failing = {}
+        self.valid = None
+
+    @property
+    def report(self) -> ValidationReport:
+        """
+        Report of the failing focus nodes of the last validation
+        :return: The ValidationReport
+        """
+        return ValidationReport(results=[result for failing in (self.failing, self.manifest_failing)
+                                         for results in failing.values() for result in results])
+
+    def validate(self, graph: Graph) -> bool:
+        """
+        Validate the graph, reusing the results of the previous call where the graph did not change
+        :param graph: The data graph
+        :return: bool indicating whether the graph conforms
+        """
+        digests = subject_digests(graph)
+        digest = combine_digests(digests)
+        if digest == self.digest:
+            logger.debug("[Incremental] Graph unchanged, cached verdict %s", self.valid)
+            return self.valid
+
+        if self.digests is None:
+            # first run: validate everything
+            affected = None
+            subgraph = graph
+        else:
+            changed = {s for s in digests.keys() | self.digests.keys() if digests.get(s) != self.digests.get(s)}
+            affected = self._dependants(graph, changed)
+            subgraph = self._describe(graph, affected)
+            logger.debug("[Incremental] %s subjects changed, %s nodes to validate", len(changed), len(affected))
+
+        failing = self._validate_subgraph(subgraph, manifest=not self.global_manifest)
+        if self.global_manifest:
+            self.manifest_failing = self._validate_manifest(graph)
+        if affected is None:
+            self.failing = failing
+        else:
+            # keep the previous failures of the untouched nodes that still exist in the graph
+            self.failing = {
+                node: results for node, results in self.failing.items()
+                if node not in affected and ((node, None, None) in graph or (None, None, node) in graph)
+            }
+            self.failing.update({node: results for node, results in failing.items() if node in affected})
+
+        self.digests = digests
+        self.digest = digest
+        self.valid = len(self.failing) == 0 and len(self.manifest_failing) == 0
+        logger.debug("[Incremental] Is valid? %s", self.valid)
+        if not self.valid:
+            logger.warning("[Incremental] The metadata does not conform\n%s", self.report)
+
+        return self.valid
+
+    def _dependants(self, graph: Graph, nodes: set) -> set:
+        """
+        Expand a set of nodes with the subjects that point to them, up to dependency_depth hops
+        :param graph: The data graph
+        :param nodes: The changed nodes
+        :return: The set of nodes whose validation may be affected
+        """
+        affected = set(nodes)
+        frontier = set(nodes)
+        for _ in range(self.dependency_depth):
+            frontier = {s for node in frontier for s in graph.subjects(None, node)} - affected
+            affected |= frontier
+        return affected
+
+    def _describe(self, graph: Graph, nodes: set) -> Graph:
+        """
+        Extract the triples describing the nodes, following the outgoing edges up to dependency_depth + 1 hops
+        :param graph: The data graph
+        :param nodes: The nodes to describe
+        :return: The subgraph
+        """
+        subgraph = Graph()
+        visited = set()
+        frontier = set(nodes)
+        for _ in range(self.dependency_depth + 1):
+            visited |= frontier
+            objects = set()
+            for node in frontier:
+                for p, o in graph.predicate_objects(node):
+                    subgraph.add((node, p, o))
+                    if not isinstance(o, Literal):
+                        objects.add(o)
+            frontier = objects - visited
+        return subgraph
+
+    def _validate_subgraph(self, graph: Graph, manifest: bool = True) -> dict:
+        """
+        Validate a (sub)graph against the Brick shapes and the manifest shapes
+        :param graph: The data graph
+        :param manifest: Whether to validate the subgraph against the manifest shapes as well
+        :return: dict focus node -> list of ValidationResult
+        """
+        import pyshacl
+
+        _, brick_results, _ = pyshacl.validate(graph,
+                                               shacl_graph=self.ontology,
+                                               ont_graph=self.ontology,
+                                               inference='rdfs',
+                                               abort_on_first=False,
+                                               allow_infos=False,
+                                               allow_warnings=False,
+                                               meta_shacl=False,
+                                               advanced=False,
+                                               js=False,
+                                               debug=False)
+
+        failing = results_by_focus_node(brick_results)
+        if manifest:
+            for node, results in self._validate_manifest(graph).items():
+                failing.setdefault(node, []).extend(results)
+        return failing
+
+    def _validate_manifest(self, graph: Graph) -> dict:
+        """
+        Validate a (sub)graph against the manifest shapes
+        :param graph: The data graph
+        :return: dict focus node -> list of ValidationResult
+        """
+        import pyshacl
+
+        _, manifest_results, _ = pyshacl.validate(expand_types(graph, self.ontology),
+                                                  shacl_graph=self.manifest_graph,
+                                                  ont_graph=self.manifest_graph,
+                                                  advanced=True,
+                                                  allow_warnings=True)
+        return results_by_focus_node(manifest_results, ignore_severities=(SH.Warning,))
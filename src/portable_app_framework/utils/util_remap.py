@@ -0,0 +1,118 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_remap.py
+Path:         utils
+
+Script Description:
+This script contains the compiled mapping between the internal naming convention (i.e., the variables of the SPARQL
+query) and the external naming convention (i.e., the names of the points in the building) used to rename the data.
+
+Notes:
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class RemapIndex:
+    """
+    This class is used to rename the columns of a dataframe between internal and external names.
+    It is built once from the fetch result, either {i: {var: name}} (one entry per binding) or a flat {var: name}, and
+    resolves the columns with vectorized index lookups. When the app has several bindings the mapping is many-to-one:
+    the external columns of all the bindings map to the same internal name (unless a binding is selected) and the
+    repeated internal columns map back to the external names in binding order.
+
+    example:
+    index = RemapIndex(app.fetch())
+    df_internal = index.rename(df, mode='to_internal')
+    """
+
+    def __init__(self, fetch_map_dict: dict):
+        if fetch_map_dict and all(isinstance(value, dict) for value in fetch_map_dict.values()):
+            self.bindings = [dict(binding) for binding in fetch_map_dict.values()]
+        else:
+            self.bindings = [dict(fetch_map_dict)]
+
+        # internal name -> external names in binding order
+        self.to_external = {}
+        # external name -> internal name
+        self.to_internal = {}
+        for binding in self.bindings:
+            for internal, external in binding.items():
+                names = self.to_external.setdefault(internal, [])
+                if external not in names:
+                    names.append(external)
+                self.to_internal.setdefault(external, internal)
+
+        # lookup indexes: external name -> internal name, (internal name, occurrence) -> external name
+        self._internal_index = pd.Index(list(self.to_internal.keys()), dtype=object)
+        self._internal_targets = np.array(list(self.to_internal.values()), dtype=object)
+        self._external_index = pd.MultiIndex.from_tuples(
+            [(internal, k) for internal, names in self.to_external.items() for k in range(len(names))],
+            names=['internal', 'occurrence'])
+        self._external_targets = np.array(
+            [name for names in self.to_external.values() for name in names], dtype=object)
+        self.unmapped = []
+
+    def external_columns(self, binding: int = None) -> list:
+        """
+        Get the external names of the points required by the app
+        :param binding: Optional position of the binding, by default all the bindings
+        :return: list of the external names in binding order
+        """
+        if binding is not None:
+            return list(dict.fromkeys(self.bindings[binding].values()))
+        return list(self.to_internal.keys())
+
+    def columns(self, columns, mode: str, binding: int = None) -> pd.Index:
+        """
+        Compute the renamed columns
+        :param columns: The columns to rename
+        :param mode: The mode of the mapping (to_internal or to_external)
+        :param binding: Optional position of the binding to use, by default all the bindings
+        :return: The renamed columns. The columns without a mapping are kept and listed in self.unmapped
+        """
+        values = np.asarray(columns, dtype=object)
+
+        if binding is not None:
+            mapping = self.bindings[binding]
+            if mode == 'to_internal':
+                mapping = {v: k for k, v in mapping.items()}
+            keys = pd.Index(list(mapping.keys()), dtype=object)
+            targets = np.array(list(mapping.values()), dtype=object)
+            positions = keys.get_indexer(values)
+        elif mode == 'to_internal':
+            targets = self._internal_targets
+            positions = self._internal_index.get_indexer(values)
+        else:
+            # the k-th column with the same internal name maps to the k-th external name
+            occurrence = pd.Series(values).groupby(values, sort=False).cumcount().to_numpy()
+            targets = self._external_targets
+            positions = self._external_index.get_indexer(pd.MultiIndex.from_arrays([values, occurrence]))
+
+        mapped = positions >= 0
+        renamed = values.copy()
+        renamed[mapped] = targets[positions[mapped]]
+        self.unmapped = list(values[~mapped])
+        return pd.Index(renamed)
+
+    def rename(self, data: pd.DataFrame, mode: str, binding: int = None, inplace: bool = False) -> pd.DataFrame:
+        """
+        Rename the columns of a dataframe without copying the data
+        :param data: The dataframe to be mapped
+        :param mode: The mode of the mapping (to_internal or to_external)
+        :param binding: Optional position of the binding to use, by default all the bindings
+        :param inplace: If True rename the columns of data, otherwise return a shallow copy sharing the data
+        :return: The mapped dataframe
+        """
+        if mode not in ('to_internal', 'to_external'):
+            raise ValueError(f'Invalid mode {mode}. Please choose between to_external or to_internal')
+        columns = self.columns(data.columns, mode, binding=binding)
+        if not inplace:
+            data = data.copy(deep=False)
+        data.columns = columns
+        return data
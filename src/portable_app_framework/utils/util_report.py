@@ -0,0 +1,322 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_report.py
+Path:         utils
+
+Script Description:
+This script contains the structured report of the validations (Brick, BuildingMOTIF, incremental). A ValidationReport
+wraps the SHACL results graph and converts it to ValidationResult tuples (focus node, shape, severity, message, path,
+value) only when the results are accessed. The report can be summarized with a bounded number of results, truncated
+(e.g., before being cached) and aggregated across many buildings, e.g. to count the violations per shape of a fleet.
+
+Example code:
+
+from portable_app_framework.utils.util_report import ValidationReport
+
+app.qualify()
+report = app.res_qualify_report
+print(report)  # bounded summary
+report.count_by('shape').most_common(5)
+ValidationReport.aggregate(reports).most_common(10)
+
+Notes:
+The shapes are labelled by their CURIE. The blank node shapes (e.g., the property shapes of Brick) are labelled by their
+sh:name or sh:message, or by the constraint component and the path, so that the labels are stable across validations.
+"""
+
+from collections import Counter
+from typing import NamedTuple
+
+from rdflib import BNode, Graph, RDF, SH
+
+from .util_brick import TermResolver
+
+# results shown by the summary (str) of a report
+MAX_RESULTS = 10
+# results kept by the reports stored in the qualify cache
+MAX_STORED_RESULTS = 100
+# fields whose counts are kept by the truncated reports
+COUNTED_FIELDS = ('shape', 'severity')
+
+
+class ValidationResult(NamedTuple):
+    """
+    One result of a SHACL validation
+    """
+    focus_node: str
+    shape: str
+    # local name of the severity (Violation, Warning, Info)
+    severity: str
+    message: str
+    # None if the result has no path or value node
+    path: str
+    value: str
+
+
+def _shape_label(graph: Graph, shape, component, resolver: TermResolver) -> str:
+    """
+    Get a stable label of the source shape of a result
+    :param graph: The results graph (pyshacl copies the description of the source shapes)
+    :param shape: The source shape
+    :param component: The source constraint component of the result
+    :param resolver: The resolver of the CURIEs
+    :return: The label of the shape
+    """
+    if not isinstance(shape, BNode):
+        return str(resolver.curie(shape))
+    label = graph.value(shape, SH.name) or graph.value(shape, SH.message)
+    if label is not None:
+        return str(label)
+    # the blank node ids change at every validation
+    path = graph.value(shape, SH.path)
+    parts = [resolver.local_name(component) if component is not None else 'Shape']
+    if path is not None:
+        parts.append(str(resolver.curie(path)))
+    return ' '.join(parts)
+
+
+def iter_results(results_graph: Graph, ignore_severities=()):
+    """
+    Iterate over the results of a SHACL results graph
+    :param results_graph: The results graph (e.g., returned by pyshacl or BuildingMOTIF)
+    :param ignore_severities: The severities (e.g. SH.Warning) to skip
+    :return: generator of tuples (result node, ValidationResult)
+    """
+    resolver = TermResolver(results_graph.namespace_manager)
+    shapes = {}
+    for node in results_graph.subjects(RDF.type, SH.ValidationResult):
+        severity = results_graph.value(node, SH.resultSeverity)
+        if severity in ignore_severities:
+            continue
+        shape = results_graph.value(node, SH.sourceShape)
+        component = results_graph.value(node, SH.sourceConstraintComponent)
+        if (shape, component) not in shapes:
+            shapes[shape, component] = _shape_label(results_graph, shape, component, resolver) \
+                if shape is not None else None
+        message = results_graph.value(node, SH.resultMessage)
+        path = results_graph.value(node, SH.resultPath)
+        value = results_graph.value(node, SH.value)
+        yield node, ValidationResult(
+            focus_node=str(results_graph.value(node, SH.focusNode)),
+            shape=shapes[shape, component],
+            severity=resolver.local_name(severity) if severity is not None else None,
+            message=str(message) if message is not None else None,
+            path=str(resolver.curie(path)) if path is not None else None,
+            value=str(value) if value is not None else None,
+        )
+
+
+def parse_results(results_graph: Graph, ignore_severities=()) -> list:
+    """
+    Convert a SHACL results graph to a list of ValidationResult
+    :param results_graph: The results graph
+    :param ignore_severities: The severities (e.g. SH.Warning) to skip
+    :return: list of ValidationResult
+    """
+    return [result for _, result in iter_results(results_graph, ignore_severities)]
+
+
+class ValidationReport:
+    """
+    This class is the report of a validation. The results are parsed from the results graph on first access, the
+    number of results is counted without parsing them. A report is falsy if it has no results and no errors.
+
+    example:
+    report = ValidationReport(results_graph)
+    len(report), report.conforms
+    report.top(5)  # the 5 shapes with most results
+    print(report.summary(max_results=20))
+    """
+
+    def __init__(self, results_graph: Graph = None, results: list = None, errors: list = None,
+                 ignore_severities=()):
+        """
+        :param results_graph: Optional SHACL results graph
+        :param results: Optional list of ValidationResult, if there is no results graph
+        :param errors: Optional messages of the errors that prevented the validation
+        :param ignore_severities: The severities (e.g. SH.Warning) of the results graph to skip
+        """
+        self.results_graph = results_graph
+        self.ignore_severities = tuple(ignore_severities)
+        self._results = list(results) if results is not None else None
+        self._errors = list(errors) if errors is not None else []
+        # reports combined by combine(), their results are concatenated on first access
+        self._parts = None
+        # total and counts of a truncated report (from_dict)
+        self._total = None
+        self._counts = None
+
+    @property
+    def results(self) -> list:
+        """
+        The results of the validation
+        :return: list of ValidationResult
+        """
+        if self._results is None:
+            if self._parts is not None:
+                self._results = [result for part in self._parts for result in part.results]
+            elif self.results_graph is not None:
+                self._results = parse_results(self.results_graph, self.ignore_severities)
+            else:
+                self._results = []
+        return self._results
+
+    @property
+    def errors(self) -> list:
+        """
+        The errors that prevented the validation (e.g., a manifest that cannot be loaded)
+        :return: list of messages
+        """
+        if self._parts is not None:
+            return [error for part in self._parts for error in part.errors]
+        return self._errors
+
+    @property
+    def conforms(self) -> bool:
+        return len(self) == 0 and not self.errors
+
+    @property
+    def truncated(self) -> bool:
+        return len(self) > len(self.results)
+
+    def __len__(self):
+        if self._parts is not None:
+            return sum(len(part) for part in self._parts)
+        if self._total is not None:
+            return self._total
+        if self._results is None and self.results_graph is not None:
+            return sum(1 for node in self.results_graph.subjects(RDF.type, SH.ValidationResult)
+                       if self.results_graph.value(node, SH.resultSeverity) not in self.ignore_severities)
+        return len(self.results)
+
+    def __bool__(self):
+        return not self.conforms
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __str__(self):
+        return self.summary()
+
+    def __repr__(self):
+        return f'<ValidationReport conforms={self.conforms} results={len(self)}>'
+
+    def __getstate__(self):
+        # the results graph is not sent to the other processes (qualify_many)
+        state = self.__dict__.copy()
+        state.update(results_graph=None, _results=self.results, _errors=self.errors, _parts=None)
+        if self._parts is not None and self.truncated:
+            state.update(_total=len(self), _counts={field: self.count_by(field) for field in COUNTED_FIELDS})
+        return state
+
+    def count_by(self, field: str = 'shape') -> Counter:
+        """
+        Count the results by a field of ValidationResult
+        :param field: The field (e.g., shape, severity, focus_node)
+        :return: Counter of the values of the field
+        """
+        if self._parts is not None:
+            return sum((part.count_by(field) for part in self._parts), Counter())
+        if self._counts is not None and field in self._counts:
+            return Counter(self._counts[field])
+        return Counter(getattr(result, field) for result in self.results)
+
+    def top(self, n: int = MAX_RESULTS, field: str = 'shape') -> list:
+        """
+        Get the most frequent values of a field
+        :param n: The number of values
+        :param field: The field of ValidationResult
+        :return: list of tuples (value, count)
+        """
+        return self.count_by(field).most_common(n)
+
+    def summary(self, max_results: int = MAX_RESULTS) -> str:
+        """
+        Summarize the report: the number of results per severity, the shapes with most results and the first results
+        :param max_results: The maximum number of results and shapes in the summary
+        :return: The summary, empty if the graph conforms
+        """
+        lines = []
+        total = len(self)
+        if total:
+            severities = ', '.join(f'{count} {severity}' for severity, count in self.top(None, 'severity'))
+            lines.append(f'{total} results ({severities})')
+            lines.append('Shapes: ' + ', '.join(f'{shape} ({count})' for shape, count in self.top(max_results)))
+            shown = self.results[:max_results]
+            lines += [f'- {self._format(result)}' for result in shown]
+            if total > len(shown):
+                lines.append(f'... {total - len(shown)} more results')
+        lines += self.errors
+        return '\n'.join(lines)
+
+    def to_text(self) -> str:
+        """
+        Get the full text report, one line per result
+        :return: The report
+        """
+        return '\n'.join([self._format(result) for result in self.results] + self.errors)
+
+    @staticmethod
+    def _format(result: ValidationResult) -> str:
+        # the blank node shapes are often labelled by their message
+        shape = f' [{result.shape}]' if result.shape != result.message else ''
+        return f'{result.focus_node}: {result.message}{shape}'
+
+    def to_dict(self, max_results: int = None) -> dict:
+        """
+        Convert the report to a JSON serializable dict
+        :param max_results: Optional maximum number of results to keep, the total and the counts per shape and severity
+        are kept anyway
+        :return: dict with conforms, total, counts, results and errors
+        """
+        results = self.results if max_results is None else self.results[:max_results]
+        return {
+            'conforms': self.conforms,
+            'total': len(self),
+            'counts': {field: dict(self.count_by(field)) for field in COUNTED_FIELDS},
+            'results': [list(result) for result in results],
+            'errors': self.errors,
+        }
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> 'ValidationReport':
+        """
+        Create a report from the dict of to_dict
+        :param entry: The dict
+        :return: The report
+        """
+        report = cls(results=[ValidationResult(*result) for result in entry.get('results', [])],
+                     errors=entry.get('errors'))
+        report._total = entry.get('total', len(report._results))
+        report._counts = {field: Counter(counts) for field, counts in entry.get('counts', {}).items()}
+        return report
+
+    @classmethod
+    def combine(cls, *reports) -> 'ValidationReport':
+        """
+        Combine the reports of many validations of a graph (e.g., Brick and BuildingMOTIF), without parsing them
+        :param reports: The reports, None are skipped and strings are kept as errors
+        :return: The combined report
+        """
+        combined = cls()
+        combined._parts = [report if isinstance(report, ValidationReport) else cls(errors=[report])
+                           for report in reports if report]
+        return combined
+
+    @staticmethod
+    def aggregate(reports, field: str = 'shape') -> Counter:
+        """
+        Count the results of many reports (e.g., of a fleet of buildings) by a field
+        :param reports: The reports, the ones that are not ValidationReport (e.g., None) are skipped
+        :param field: The field of ValidationResult
+        :return: Counter of the values of the field
+        """
+        counts = Counter()
+        for report in reports:
+            if isinstance(report, ValidationReport):
+                counts.update(report.count_by(field))
+        return counts
@@ -0,0 +1,90 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  util_stream.py
+Path:         utils
+
+Script Description:
+This script contains the helpers to stream the data through the preprocess and analyze functions of an app in
+time-windowed chunks, so that the peak memory is bounded by the chunk size and not by the dataset size.
+
+Notes:
+The chunks must be sorted by their DatetimeIndex (e.g., pd.read_csv(..., index_col=0, parse_dates=True, chunksize=N)).
+"""
+
+import pandas as pd
+
+
+def iter_time_windows(chunks, window):
+    """
+    Re-chunk a stream of dataframes into time windows aligned to the window frequency
+    :param chunks: A dataframe or an iterable of dataframes sorted by their DatetimeIndex
+    :param window: The window length as a fixed frequency (e.g., '1D', '6h' or pd.Timedelta)
+    :return: generator of dataframes, one per window
+    """
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    window = pd.Timedelta(window)
+
+    # the buffer holds at most the incomplete last window and one chunk
+    buffer = None
+    for chunk in chunks:
+        buffer = chunk if buffer is None else pd.concat([buffer, chunk])
+        if buffer.empty:
+            continue
+        bins = buffer.index.floor(window)
+        complete = bins < bins[-1]
+        if complete.any():
+            for _, window_data in buffer[complete].groupby(bins[complete]):
+                yield window_data
+            buffer = buffer[~complete]
+
+    if buffer is not None and not buffer.empty:
+        yield buffer
+
+
+def iter_with_overlap(chunks, overlap=None):
+    """
+    Prepend to each chunk the tail of the previous one (e.g., to compute rolling features across the chunk boundaries)
+    :param chunks: An iterable of dataframes sorted by their index
+    :param overlap: The overlap as a number of rows (int) or as a duration (e.g., '1h' or pd.Timedelta)
+    :return: generator of tuples (extended chunk, number of overlap rows prepended)
+    """
+    if overlap is not None and not isinstance(overlap, int):
+        overlap = pd.Timedelta(overlap)
+
+    tail = None
+    for chunk in chunks:
+        if tail is not None and not tail.empty:
+            extended = pd.concat([tail, chunk])
+            n_overlap = len(tail)
+        else:
+            extended = chunk
+            n_overlap = 0
+        yield extended, n_overlap
+
+        if not overlap or extended.empty:
+            tail = None
+        elif isinstance(overlap, int):
+            tail = extended.iloc[-overlap:]
+        else:
+            tail = extended[extended.index > extended.index[-1] - overlap]
+
+
+def trim_overlap(result, chunk_start, n_overlap: int):
+    """
+    Remove from the result of a chunk the rows computed on the overlap
+    :param result: The result of the function applied on the extended chunk
+    :param chunk_start: The first index of the chunk without overlap
+    :param n_overlap: The number of overlap rows prepended to the chunk
+    :return: The result without the overlap rows. Results that are not dataframes or series are returned as they are
+    """
+    if n_overlap == 0 or not isinstance(result, (pd.DataFrame, pd.Series)):
+        return result
+    if isinstance(result.index, pd.DatetimeIndex):
+        # the function may resample the data: trim by time
+        return result[result.index >= chunk_start]
+    return result.iloc[n_overlap:]
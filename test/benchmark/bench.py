@@ -0,0 +1,294 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  bench.py
+Path:         test/benchmark
+
+Script Description:
+This script contains the benchmark suite of the qualify/fetch/remap/preprocess/analyze pipeline. Each benchmark is
+timed on synthetic buildings of increasing size (see generator.py), with the peak memory measured by tracemalloc in a
+separate run, and the results are stored as JSON so that the regressions between releases are visible.
+
+Example code:
+
+python -m test.benchmark.bench --sizes 10 100 1000 10000 100000
+python -m test.benchmark.bench --only fetch remap --compare test/benchmark/results/<previous>.json
+
+Notes:
+Run from the root of the repository (make benchmark). The validation benchmarks are slow (RDFS inference over the
+Brick ontology) and run only up to --max-validation-size points. The larger sizes of a benchmark are skipped (and
+recorded as skipped) when the time of the runs or the peak memory extrapolated linearly from the previous size exceed
+--max-time seconds or --max-memory MiB.
+The remap, preprocess and analyze benchmarks use the mapping of generate_mapping, so that their setup does not run
+the query.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from src.portable_app_framework import Application
+from src.portable_app_framework.utils.util_brick import POINT_METADATA_QUERY, parse_raw_query, prepare_query
+from src.portable_app_framework.utils.util_qualify import BasicValidationInterface
+from src.portable_app_framework.utils.util_qualify import BuildingMotifValidationInterface
+from src.portable_app_framework.utils import util_preprocess
+from test.benchmark.generator import BENCHMARK_QUERY, generate_building, generate_data, generate_mapping
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+ROOT_FOLDER = os.path.dirname(os.path.dirname(BENCHMARK_FOLDER))
+RESULTS_FOLDER = os.path.join(BENCHMARK_FOLDER, 'results')
+# the benchmarks use the test app
+APP_BASE_PATH = os.path.join(ROOT_FOLDER, 'test')
+APP_NAME = 'app_test'
+
+# number of timestamps of the synthetic time series
+N_ROWS = 2880
+
+# name -> (setup, repeat, is_validation, sized)
+BENCHMARKS = {}
+
+
+def benchmark(name: str, repeat: int = 5, validation: bool = False, sized: bool = True):
+    """
+    Register a benchmark. The decorated function receives the size and returns the callable to time, so that the
+    setup (e.g., the generation of the building) is not timed
+    :param name: The name of the benchmark
+    :param repeat: The number of timed runs
+    :param validation: If True the benchmark runs only up to the maximum validation size
+    :param sized: If False the benchmark does not depend on the size and runs once
+    :return: The decorator
+    """
+
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, repeat, validation, sized)
+        return setup
+
+    return decorator
+
+
+def _application(size: int) -> Application:
+    app = Application(metadata=generate_building(size), app_name=APP_NAME, base_path=APP_BASE_PATH)
+    app.query = BENCHMARK_QUERY
+    return app
+
+
+def _external_names(mapping: dict) -> list:
+    return [name for binding in mapping.values() for name in binding.values()]
+
+
+@benchmark('basic_validation', repeat=1, validation=True)
+def bench_basic_validation(size: int):
+    graph = generate_building(size)
+    return lambda: BasicValidationInterface(graph=graph).validate()
+
+
+@benchmark('building_motif_validation', repeat=1, validation=True)
+def bench_building_motif_validation(size: int):
+    app = _application(size)
+    return lambda: BuildingMotifValidationInterface(graph=app.metadata, app_name=APP_NAME,
+                                                    manifest=app.manifest).validate()
+
+
+@benchmark('fetch')
+def bench_fetch(size: int):
+    app = _application(size)
+    return app.fetch
+
+
+@benchmark('parse_raw_query')
+def bench_parse_raw_query(size: int):
+    graph = generate_building(size)
+    # one row per point, the query results are materialized once and only the parsing is timed
+    query_results = graph.query(prepare_query(POINT_METADATA_QUERY))
+    query_results.bindings
+    return lambda: parse_raw_query(query_results)
+
+
+@benchmark('remap')
+def bench_remap(size: int):
+    app = Application(app_name=APP_NAME, base_path=APP_BASE_PATH)
+    mapping, _ = generate_mapping(size)
+    data = generate_data(_external_names(mapping), N_ROWS)
+    return lambda: app.remap(data, mapping, mode='to_internal')
+
+
+@benchmark('preprocess')
+def bench_preprocess(size: int):
+    app = Application(app_name=APP_NAME, base_path=APP_BASE_PATH)
+    app.res_fetch, app.res_fetch_units = generate_mapping(size)
+    data = app.remap(generate_data(_external_names(app.res_fetch), N_ROWS), app.res_fetch, mode='to_internal')
+
+    def preprocess():
+        df = app.convert(data)
+        df = util_preprocess.mask_outliers(df, method='iqr')
+        df = util_preprocess.interpolate(df, limit=4)
+        return util_preprocess.resample(df, app.parameters['aggregation'])
+
+    return preprocess
+
+
+@benchmark('analyze')
+def bench_analyze(size: int):
+    app = Application(app_name=APP_NAME, base_path=APP_BASE_PATH)
+    mapping, _ = generate_mapping(size)
+    data = generate_data(_external_names(mapping), N_ROWS)
+    # one frame per AHU with the internal names
+    frames = [app.remap(data, mapping, mode='to_internal', binding=i) for i in range(len(mapping))]
+
+    def analyze():
+        # a typical rule: timestamps with the mixed air temperature out of the return/outside air range
+        return [((df['t_ma'] > df[['t_ra', 't_oa']].max(axis=1)) |
+                 (df['t_ma'] < df[['t_ra', 't_oa']].min(axis=1))).sum() for df in frames]
+
+    return analyze
+
+
+@benchmark('cli_startup', repeat=5, sized=False)
+def bench_cli_startup(size: int):
+    code = "import sys; sys.argv = ['portable-app-framework', 'ls']; " \
+           "from src.portable_app_framework import cli_entry_point; cli_entry_point()"
+    cwd = tempfile.mkdtemp()
+    env = {**os.environ, 'PYTHONPATH': ROOT_FOLDER}
+    return lambda: subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, check=True, capture_output=True)
+
+
+def measure(function, repeat: int) -> dict:
+    """
+    Time a function and measure its peak memory
+    :param function: The function to measure
+    :param repeat: The number of timed runs
+    :return: dict with the times in seconds, their min and median and the peak memory in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows down the allocations: the memory is measured in a separate run
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'times': times, 'min': min(times), 'median': statistics.median(times), 'peak_memory': peak}
+
+
+def run(sizes: list, only: list = None, max_validation_size: int = 100, max_time: float = 60.0,
+        max_memory: float = 1024.0, repeat: int = None) -> dict:
+    """
+    Run the benchmarks
+    :param sizes: The numbers of points of the synthetic buildings
+    :param only: Optional names of the benchmarks to run
+    :param max_validation_size: The maximum size of the validation benchmarks
+    :param max_time: The time budget in seconds of the measurement of a size (all the runs), the larger sizes of a
+    benchmark are skipped when the time extrapolated linearly from the previous size exceeds it
+    :param max_memory: The peak memory budget in MiB of a single run, applied as max_time
+    :param repeat: Optional number of timed runs overriding the one of each benchmark
+    :return: dict with the metadata of the run and the results
+    """
+    results = []
+    for name, (setup, default_repeat, validation, sized) in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        previous = None
+        for size in sorted(sizes) if sized else [None]:
+            if validation and size > max_validation_size:
+                continue
+            runs = (repeat or default_repeat) + 1
+            if previous is not None and (previous['median'] * runs * size / previous['size'] > max_time or
+                                         previous['peak_memory'] / 2 ** 20 * size / previous['size'] > max_memory):
+                results.append({'name': name, 'size': size, 'skipped': True})
+                print(f"{name:<28} {size:>8} {'skipped':>15}")
+                continue
+            function = setup(size)
+            result = measure(function, repeat or default_repeat)
+            result.update({'name': name, 'size': size})
+            results.append(result)
+            previous = result
+            print(f"{name:<28} {str(size or '-'):>8} {result['median'] * 1e3:>12.2f} ms "
+                  f"{result['peak_memory'] / 2 ** 20:>10.2f} MiB")
+
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(run_results: dict, baseline: dict) -> list:
+    """
+    Compare the results of a run with a baseline run
+    :param run_results: The results of the run
+    :param baseline: The results of the baseline run
+    :return: list of tuples (name, size, median ratio, peak memory ratio), ratios > 1 are regressions
+    """
+    baseline_results = {(r['name'], r['size']): r for r in baseline['results'] if not r.get('skipped')}
+    rows = []
+    for result in run_results['results']:
+        previous = baseline_results.get((result['name'], result['size']))
+        if previous is None or result.get('skipped'):
+            continue
+        rows.append((result['name'], result['size'], result['median'] / previous['median'],
+                     result['peak_memory'] / max(previous['peak_memory'], 1)))
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_FOLDER, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the portable app framework pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help='Numbers of points of the synthetic buildings.')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run.')
+    parser.add_argument('--repeat', type=int, help='Number of timed runs of each benchmark.')
+    parser.add_argument('--max-validation-size', type=int, default=100,
+                        help='Maximum number of points of the validation benchmarks.')
+    parser.add_argument('--max-time', type=float, default=60.0,
+                        help='Time budget in seconds of the runs of a size, larger sizes are skipped when exceeded.')
+    parser.add_argument('--max-memory', type=float, default=1024.0,
+                        help='Peak memory budget in MiB of a single run, larger sizes are skipped when exceeded.')
+    parser.add_argument('--output', default=RESULTS_FOLDER, help='Folder of the JSON results.')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with.')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, only=args.only, max_validation_size=args.max_validation_size,
+                  max_time=args.max_time, max_memory=args.max_memory, repeat=args.repeat)
+
+    os.makedirs(args.output, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    path = os.path.join(args.output, f"{stamp}_{results['commit'] or 'nogit'}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Results stored in {path}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for name, size, time_ratio, memory_ratio in compare(results, baseline):
+            print(f"{name:<28} {str(size or '-'):>8} time x{time_ratio:.2f} memory x{memory_ratio:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Author:       Roberto Chiosa
+Copyright:    Roberto Chiosa, © 2023
+Email:        roberto.chiosa@polito.it
+
+Created:      17/10/26
+Script Name:  generator.py
+Path:         test/benchmark
+
+Script Description:
+This script contains the generators of synthetic Brick buildings and time series used by the benchmarks.
+A building is a set of AHUs, each one with the same template of points (temperatures, valves, fans, ...), so that the
+size of the graph scales linearly with the number of points.
+
+Notes:
+The generators are deterministic: the same arguments return the same graph and data.
+"""
+
+import numpy as np
+import pandas as pd
+from rdflib import Graph, Namespace, RDF
+
+BRICK = Namespace('https://brickschema.org/schema/Brick#')
+UNIT = Namespace('http://qudt.org/vocab/unit/')
+QUDT = Namespace('http://qudt.org/schema/qudt/')
+BLDG = Namespace('http://bldg-59#')
+
+# template of the points of an AHU: (name, Brick class, unit)
+AHU_POINTS = [
+    ('SA_TEMP', BRICK.Supply_Air_Temperature_Sensor, UNIT.DEG_F),
+    ('MA_TEMP', BRICK.Mixed_Air_Temperature_Sensor, UNIT.DEG_F),
+    ('RA_TEMP', BRICK.Return_Air_Temperature_Sensor, UNIT.DEG_F),
+    ('OA_TEMP', BRICK.Outside_Air_Temperature_Sensor, UNIT.DEG_F),
+    ('SA_TEMP_SP', BRICK.Supply_Air_Temperature_Setpoint, UNIT.DEG_F),
+    ('CHW_VLV_CMD', BRICK.Valve_Position_Command, UNIT.PERCENT),
+    ('HW_VLV_CMD', BRICK.Valve_Command, UNIT.PERCENT),
+    ('OA_DMPR_CMD', BRICK.Damper_Position_Command, UNIT.PERCENT),
+    ('SF_SPD_CMD', BRICK.Fan_Speed_Command, UNIT.PERCENT),
+    ('SA_PRESS', BRICK.Supply_Air_Static_Pressure_Sensor, UNIT.IN_H2O),
+]
+
+# SPARQL query of the benchmarks, one binding per AHU.
+# Each point is matched in its own group: in a single basic graph pattern rdflib joins all the brick:hasPoint of an AHU
+# before filtering their classes, i.e. points_per_ahu ** 4 candidates per AHU
+BENCHMARK_QUERY = """
+SELECT ?ahu ?t_sa ?t_ma ?t_ra ?t_oa WHERE {
+    ?ahu a brick:AHU .
+    { ?ahu brick:hasPoint ?t_sa . ?t_sa a brick:Supply_Air_Temperature_Sensor . }
+    { ?ahu brick:hasPoint ?t_ma . ?t_ma a brick:Mixed_Air_Temperature_Sensor . }
+    { ?ahu brick:hasPoint ?t_ra . ?t_ra a brick:Return_Air_Temperature_Sensor . }
+    { ?ahu brick:hasPoint ?t_oa . ?t_oa a brick:Outside_Air_Temperature_Sensor . }
+}
+"""
+# internal name of the variables of BENCHMARK_QUERY -> point of the AHU template
+BENCHMARK_VARIABLES = {'t_sa': 'SA_TEMP', 't_ma': 'MA_TEMP', 't_ra': 'RA_TEMP', 't_oa': 'OA_TEMP'}
+
+
+def _n_ahu(n_points: int) -> int:
+    return max(1, -(-n_points // len(AHU_POINTS)))
+
+
+def generate_building(n_points: int) -> Graph:
+    """
+    Generate a synthetic Brick building
+    :param n_points: The number of points (rounded up to a multiple of the points of an AHU)
+    :return: The graph of the building
+    """
+    graph = Graph()
+    graph.bind('brick', BRICK)
+    graph.bind('unit', UNIT)
+    graph.bind('bldg', BLDG)
+
+    for i in range(_n_ahu(n_points)):
+        ahu = BLDG[f'AHU_{i}']
+        graph.add((ahu, RDF.type, BRICK.AHU))
+        graph.add((ahu, BRICK.feeds, BLDG[f'VAV_{i}']))
+        graph.add((BLDG[f'VAV_{i}'], RDF.type, BRICK.VAV))
+        for name, brick_class, unit in AHU_POINTS:
+            point = BLDG[f'AHU_{i}_{name}']
+            graph.add((point, RDF.type, brick_class))
+            graph.add((ahu, BRICK.hasPoint, point))
+            graph.add((point, BRICK.isPointOf, ahu))
+            if unit is not None:
+                graph.add((point, BRICK.hasUnit, unit))
+    # the units are not defined by the Brick ontology
+    for unit in {unit for _, _, unit in AHU_POINTS if unit is not None}:
+        graph.add((unit, RDF.type, QUDT.Unit))
+    return graph
+
+
+def generate_mapping(n_points: int) -> tuple:
+    """
+    Generate the result of Application.fetch(with_units=True) on generate_building(n_points) with BENCHMARK_QUERY,
+    without running the query
+    :param n_points: The number of points
+    :return: tuple (mapping {i: {var: name}}, units {name: {'unit': ..., 'datatype': ...}})
+    """
+    units = {name: unit.split('/')[-1] for name, _, unit in AHU_POINTS}
+    mapping, point_units = {}, {}
+    for i in range(_n_ahu(n_points)):
+        binding = {'ahu': f'AHU_{i}'}
+        for var, name in BENCHMARK_VARIABLES.items():
+            binding[var] = f'AHU_{i}_{name}'
+            point_units[binding[var]] = {'unit': units[name], 'datatype': None}
+        mapping[i] = binding
+    return mapping, point_units
+
+
+def generate_data(columns: list, n_rows: int, freq: str = '15min', seed: int = 0) -> pd.DataFrame:
+    """
+    Generate synthetic time series for the points of a building
+    :param columns: The names of the columns (e.g., the external names of the fetch mapping)
+    :param n_rows: The number of timestamps
+    :param freq: The sampling frequency
+    :param seed: The seed of the random generator
+    :return: The dataframe indexed by time
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2021-01-01', periods=n_rows, freq=freq, name='timestamp')
+    values = 60 + 10 * rng.standard_normal((n_rows, len(columns)))
+    # some gaps and outliers
+    values.flat[rng.integers(0, values.size, values.size // 100)] = np.nan
+    values.flat[rng.integers(0, values.size, values.size // 1000)] = 1e4
+    return pd.DataFrame(values, index=index, columns=columns)
@@ -1,11 +1,60 @@
+import asyncio
+import io
+import logging
 import os
+import pickle
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+from logging.handlers import QueueHandler
+import numpy as np
 import pandas as pd
-from rdflib import Graph
+import pytest
+from rdflib import Graph, Namespace, RDF, URIRef
+from rdflib.graph import ModificationException
 from src.portable_app_framework import Application
+from src.portable_app_framework import qualify_many
+from src.portable_app_framework import qualify_matrix
+from src.portable_app_framework.utils.logger import ColoredFormatter, CustomLogger, configure_logging, flush_logging
+from src.portable_app_framework.utils.logger import logger
+from src.portable_app_framework.utils.util_app import AppCatalog, get_app_catalog, invalidate_app_catalog
+from src.portable_app_framework.utils.util_async import AsyncPipeline, FileDataSource
+from src.portable_app_framework.utils import util_async
+from src.portable_app_framework.utils.util_data import read_csv_columns
+from src.portable_app_framework.utils.util_brick import TermResolver
+from src.portable_app_framework.utils.util_brick import parse_results
+from src.portable_app_framework.utils.util_brick import prepare_query
+from src.portable_app_framework.utils.util_cache import PreprocessCache, fingerprint
+from src.portable_app_framework.utils.util_cache import QualifyCache
+from src.portable_app_framework.utils.util_metrics import ApplicationStats
+from src.portable_app_framework.utils.util_ontology import CACHE_DIR_ENV, file_digest
+from src.portable_app_framework.utils.util_ontology import load_brick_ontology, load_ontology
+from src.portable_app_framework.utils import util_ontology
+from src.portable_app_framework.utils.util_profile import AppProfiler, aggregate_profiles
+from src.portable_app_framework.utils import util_preprocess
+from src.portable_app_framework.utils.util_qualify import BuildingMotifValidationInterface
+from src.portable_app_framework.utils.util_qualify import CombinedManifestValidationInterface
+from src.portable_app_framework.utils.util_qualify import IncrementalValidationInterface
+from src.portable_app_framework.utils.util_qualify import get_building_motif_session
+from src.portable_app_framework.utils.util_report import ValidationReport
+from test.benchmark import bench, generator
 
 df = pd.DataFrame({'a': [1, 2, 3], 'b': [4, 5, 6]})
 
 
+@pytest.fixture(autouse=True, scope='session')
+def cache_dir(tmp_path_factory):
+    """
+    Keep the on-disk caches (e.g., the compiled ontology) out of the user cache folder
+    :return:
+    """
+    os.environ[CACHE_DIR_ENV] = str(tmp_path_factory.mktemp('cache'))
+    yield os.environ[CACHE_DIR_ENV]
+    os.environ.pop(CACHE_DIR_ENV, None)
+
+
 def load_ttl(name: str) -> Graph:
     """
     Load a ttl file into a graph
@@ -31,13 +80,16 @@ def test_qualify_pass():
     Test that the qualify returns True
     :return:
     """
+    metadata = load_ttl("test_qualify_pass.ttl")
+    n_triples = len(metadata)
     app = Application(
-        metadata=load_ttl("test_qualify_pass.ttl"),
+        metadata=metadata,
         app_name='app_test'
     )
     res = app.qualify()
 
-    assert res is True
+    # the ontology must not be merged into the metadata graph
+    assert res is True and len(metadata) == n_triples
 
 
 def test_qualify_fail():
@@ -54,6 +106,241 @@ def test_qualify_fail():
     assert res is False
 
 
+def test_qualify_incremental():
+    """
+    Test that the incremental qualify reuses the verdict and detects changes
+    :return:
+    """
+    metadata = load_ttl("test_qualify_pass.ttl")
+    app = Application(
+        metadata=metadata,
+        app_name='app_test'
+    )
+    first_check = app.qualify(incremental=True) is True
+    # unchanged graph -> cached verdict
+    second_check = app.qualify(incremental=True) is True
+    # remove the point type -> the ahu does not have the mixed air temperature sensor anymore
+    bldg = Namespace("http://bldg-59#")
+    brick = Namespace("https://brickschema.org/schema/Brick#")
+    metadata.remove((bldg.MA_TEMP, RDF.type, brick.Mixed_Air_Temperature_Sensor))
+    third_check = app.qualify(incremental=True) is False
+
+    assert all([first_check, second_check, third_check]) is True
+
+
+def test_qualify_cache(tmp_path):
+    """
+    Test that a cache hit skips the validation
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test_qualify_fail.ttl"),
+        app_name='app_test'
+    )
+    cache = QualifyCache(cache_dir=str(tmp_path))
+    # store a fake result, the validation would return False
+    cache.put(cache.key(app.metadata, app.manifest), True, report='cached')
+    cache.put(cache.key(app.metadata, app.manifest, mode='incremental'), False, report='incremental')
+    res = app.qualify(cache=cache)
+    first_check = res is True and app.res_qualify_report == 'cached'
+
+    # the modes do not share the entries
+    res = app.qualify(incremental=True, cache=cache)
+    second_check = res is False and app.res_qualify_report == 'incremental'
+
+    assert all([first_check, second_check]) is True
+
+
+def test_validation_report(tmp_path):
+    """
+    Test that the qualify report is structured, bounded and survives the cache
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test_qualify_fail.ttl"),
+        app_name='app_test'
+    )
+    cache = QualifyCache(cache_dir=str(tmp_path))
+    app.qualify(cache=cache)
+    report = app.res_qualify_report
+    # the AHU misses the mixed air temperature sensor (manifest) and the point type (Brick)
+    first_check = not report.conforms and len(report) >= 2 and \
+        {result.focus_node for result in report} == {'http://bldg-59#AHU'}
+    second_check = report.summary(max_results=1).endswith(f'... {len(report) - 1} more results')
+    # the cached report is truncated but keeps the counts
+    app.qualify(cache=cache)
+    cached = app.res_qualify_report
+    third_check = isinstance(cached, ValidationReport) and cached.count_by('shape') == report.count_by('shape')
+    fourth_check = ValidationReport.aggregate([report, cached, None]) == \
+        report.count_by('shape') + cached.count_by('shape')
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_building_motif_session():
+    """
+    Test that the shared BuildingMOTIF session isolates the models of consecutive validations
+    :return:
+    """
+    session = get_building_motif_session()
+    manifest = os.path.join("test", "app", "app_test", "manifest.ttl")
+    results = []
+    for name in ["test_qualify_pass.ttl", "test_qualify_fail.ttl", "test_qualify_pass.ttl"]:
+        validation = BuildingMotifValidationInterface(
+            graph=load_ttl(name),
+            app_name='app_test',
+            manifest=manifest,
+            session=session
+        )
+        results.append(validation.validate())
+
+    assert results == [True, False, True]
+
+
+def test_manifest_imports(tmp_path):
+    """
+    Test that the combined and incremental validations resolve the BuildingMOTIF constraint library as BuildingMOTIF
+    :return:
+    """
+    graph = load_ttl("test_qualify_pass.ttl")
+    session = get_building_motif_session()
+    results = []
+    # BuildingMOTIF identifies the libraries by the ontology name, one per manifest
+    for count in [1, 2]:
+        manifest = str(tmp_path / f"manifest_{count}.ttl")
+        with open(manifest, 'w') as f:
+            f.write(f"""
+@prefix brick: <https://brickschema.org/schema/Brick#> .
+@prefix constraint: <https://nrel.gov/BuildingMOTIF/constraints#> .
+@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix : <urn:app_count_{count}/> .
+
+: a owl:Ontology ;
+    owl:imports <https://nrel.gov/BuildingMOTIF/constraints> .
+
+:ahus a sh:NodeShape ;
+    sh:targetNode : ;
+    constraint:class brick:AHU ;
+    constraint:exactCount {count} .
+""")
+        building_motif = BuildingMotifValidationInterface(graph=graph, app_name='app_count', manifest=manifest,
+                                                          session=session).validate()
+        combined = CombinedManifestValidationInterface({'app_count': manifest}).validate(graph)['app_count']
+        incremental = IncrementalValidationInterface(manifest).validate(graph)
+        results.append((building_motif, combined, incremental))
+
+    assert results == [(True, True, True), (False, False, False)]
+
+
+def test_combined_manifest_nodes(tmp_path):
+    """
+    Test that the combined validation renames only the shapes, so that the nodes declared by a manifest match the data
+    :return:
+    """
+    manifests = {'app_test': os.path.join("test", "app", "app_test", "manifest.ttl")}
+    for count in [1, 2]:
+        manifests[f'app_points_{count}'] = str(tmp_path / f"manifest_{count}.ttl")
+        with open(manifests[f'app_points_{count}'], 'w') as f:
+            f.write(f"""
+@prefix bldg: <http://bldg-59#> .
+@prefix brick: <https://brickschema.org/schema/Brick#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix : <urn:app_points_{count}/> .
+
+bldg:AHU rdfs:label "The AHU of the site" .
+
+:ahu-points a sh:NodeShape ;
+    sh:targetNode bldg:AHU ;
+    sh:property [ sh:path brick:hasPoint ; sh:minCount {count} ] .
+""")
+
+    res = CombinedManifestValidationInterface(manifests).validate(load_ttl("test_qualify_fail.ttl"))
+
+    assert res == {'app_test': False, 'app_points_1': True, 'app_points_2': False}
+
+
+def test_qualify_many(tmp_path):
+    """
+    Test that the batch qualification streams back one result per graph
+    :return:
+    """
+    paths = [os.path.join("test", "data", name) for name in ["test_qualify_pass.ttl", "test_qualify_fail.ttl"]]
+    # prefill the cache for the first graph only, the second one is validated by a worker
+    cache = QualifyCache(cache_dir=str(tmp_path))
+    manifest = os.path.join("app", "app_test", "manifest.ttl")
+    cache.put(cache.key(load_ttl(os.path.basename(paths[0])), manifest), True, ValidationReport().to_dict())
+    missing = str(tmp_path / "missing.ttl")
+
+    res, reports = {}, {}
+    for key, valid, report in qualify_many(paths + [missing], 'app_test', workers=2, cache=cache):
+        res[key], reports[key] = valid, report
+
+    first_check = res == {paths[0]: True, paths[1]: False, missing: False}
+    second_check = all(isinstance(report, ValidationReport) for report in reports.values())
+    third_check = len(reports[paths[1]]) > 0 and not reports[paths[1]].errors
+    fourth_check = len(reports[missing].errors) == 1 and not reports[missing].conforms
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_qualify_matrix():
+    """
+    Test that the qualification matrix has one row per app and one column per graph
+    :return:
+    """
+    paths = [os.path.join("test", "data", name) for name in ["test_qualify_pass.ttl", "test_qualify_fail.ttl"]]
+    matrix = qualify_matrix(paths, ['app_test'], basic_validation=False)
+
+    assert matrix.loc['app_test'].tolist() == [True, False]
+
+
+def test_ontology_shared():
+    """
+    Test that the Brick ontology is parsed once and shared across calls, and that the validations do not modify it
+    :return:
+    """
+    ontology_first = load_brick_ontology(read_only=False)
+    ontology_second = load_brick_ontology(read_only=False)
+    first_check = ontology_first is ontology_second and len(ontology_first) > 0
+
+    triples = len(ontology_first)
+    app = Application(
+        metadata=load_ttl("test_qualify_fail.ttl"),
+        app_name='app_test'
+    )
+    app.qualify()
+    second_check = len(ontology_first) == triples
+    # the view refuses the changes
+    with pytest.raises(ModificationException):
+        load_brick_ontology().add((URIRef('urn:a'), RDF.type, URIRef('urn:b')))
+
+    assert all([first_check, second_check]) is True
+
+
+def test_ontology_snapshot(tmp_path):
+    """
+    Test that the compiled ontology snapshot is private and that a snapshot not written by the package is not unpickled
+    :return:
+    """
+    path = str(tmp_path / 'ontology.ttl')
+    shutil.copy(os.path.join("test", "data", "test.ttl"), path)
+    cache_dir = str(tmp_path / 'cache')
+    graph = load_ontology(path, cache_dir=cache_dir, read_only=False)
+    snapshot = os.path.join(cache_dir, f'ontology.ttl.{file_digest(path)[:16]}.pickle')
+    first_check = os.path.exists(snapshot) and os.stat(snapshot).st_mode & 0o777 == 0o600
+
+    # replace the snapshot with an empty graph: it is not authenticated and the ontology is parsed again
+    with open(snapshot, 'r+b') as f:
+        f.seek(32)
+        f.write(pickle.dumps(Graph()))
+        f.truncate()
+    second_check = len(util_ontology._parse_ontology(path, file_digest(path), cache_dir)) == len(graph)
+
+    assert all([first_check, second_check]) is True
+
+
 def test_fetch_dict():
     """
     Test that the fetch returns dictionary
@@ -68,6 +355,141 @@ def test_fetch_dict():
     assert type(res) == type({})
 
 
+def test_fetch_init_bindings():
+    """
+    Test that the prepared query is reused and can be scoped with initial bindings
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test.ttl"),
+        app_name='app_test'
+    )
+    app.query = """
+    SELECT ?ahu ?point WHERE {
+        ?ahu a brick:AHU .
+        ?ahu brick:hasPoint ?point .
+    }
+    """
+    res_all = app.fetch()
+    res_scoped = app.fetch(init_bindings={'point': URIRef('http://bldg-59#MA_TEMP')})
+
+    assert prepare_query(app.query) is prepare_query(app.query)
+    assert len(res_all) > 1 and res_scoped == {0: {'ahu': 'AHU', 'point': 'MA_TEMP'}}
+
+
+def test_fetch_prefixes():
+    """
+    Test that the local names of the fetch follow the prefixes bound in the graph
+    :return:
+    """
+    graph = Graph()
+    graph.parse(data="""
+    @prefix brick: <https://brickschema.org/schema/Brick#> .
+    @prefix ahu: <urn:site/AHU_> .
+    @prefix point: <urn:site/points/> .
+
+    ahu:1 a brick:AHU ; brick:hasPoint point:MA_TEMP .
+    """, format='ttl')
+    app = Application(
+        metadata=graph,
+        app_name='app_test'
+    )
+    app.query = """
+    SELECT ?ahu ?point WHERE {
+        ?ahu a brick:AHU .
+        ?ahu brick:hasPoint ?point .
+    }
+    """
+
+    assert app.fetch() == {0: {'ahu': '1', 'point': 'MA_TEMP'}}
+
+
+def test_fetch_units():
+    """
+    Test that fetch returns the units of the points and that the remapped data is converted in one step
+    :return:
+    """
+    graph = load_ttl("test.ttl")
+    brick = Namespace('https://brickschema.org/schema/Brick#')
+    unit = Namespace('http://qudt.org/vocab/unit/')
+    graph.add((URIRef('http://bldg-59#MA_TEMP'), brick.hasUnit, unit.DEG_F))
+    # a point of another building with the same local name
+    graph.add((URIRef('http://bldg-60#MA_TEMP'), brick.hasUnit, unit.DEG_C))
+    app = Application(
+        metadata=graph,
+        app_name='app_test'
+    )
+    app.query = """
+    SELECT ?ahu ?t_mix WHERE {
+        ?ahu a brick:AHU .
+        ?ahu brick:hasPoint ?t_mix .
+    }
+    """
+    mapping, units = app.fetch(init_bindings={'t_mix': URIRef('http://bldg-59#MA_TEMP')}, with_units=True)
+    first_check = units == {'MA_TEMP': {'unit': 'DEG_F', 'datatype': None}}
+
+    df_mock = pd.DataFrame({'MA_TEMP': [32, 212], 'other': [1, 2]})
+    df_internal = app.remap(df_mock, mapping, mode='to_internal')
+    df_converted = app.convert(df_internal)
+    second_check = list(df_converted['t_mix']) == [0, 100] and list(df_converted['other']) == [1, 2]
+    third_check = list(app.convert(df_internal, targets={'t_mix': 'K'})['t_mix'].round(2)) == [273.15, 373.15]
+
+    assert all([first_check, second_check, third_check]) is True
+
+
+def test_fetch_columns(tmp_path):
+    """
+    Test that the fetch can return the mapping as columns, while remap and load keep working on the fetch result
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test.ttl"),
+        app_name='app_test'
+    )
+    app.query = """
+    SELECT ?ahu ?point WHERE {
+        ?ahu a brick:AHU .
+        ?ahu brick:hasPoint ?point .
+    }
+    """
+    res_dict = app.fetch()
+    res_columns = app.fetch(output='columns')
+    res_df = app.fetch(output='dataframe')
+
+    assert res_columns['point'] == [binding['point'] for binding in res_dict.values()]
+    assert res_df.shape == (len(res_dict), 2)
+
+    app.fetch(output='columns')
+    columns = [res_columns['ahu'][0], res_columns['point'][0]]
+    index = pd.date_range('2021-01-01', periods=4, freq='1h', name='timestamp')
+    df_mock = pd.DataFrame({name: range(4) for name in columns}, index=index, dtype=float)
+    df_mock.to_csv(tmp_path / 'data.csv')
+    first_check = list(app.remap(df_mock, app.res_fetch, mode='to_internal', binding=0).columns) == ['ahu', 'point']
+    second_check = sorted(app.load(str(tmp_path / 'data.csv'), binding=0, time_from=None, time_to=None).columns) == [
+        'ahu', 'point']
+
+    assert all([first_check, second_check]) is True
+
+
+def test_term_resolver():
+    """
+    Test the local names and CURIEs of hash, slash and urn namespaces
+    :return:
+    """
+    graph = load_ttl("test.ttl")
+    graph.add((URIRef('urn:site:ahu2'), RDF.type, URIRef('http://example.org/brick/AHU')))
+    resolver = TermResolver(graph.namespace_manager)
+
+    first_check = [resolver.local_name(URIRef(uri)) for uri in [
+        'http://bldg-59#AHU', 'urn:site:ahu2', 'http://example.org/brick/AHU']] == ['AHU', 'ahu2', 'AHU']
+    first_check = first_check and resolver.curie(URIRef('http://bldg-59#AHU')) == 'bldg:AHU'
+    # namespaces that are not bound must not raise
+    res = parse_results(graph.query("SELECT ?s ?o WHERE { ?s a ?o }"))
+    second_check = 'urn:site:ahu2' in [str(s) for s in res['s']]
+
+    assert all([first_check, second_check]) is True
+
+
 def test_remap():
     """
     Test that the fetch returns dictionary
@@ -95,6 +517,445 @@ def test_remap():
 
     assert all([first_check, second_check]) is True
 
+
+def test_remap_bindings():
+    """
+    Test the remap of a fetch result with several bindings
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test'
+    )
+    fetch_result = {0: {'ahu': 'AHU1', 't_mix': 'MA_TEMP1'}, 1: {'ahu': 'AHU2', 't_mix': 'MA_TEMP2'}}
+    df_mock = pd.DataFrame({'MA_TEMP1': [1, 2, 3], 'MA_TEMP2': [4, 5, 6], 'other': [0, 0, 0]})
+
+    df_to_internal = app.remap(data=df_mock, fetch_map_dict=fetch_result, mode='to_internal')
+    first_check = list(df_to_internal.columns) == ['t_mix', 't_mix', 'other']
+    df_to_external = app.remap(data=df_to_internal, fetch_map_dict=fetch_result, mode='to_external')
+    second_check = list(df_to_external.columns) == list(df_mock.columns)
+    df_binding = app.remap(data=df_mock, fetch_map_dict=fetch_result, mode='to_internal', binding=1)
+    third_check = list(df_binding.columns) == ['MA_TEMP1', 't_mix', 'other']
+    # the original dataframe is not renamed
+    fourth_check = list(df_mock.columns) == ['MA_TEMP1', 'MA_TEMP2', 'other']
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_stream(monkeypatch):
+    """
+    Test that streaming the data in chunks gives the same results of the whole dataset
+    :return:
+    """
+    stats = ApplicationStats()
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test',
+        stats=stats
+    )
+    functions = {
+        'preprocess_fn': lambda data: data.rolling(3).mean(),
+        'analyze_fn': lambda data: data['t_mix'].sum(),
+        'reduce_fn': lambda accumulator, result: accumulator + result,
+    }
+    monkeypatch.setattr(app, '_load_function', lambda module_name, function_name: functions.get(function_name))
+
+    index = pd.date_range('2024-01-01', periods=96, freq='1h')
+    df_mock = pd.DataFrame({'t_mix': range(96)}, index=index, dtype=float)
+    chunks = (df_mock.iloc[i:i + 10] for i in range(0, len(df_mock), 10))
+
+    df_stream = pd.concat(list(app.preprocess_stream(chunks, window='1D', overlap=2)))
+    first_check = df_stream.equals(df_mock.rolling(3).mean())
+
+    # without overlap each window is preprocessed on its own
+    windows = df_mock.groupby(index.floor('6h'))
+    second_check = app.analyze_stream(app.preprocess_stream(df_mock, window='6h')) == sum(
+        window['t_mix'].rolling(3).mean().sum() for _, window in windows)
+
+    # each chunk goes through preprocess and analyze
+    stages = Counter(record.stage for record in stats.records)
+    third_check = stages == Counter({'preprocess': 4 + 16, 'analyze': 16})
+    fourth_check = app.res_preprocess.equals(df_mock.iloc[-6:].rolling(3).mean())
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_load(tmp_path):
+    """
+    Test that only the columns of the mapping are loaded within the time range, with the internal names
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test'
+    )
+    fetch_result = {0: {'t_mix': 'MA_TEMP1', 'ahu': 'AHU1'}}
+    index = pd.date_range('2021-01-01', periods=48, freq='1h', name='timestamp')
+    df_mock = pd.DataFrame({'AHU1': 1.0, 'MA_TEMP1': range(48), 'other': 0.0}, index=index)
+    df_mock.to_csv(tmp_path / 'data.csv')
+
+    df_load = app.load(str(tmp_path / 'data.csv'), fetch_map_dict=fetch_result,
+                       time_from='2021-01-01T12:00:00Z', time_to='2021-01-02T00:00:00Z')
+    first_check = sorted(df_load.columns) == ['ahu', 't_mix']
+    second_check = list(df_load['t_mix']) == list(range(12, 25))
+
+    # the range defaults to the parameters of config.yaml (a single timestamp), None removes the bound
+    third_check = list(app.load(str(tmp_path / 'data.csv'), fetch_map_dict=fetch_result)['t_mix']) == [0]
+    df_load = app.load(str(tmp_path / 'data.csv'), fetch_map_dict=fetch_result, time_from=None, time_to=None)
+    fourth_check = list(df_load['t_mix']) == list(range(48))
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_preprocess_cache(tmp_path, monkeypatch):
+    """
+    Test that the preprocess cache is keyed by the input data and the parameters and reused across runs
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test'
+    )
+    calls = []
+
+    def preprocess_fn(data, aggregation='1h'):
+        calls.append(aggregation)
+        return data.resample(aggregation).mean()
+
+    monkeypatch.setattr(app, '_load_function', lambda module_name, function_name: preprocess_fn)
+    index = pd.date_range('2021-01-01', periods=48, freq='15min')
+    df_mock = pd.DataFrame({'t_mix': range(48)}, index=index, dtype=float)
+
+    key = PreprocessCache.key(preprocess_fn, (df_mock,), {}, app.parameters)
+    first_check = key == PreprocessCache.key(preprocess_fn, (df_mock.copy(),), {}, app.parameters)
+    second_check = key != PreprocessCache.key(preprocess_fn, (df_mock + 1,), {}, app.parameters)
+    third_check = key != PreprocessCache.key(preprocess_fn, (df_mock,), {'aggregation': '2h'}, app.parameters)
+    assert all([first_check, second_check, third_check]) is True
+
+    pytest.importorskip('pyarrow')
+    cache = PreprocessCache(cache_dir=str(tmp_path))
+    df_first = app.preprocess(df_mock, cache=cache)
+    df_second = app.preprocess(df_mock, cache=cache)
+
+    assert calls == ['1h'] and df_second.equals(df_first)
+
+    # the cached columns are views of the memory-mapped file
+    import pyarrow as pa
+    df_large = pd.DataFrame({'t_mix': np.arange(100_000, dtype=float)})
+    cache.put('large', df_large)
+    allocated = pa.total_allocated_bytes()
+    df_cached = cache.get('large')
+
+    assert df_cached.equals(df_large) and pa.total_allocated_bytes() - allocated < df_large['t_mix'].nbytes / 10
+
+
+def test_fingerprint():
+    """
+    Test that the fingerprint depends on the whole content of large arrays and rejects the values without a canonical
+    form
+    :return:
+    """
+    values = np.arange(10000.)
+    changed = values.copy()
+    changed[5000] += 1
+    first_check = fingerprint(values) != fingerprint(changed) and fingerprint(values) == fingerprint(values.copy())
+    second_check = fingerprint({'weights': values}) != fingerprint({'weights': changed})
+    third_check = fingerprint(values) != fingerprint(values.astype('float32')) and \
+        fingerprint(np.array(['a', 1], dtype=object)) != fingerprint(np.array(['a', 2], dtype=object))
+    with pytest.raises(TypeError):
+        fingerprint({'model': object()})
+
+    assert all([first_check, second_check, third_check]) is True
+
+
+def test_app_functions(tmp_path):
+    """
+    Test that the functions are loaded from the app folder of base_path, cached and reloaded when the source changes
+    :return:
+    """
+    app_path = tmp_path / 'app' / 'app_test'
+    shutil.copytree(os.path.join('test', 'app', 'app_test'), app_path)
+    (app_path / 'helper.py').write_text('OFFSET = 1\n')
+    (app_path / 'preprocess.py').write_text(
+        'from .helper import OFFSET\n\n\ndef preprocess_fn(x):\n    return x + OFFSET\n')
+
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test',
+        base_path=str(tmp_path)
+    )
+    first_check = app.preprocess(1) == 2
+
+    (app_path / 'preprocess.py').write_text('def preprocess_fn(x):\n    return x * 10\n')
+    mtime = os.stat(app_path / 'preprocess.py').st_mtime + 2
+    os.utime(app_path / 'preprocess.py', (mtime, mtime))
+    # the cached function is used until the app is reloaded
+    second_check = app.preprocess(1) == 2
+    app.reload()
+    third_check = app.preprocess(1) == 10
+
+    assert all([first_check, second_check, third_check]) is True
+
+
+def test_app_catalog(tmp_path):
+    """
+    Test that the app catalog indexes the app folder once and picks up the changes of the app files
+    :return:
+    """
+    app_path = tmp_path / 'app' / 'app_test'
+    shutil.copytree(os.path.join('test', 'app', 'app_test'), app_path)
+    catalog = AppCatalog(str(tmp_path / 'app'), refresh_interval=0)
+    app = Application(metadata=None, app_name='app_test', base_path=str(tmp_path), catalog=catalog)
+    first_check = catalog.names() == ['app_test'] and app.parameters['aggregation'] == '1h'
+
+    config = (app_path / 'config.yaml').read_text().replace('aggregation: 1h', 'aggregation: 15min')
+    (app_path / 'config.yaml').write_text(config)
+    mtime = os.stat(app_path / 'config.yaml').st_mtime + 2
+    os.utime(app_path / 'config.yaml', (mtime, mtime))
+    second_check = catalog.get('app_test').parameters['aggregation'] == '15min'
+
+    with pytest.raises(ValueError):
+        catalog.get('app_missing')
+
+    # the apps get their own copy of the nested parameters
+    (app_path / 'config.yaml').write_text(config.replace('aggregation: 15min',
+                                                         'aggregation: 15min\n  sensors:\n    - t_mix'))
+    os.utime(app_path / 'config.yaml', (mtime + 2, mtime + 2))
+    app = Application(metadata=None, app_name='app_test', base_path=str(tmp_path), catalog=catalog)
+    app.parameters['sensors'].append('t_out')
+    third_check = catalog.get('app_test').parameters['sensors'] == ['t_mix']
+
+    # a new app is visible right after the invalidation, within the refresh interval
+    shared = get_app_catalog(str(tmp_path / 'app'))
+    shared.names()
+    shutil.copytree(app_path, tmp_path / 'app' / 'app_new')
+    invalidate_app_catalog(str(tmp_path / 'app'))
+    fourth_check = shared.names() == ['app_new', 'app_test']
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_preprocess_toolkit():
+    """
+    Test the vectorized unit conversion, outlier masking, interpolation and resampling
+    :return:
+    """
+    index = pd.date_range('2021-01-01', periods=8, freq='15min')
+    df_mock = pd.DataFrame({'t_mix': [32, 50, 212, 68, 1000, 86, 104, 122.],
+                            'p_sup': [1, 2, None, None, 5, None, None, None]}, index=index)
+
+    df_converted = util_preprocess.convert_units(
+        df_mock, {'t_mix': 'http://qudt.org/vocab/unit/DEG_F', 'p_sup': 'unit:KiloPA'})
+    first_check = list(df_converted['t_mix'][:3]) == [0, 10, 100] and df_converted['p_sup'].iloc[0] == 1000
+
+    df_masked = util_preprocess.mask_outliers(df_mock, method='range', upper={'t_mix': 300})
+    df_interpolated = util_preprocess.interpolate(df_masked, limit=2)
+    second_check = df_interpolated['t_mix'].iloc[4] == 77 and list(df_interpolated['p_sup'][:5]) == [1, 2, 3, 4, 5]
+    # trailing missing values are not filled
+    third_check = df_interpolated['p_sup'][5:].isna().all()
+
+    df_resampled = util_preprocess.resample(df_interpolated, '1h', how='max')
+    fourth_check = list(df_resampled['t_mix']) == [212, 122]
+
+    # calendar frequencies
+    df_daily = pd.DataFrame({'t_mix': 1.0}, index=pd.date_range('2024-01-01', periods=60, freq='1D'))
+    fifth_check = (list(util_preprocess.resample(df_daily, 'MS', how='sum')['t_mix']) == [31, 29] and
+                   len(util_preprocess.resample(df_daily, 'W')) == 9)
+
+    assert all([first_check, second_check, third_check, fourth_check, fifth_check]) is True
+
+
+def test_async_pipeline(tmp_path, monkeypatch):
+    """
+    Test that the async pipeline reads the points of the mapping from the data source and runs the app functions
+    :return:
+    """
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test'
+    )
+    functions = {
+        'preprocess_fn': lambda data: data.resample('1h').mean(),
+        'analyze_fn': lambda data: data['t_mix'].max(),
+    }
+    monkeypatch.setattr(app, '_load_function', lambda module_name, function_name: functions.get(function_name))
+    app.res_fetch = {0: {'t_mix': 'MA_TEMP1', 'ahu': 'AHU1'}}
+
+    index = pd.date_range('2021-01-01', periods=8, freq='15min', name='timestamp')
+    pd.DataFrame({'AHU1': 1.0, 'MA_TEMP1': range(8), 'other': 0.0}, index=index).to_csv(tmp_path / 'data.csv')
+    pipeline = AsyncPipeline(app, FileDataSource(str(tmp_path)), max_concurrency=2)
+    # the file is parsed once for all the points
+    reads = []
+
+    def counted_read(path, columns, **kwargs):
+        reads.append(columns)
+        return read_csv_columns(path, columns, **kwargs)
+
+    monkeypatch.setattr(util_async, 'read_csv_columns', counted_read)
+
+    df_load = asyncio.run(pipeline.load(time_from=None, time_to='2021-01-01T01:00:00'))
+    first_check = sorted(df_load.columns) == ['ahu', 't_mix'] and len(df_load) == 5 and reads == [['MA_TEMP1', 'AHU1']]
+
+    async def run():
+        data = await pipeline.load(time_from=None, time_to='2021-01-01T01:00:00')
+        return await pipeline.analyze(await pipeline.preprocess(data))
+
+    second_check = asyncio.run(run()) == 4
+
+    assert all([first_check, second_check]) is True
+
+
+def test_benchmark_suite():
+    """
+    Test that the synthetic buildings match the generated mapping and that the benchmarks run and compare
+    :return:
+    """
+    graph = generator.generate_building(25)
+    app = Application(metadata=graph, app_name='app_test')
+    app.query = generator.BENCHMARK_QUERY
+    first_check = app.fetch(with_units=True) == generator.generate_mapping(25)
+
+    results = bench.run([10, 20], only=['fetch', 'remap'], repeat=1)
+    second_check = [(r['name'], r['size']) for r in results['results']] == [
+        ('fetch', 10), ('fetch', 20), ('remap', 10), ('remap', 20)]
+
+    third_check = all(row[2] == 1.0 for row in bench.compare(results, results))
+
+    assert all([first_check, second_check, third_check]) is True
+
+
+def test_stage_metrics(tmp_path):
+    """
+    Test that the components record their metrics in the stats of the app and that the metrics are exported
+    :return:
+    """
+    stats = ApplicationStats()
+    app = Application(
+        metadata=load_ttl("test.ttl"),
+        app_name='app_test',
+        stats=stats
+    )
+    app.query = """
+    SELECT ?ahu ?point WHERE {
+        ?ahu a brick:AHU .
+        ?ahu brick:hasPoint ?point .
+    }
+    """
+    mapping = app.fetch()
+    data = pd.DataFrame({'MA_TEMP': [1.0, 2.0], 'other': [0.0, 0.0]})
+    app.remap(data, mapping, mode='to_internal', binding=0)
+    with pytest.raises(AttributeError):
+        app.remap(None, mapping, mode='to_internal')
+
+    fetch, remap, remap_error = stats.records
+    first_check = (fetch.stage == 'fetch' and fetch.rows == len(mapping) and fetch.columns == 2 and
+                   fetch.triples_before == fetch.triples_after == len(app.metadata) and fetch.error is None)
+    second_check = (remap.rows, remap.columns, remap.wall_time >= 0) == (2, 2, True)
+    third_check = remap_error.error == 'AttributeError'
+
+    path = stats.write_prometheus(str(tmp_path / 'metrics' / 'app.prom'))
+    with open(path) as f:
+        exposition = f.read()
+    fourth_check = 'portable_app_stage_calls_total{app="app_test",stage="remap"} 2' in exposition
+    fifth_check = [span['status'] for span in stats.to_spans()] == ['OK', 'OK', 'ERROR']
+
+    assert all([first_check, second_check, third_check, fourth_check, fifth_check]) is True
+
+
+def test_profile(tmp_path, monkeypatch):
+    """
+    Test that the profiled app functions write their profiles and that the profiles are aggregated per app
+    :return:
+    """
+
+    def busy(seconds):
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            pass
+        return seconds
+
+    profiler = AppProfiler(str(tmp_path), mode='cprofile')
+    app = Application(
+        metadata=load_ttl("test_fetch_dict.ttl"),
+        app_name='app_test',
+        profiler=profiler
+    )
+    functions = {'preprocess_fn': lambda data: busy(data), 'analyze_fn': lambda data: busy(data)}
+    monkeypatch.setattr(app, '_load_function', lambda module_name, function_name: functions.get(function_name))
+
+    first_check = app.preprocess(0.05) == 0.05 and sorted(os.path.splitext(p)[1] for p in profiler.last_paths) == [
+        '.collapsed', '.pstats']
+
+    app.profiler = AppProfiler(str(tmp_path), mode='sampling', interval=0.001)
+    second_check = app.analyze(0.05) == 0.05 and len(app.profiler.last_paths) == 1
+
+    results = aggregate_profiles(str(tmp_path))
+    function, self_time, total_time, runs = results['app_test'][0]
+    third_check = function.startswith('busy') and runs == 2 and 0 < self_time <= total_time and total_time > 0.05
+    fourth_check = aggregate_profiles(str(tmp_path), stage='analyze')['app_test'][0][3] == 1
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_logger():
+    """
+    Test that the logging is configured once on the package logger, that the formatter does not modify the records and
+    that the disabled levels do not format their arguments, also after BuildingMOTIF is instantiated
+    :return:
+    """
+    root = logging.getLogger()
+    root_level, root_handlers = root.level, list(root.handlers)
+    CustomLogger().get_logger()
+    CustomLogger().get_logger()
+    first_check = len([h for h in logger.handlers if isinstance(h, (logging.StreamHandler, QueueHandler)) and
+                       getattr(h, '_portable_app_framework', False)]) == 1
+
+    record = logging.makeLogRecord({'msg': {'a': 1}, 'levelname': 'WARNING', 'levelno': logging.WARNING})
+    formatted = ColoredFormatter(fmt='%(levelname)s %(message)s').format(record)
+    second_check = record.msg == {'a': 1} and record.levelname == 'WARNING' and "{'a': 1}" in formatted
+
+    class Argument:
+        calls = 0
+
+        def __str__(self):
+            Argument.calls += 1
+            return 'argument'
+
+    stream = io.StringIO()
+    try:
+        configure_logging(level='WARNING', stream=stream, use_queue=True, force=True)
+        logger.debug('not formatted %s', Argument())
+        calls_disabled = Argument.calls
+        logger.warning('formatted %s', Argument())
+        flush_logging()
+    finally:
+        configure_logging(force=True)
+    third_check = calls_disabled == 0 and 'formatted argument' in stream.getvalue()
+
+    # BuildingMOTIF configures the root logger when instantiated
+    get_building_motif_session()
+    fourth_check = (root.level, root.handlers) == (root_level, root_handlers) and not any(
+        logging.getLogger(name).isEnabledFor(logging.DEBUG) for name in ['portable_app_framework', 'buildingmotif'])
+
+    assert all([first_check, second_check, third_check, fourth_check]) is True
+
+
+def test_import_time(tmp_path):
+    """
+    Test that importing the package is fast, does not load the heavy dependencies and does not write in the cwd
+    :return:
+    """
+    code = ("import sys, time; start = time.perf_counter(); import src.portable_app_framework; "
+            "print(time.perf_counter() - start); "
+            "print([m for m in ('pandas', 'rdflib', 'pyshacl', 'buildingmotif', 'inquirer') if m in sys.modules])")
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONPATH': os.getcwd()})
+    elapsed, modules = result.stdout.splitlines()
+
+    assert float(elapsed) < 1.0 and modules == '[]' and os.listdir(tmp_path) == []
+
+
+
 # def test_change_name():
 #     """
 #     Test that if name change the fetch doesnt fail